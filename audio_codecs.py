@@ -0,0 +1,181 @@
+"""
+Console Audio Codecs
+Playback codecs a console can negotiate for caller audio: 8kHz μ-law
+(what Twilio sends), 16kHz PCM16 (the default) or raw Opus packets from one
+continuous encoder per call, via libsndfile/soundfile when available
+"""
+import asyncio
+import logging
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+MULAW = "mulaw"
+PCM16 = "pcm16"
+OPUS = "opus"
+CODECS = (MULAW, PCM16, OPUS)
+
+# Opus packets are sent a few frames at a time rather than one message per 20ms
+OPUS_BATCH_MS = 200
+OPUS_SAMPLE_RATE = 16000
+
+# libsndfile SFC_SET_OGG_PAGE_LATENCY_MS (>= 1.2); the default ~1s pages would delay playback
+SFC_SET_OGG_PAGE_LATENCY_MS = 0x1302
+
+_opus_available: Optional[bool] = None
+
+
+def opus_available() -> bool:
+    """libsndfile built with Ogg/Opus support (soundfile >= 0.11, libsndfile >= 1.0.29)"""
+    global _opus_available
+    if _opus_available is None:
+        try:
+            import soundfile
+            _opus_available = "OPUS" in soundfile.available_subtypes("OGG")
+        except Exception:
+            _opus_available = False
+        if not _opus_available:
+            logger.info("Opus console audio unavailable (soundfile/libsndfile without Ogg Opus)")
+    return _opus_available
+
+
+def negotiate(requested: Optional[str]) -> str:
+    """Codec to use for a console's request, falling back to PCM16"""
+    codec = (requested or PCM16).lower()
+    if codec in ("ulaw", "pcmu", "mulaw"):
+        return MULAW
+    if codec == OPUS and opus_available():
+        return OPUS
+    return PCM16
+
+
+def audio_kind(codec: str) -> str:
+    """Topic kind for a codec's stream ("audio" stays PCM16 for existing consoles)"""
+    return "audio" if codec == PCM16 else f"audio.{codec}"
+
+
+def audio_topic(topic: str, codec: str) -> str:
+    """Rewrite an "audio:<key>" subscription to the negotiated codec's stream"""
+    kind, sep, key = topic.partition(":")
+    if kind == "audio" and sep:
+        return f"{audio_kind(codec)}:{key}"
+    return topic
+
+
+class _OggSink:
+    """Write-only file object for libsndfile that hands back the Ogg bytes written since the last take()"""
+
+    def __init__(self):
+        self._data = bytearray()
+        self._pos = 0
+
+    def write(self, data) -> int:
+        self._data += data
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        # The Ogg writer only appends; answer position queries
+        return self._pos
+
+    def read(self, size: int = -1) -> bytes:
+        return b""
+
+    def take(self) -> bytes:
+        data = bytes(self._data)
+        self._data.clear()
+        return data
+
+
+def ogg_packets(data: bytes, partial: bytes = b"") -> tuple:
+    """Split whole Ogg pages into packets; returns (packets, trailing partial packet)"""
+    packets = []
+    offset = 0
+    while offset + 27 <= len(data) and data[offset:offset + 4] == b"OggS":
+        segments = data[offset + 26]
+        lacing = data[offset + 27:offset + 27 + segments]
+        offset += 27 + segments
+        for size in lacing:
+            partial += data[offset:offset + size]
+            offset += size
+            if size < 255:
+                packets.append(partial)
+                partial = b""
+    return packets, partial
+
+
+class OpusStream:
+    """
+    One Opus encoder per call fed 16kHz PCM16; every OPUS_BATCH_MS it returns
+    the new 20ms packets. Packets come out of a single continuous stream, so
+    every console (including one joining mid-call) decodes them with `head`
+    (the OpusHead) instead of restarting a decoder per Ogg file
+    """
+
+    __slots__ = ("head", "_pcm", "_batch_bytes", "_sink", "_file", "_partial", "_headers")
+
+    def __init__(self):
+        self.head: Optional[bytes] = None
+        self._pcm = bytearray()
+        self._batch_bytes = OPUS_SAMPLE_RATE * OPUS_BATCH_MS // 1000 * 2
+        self._sink: Optional[_OggSink] = None
+        self._file = None
+        self._partial = b""
+        self._headers = 0
+
+    async def push(self, pcm16: bytes) -> Optional[List[bytes]]:
+        self._pcm += pcm16
+        if len(self._pcm) < self._batch_bytes:
+            return None
+        batch = bytes(self._pcm[:self._batch_bytes])
+        del self._pcm[:self._batch_bytes]
+        # libsndfile releases the GIL while encoding; keep it off the event loop
+        return await asyncio.to_thread(self._encode, batch)
+
+    def _open(self):
+        import soundfile
+
+        self._sink = _OggSink()
+        self._file = soundfile.SoundFile(self._sink, "w", OPUS_SAMPLE_RATE, 1, format="OGG", subtype="OPUS")
+        self._partial = b""
+        self._headers = 0
+        try:
+            latency = soundfile._ffi.new("double*", float(OPUS_BATCH_MS))
+            soundfile._snd.sf_command(self._file._file, SFC_SET_OGG_PAGE_LATENCY_MS, latency,
+                                      soundfile._ffi.sizeof("double"))
+        except Exception as e:
+            logger.debug(f"Ogg page latency not adjustable, Opus packets arrive in ~1s pages: {e}")
+
+    def _encode(self, pcm16: bytes) -> Optional[List[bytes]]:
+        try:
+            import numpy as np
+
+            if self._file is None:
+                self._open()
+            self._file.write(np.frombuffer(pcm16, dtype=np.int16))
+            packets, self._partial = ogg_packets(self._sink.take(), self._partial)
+        except Exception as e:
+            logger.error(f"Opus encode failed: {e}")
+            self.reset()
+            return None
+        # The stream opens with its OpusHead and OpusTags packets
+        while packets and self._headers < 2:
+            if self._headers == 0:
+                self.head = packets[0]
+            packets.pop(0)
+            self._headers += 1
+        return packets or None
+
+    def reset(self):
+        """Drop buffered audio and end the stream; the next push starts a new one"""
+        self._pcm.clear()
+        if self._file is not None:
+            try:
+                self._file.close()
+            except Exception:
+                pass
+        self._file = None
+        self._sink = None
@@ -0,0 +1,303 @@
+"""
+Per-call state and lifecycle
+A CallContext owns everything that belongs to one Twilio media stream and
+cancels/awaits all of its child tasks when the call ends
+"""
+import asyncio
+import logging
+import time
+import weakref
+from typing import Any, Coroutine, Dict, List, Optional
+
+from jitter import InboundJitterBuffer
+from mixer import CallMixer
+from replay import CallReplay
+
+logger = logging.getLogger(__name__)
+
+# Outbound (to phone) audio buffer per call - ~71 chunks per translated sentence on average
+OUTBOUND_QUEUE_SIZE = 500
+
+# Every CallContext ever created that hasn't been garbage collected yet
+_live_contexts: "weakref.WeakSet[CallContext]" = weakref.WeakSet()
+
+
+class CallContext:
+    """State for a single call: transcribers, outbound audio, recording, language and tasks"""
+
+    __slots__ = (
+        "call_sid",
+        "stream_sid",
+        "caller_number",
+        "metadata",
+        "phone_transcriber",
+        "browser_transcriber",
+        "language_identifier",
+        "outbound",
+        "outbound_epoch",
+        "utterances",
+        "held_utterances",
+        "recording",
+        "jitter",
+        "mixer",
+        "opus_stream",
+        "replay",
+        "caller_language",
+        "dispatcher_language",
+        "agency",
+        "started_at",
+        "ended_at",
+        "_task_group",
+        "_tasks",
+        "_closed",
+        "__weakref__",
+    )
+
+    def __init__(self, call_sid: str, caller_number: str, stream_sid: Optional[str] = None,
+                 metadata: Optional[Dict[str, Any]] = None):
+        self.call_sid = call_sid
+        self.stream_sid = stream_sid
+        self.caller_number = caller_number
+        self.metadata = metadata or {}
+        self.phone_transcriber = None  # CALLER leg (Twilio inbound audio)
+        self.browser_transcriber = None  # DISPATCH leg (browser microphone)
+        self.language_identifier = None
+        self.outbound: asyncio.Queue = asyncio.Queue(maxsize=OUTBOUND_QUEUE_SIZE)
+        self.outbound_epoch = 0  # Bumped on each barge-in hold
+        self.utterances: Dict[str, Dict[str, Any]] = {}  # TTS utterance_id -> text, audio and playback status
+        self.held_utterances: Optional[List[str]] = None  # TTS held back while the caller talks over it
+        self.recording: List[bytes] = []
+        self.jitter = InboundJitterBuffer()  # Reorders/conceals Twilio inbound frames
+        self.replay = CallReplay()  # Recent transcripts/mixed audio for consoles that join mid-call
+        # Caller + dispatcher monitoring stream for supervisors; also fills the replay audio
+        self.mixer = CallMixer(sink=self.replay.record_audio)
+        self.opus_stream = None  # Created when a console first asks for Opus
+        self.caller_language: Optional[str] = None
+        self.dispatcher_language: Optional[str] = None
+        self.agency: Optional[str] = None  # ems / fire / police, from early caller keywords
+        self.started_at = time.time()
+        self.ended_at: Optional[float] = None
+        self._task_group: Optional[asyncio.TaskGroup] = None
+        self._tasks: "weakref.WeakSet[asyncio.Task]" = weakref.WeakSet()
+        self._closed = False
+        _live_contexts.add(self)
+
+    def __repr__(self):
+        return f"<CallContext {self.call_sid} from {self.caller_number}{' closed' if self._closed else ''}>"
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    async def __aenter__(self):
+        self._task_group = asyncio.TaskGroup()
+        await self._task_group.__aenter__()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+        # Children are cancelled by close(); let the task group await them without
+        # wrapping the body's own exception (e.g. WebSocketDisconnect) in an ExceptionGroup
+        if self._task_group is not None:
+            await self._task_group.__aexit__(None, None, None)
+        return False
+
+    def spawn(self, coro: Coroutine, name: Optional[str] = None) -> Optional[asyncio.Task]:
+        """Run a child task that is cancelled and awaited when the call ends"""
+        if self._closed or self._task_group is None:
+            coro.close()
+            return None
+        task = self._task_group.create_task(self._guard(coro), name=name)
+        self._tasks.add(task)
+        return task
+
+    async def _guard(self, coro: Coroutine):
+        # A failing child must not tear down the rest of the call
+        try:
+            return await coro
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Task failed in call {self.call_sid}: {e}")
+
+    def queue_outbound(self, payload) -> bool:
+        """Queue μ-law audio (or a control dict) for the phone leg, dropping the oldest item if the buffer is full"""
+        try:
+            self.outbound.put_nowait(payload)
+            return True
+        except asyncio.QueueFull:
+            try:
+                self.outbound.get_nowait()
+                self.outbound.put_nowait(payload)
+                return True
+            except (asyncio.QueueEmpty, asyncio.QueueFull):
+                return False
+
+    def queue_mark(self, utterance_id: str) -> bool:
+        """
+        Queue a Twilio mark after an utterance's audio (echoed back once it has
+        played). The name carries the outbound epoch, so a replayed utterance's
+        mark can't be confused with the one cleared by the barge-in
+        """
+        return self.queue_outbound({"mark": f"{utterance_id}:{self.outbound_epoch}", "utterance_id": utterance_id})
+
+    def mark_utterance(self, name: Optional[str]) -> Optional[str]:
+        """Utterance a Twilio mark belongs to, or None if it was sent before the latest barge-in"""
+        utterance_id, _, epoch = (name or "").rpartition(":")
+        if not utterance_id or epoch != str(self.outbound_epoch):
+            return None
+        return utterance_id
+
+    def flush_outbound(self) -> List[str]:
+        """Drop everything queued for the phone; returns the utterances whose marks were never sent"""
+        dropped = []
+        while not self.outbound.empty():
+            item = self.outbound.get_nowait()
+            if isinstance(item, dict) and "mark" in item:
+                dropped.append(item["utterance_id"])
+        return dropped
+
+    def playing_utterances(self) -> List[str]:
+        """Utterances already handed to Twilio whose mark hasn't come back, i.e. audible right now"""
+        return [uid for uid, u in self.utterances.items() if u["status"] == "sent"]
+
+    def queue_utterance(self, utterance_id: Optional[str], frames: List[bytes]) -> int:
+        """Queue an utterance's μ-law frames and its mark; held instead while TTS is paused by a barge-in"""
+        if utterance_id and self.held_utterances is not None:
+            self.held_utterances.append(utterance_id)
+            return 0
+        queued = sum(1 for frame in frames if self.queue_outbound(frame))
+        if utterance_id:
+            # Twilio echoes the mark back once everything before it has played
+            self.queue_mark(utterance_id)
+        return queued
+
+    def hold_outbound(self, interrupted: List[str]) -> List[str]:
+        """
+        Barge-in: take queued TTS off the phone queue and hold it, after the
+        `interrupted` utterances, until resume_outbound(). Returns the held ids
+        """
+        self.outbound_epoch += 1
+        queued = self.flush_outbound()
+        held = self.held_utterances or []
+        held += [uid for uid in interrupted + queued if uid not in held]
+        self.held_utterances = held
+        return held
+
+    def resume_outbound(self) -> List[str]:
+        """Requeue held utterances in order, each from its start; returns the ids requeued"""
+        held, self.held_utterances = self.held_utterances or [], None
+        resumed = []
+        for uid in held:
+            utterance = self.utterances.get(uid)
+            if utterance and utterance.get("audio"):
+                self.queue_utterance(uid, utterance["audio"])
+                resumed.append(uid)
+        return resumed
+
+    async def close(self):
+        """Stop transcribers and cancel every child task (idempotent)"""
+        if self._closed:
+            return
+        self._closed = True
+        self.ended_at = time.time()
+
+        if self.language_identifier:
+            self.language_identifier.cancel()
+
+        for transcriber in (self.phone_transcriber, self.browser_transcriber):
+            if transcriber:
+                try:
+                    await transcriber.stop()
+                except Exception as e:
+                    logger.error(f"Error stopping {transcriber.speaker_label} transcriber: {e}")
+
+        for task in list(self._tasks):
+            if not task.done():
+                task.cancel()
+
+    def release(self):
+        """Drop references to heavy per-call objects once the call has been persisted"""
+        self.phone_transcriber = None
+        self.browser_transcriber = None
+        self.language_identifier = None
+        if self.opus_stream:
+            self.opus_stream.reset()
+        self.opus_stream = None
+        self.recording = []
+        self.utterances = {}
+        self.held_utterances = None
+        self.replay.clear()
+        while not self.outbound.empty():
+            self.outbound.get_nowait()
+
+    def pending_tasks(self) -> int:
+        return sum(1 for task in self._tasks if not task.done())
+
+
+class CallRegistry:
+    """Live calls indexed by call_sid, with a secondary index on caller number"""
+
+    def __init__(self):
+        self._by_sid: Dict[str, CallContext] = {}
+        self._by_number: Dict[str, List[str]] = {}
+
+    def __len__(self):
+        return len(self._by_sid)
+
+    def __contains__(self, call_sid):
+        return call_sid in self._by_sid
+
+    def add(self, call: CallContext):
+        self._by_sid[call.call_sid] = call
+        self._by_number.setdefault(call.caller_number, []).append(call.call_sid)
+
+    def remove(self, call: CallContext):
+        if self._by_sid.get(call.call_sid) is call:
+            del self._by_sid[call.call_sid]
+        sids = self._by_number.get(call.caller_number)
+        if sids and call.call_sid in sids:
+            sids.remove(call.call_sid)
+            if not sids:
+                del self._by_number[call.caller_number]
+
+    def get(self, call_sid: Optional[str]) -> Optional[CallContext]:
+        return self._by_sid.get(call_sid) if call_sid else None
+
+    def by_number(self, caller_number: str) -> Optional[CallContext]:
+        """Most recent live call from a number (several calls may share e.g. "unknown")"""
+        sids = self._by_number.get(caller_number)
+        return self._by_sid.get(sids[-1]) if sids else None
+
+    def all(self) -> List[CallContext]:
+        return list(self._by_sid.values())
+
+
+def find_leaks(grace_seconds: float = 30.0, collect: bool = False) -> List[Dict[str, Any]]:
+    """
+    Report contexts that are still alive (or still running tasks) after hangup.
+
+    A context is leaked when it ended more than `grace_seconds` ago and something
+    still holds a reference to it. Pass collect=True to run a full GC first so
+    unreachable reference cycles are not reported.
+    """
+    if collect:
+        import gc
+        gc.collect()
+
+    now = time.time()
+    leaks = []
+    for call in list(_live_contexts):
+        if call.ended_at is None or now - call.ended_at < grace_seconds:
+            continue
+        leaks.append({
+            "call_sid": call.call_sid,
+            "caller_number": call.caller_number,
+            "ended_seconds_ago": round(now - call.ended_at, 1),
+            "pending_tasks": call.pending_tasks(),
+        })
+    return leaks
+
+
+def live_context_count() -> int:
+    return len(_live_contexts)
@@ -0,0 +1,423 @@
+"""
+Priority Call Queue
+Orders waiting calls by waiting time plus an urgency score from early caller
+transcripts and offers each call to the least-loaded idle operator
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import re
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from config import config
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Seconds an operator has to accept an offered call before it is re-offered
+OFFER_TIMEOUT_SECONDS = float(config.get("CALL_OFFER_TIMEOUT_SECONDS", "15"))
+# An operator who declined (or let expire) an offer isn't offered that call again for this long,
+# unless they are the only one who could take it and the backoff has passed
+REOFFER_BACKOFF_SECONDS = float(config.get("CALL_REOFFER_BACKOFF_SECONDS", "30"))
+# Calls an operator can handle at once
+OPERATOR_MAX_CALLS = int(config.get("OPERATOR_MAX_CALLS", "1"))
+# One urgency point is worth this many seconds of waiting
+URGENCY_SECONDS_PER_POINT = float(config.get("URGENCY_SECONDS_PER_POINT", "15"))
+
+# Keyword -> (urgency points, agency). English plus common romanized Hindi.
+URGENCY_KEYWORDS: Dict[str, Tuple[int, Optional[str]]] = {
+    "not breathing": (10, "ems"),
+    "unconscious": (9, "ems"),
+    "heart attack": (9, "ems"),
+    "chest pain": (8, "ems"),
+    "bleeding": (7, "ems"),
+    "blood": (6, "ems"),
+    "khoon": (6, "ems"),
+    "accident": (6, "ems"),
+    "injured": (5, "ems"),
+    "pregnant": (5, "ems"),
+    "ambulance": (5, "ems"),
+    "fire": (8, "fire"),
+    "aag": (8, "fire"),
+    "smoke": (6, "fire"),
+    "explosion": (9, "fire"),
+    "gas leak": (8, "fire"),
+    "gun": (10, "police"),
+    "shot": (9, "police"),
+    "knife": (9, "police"),
+    "stabbed": (10, "police"),
+    "kidnap": (9, "police"),
+    "attack": (7, "police"),
+    "robbery": (7, "police"),
+    "chor": (5, "police"),
+    "help": (2, None),
+    "bachao": (5, None),
+    "emergency": (2, None),
+}
+_KEYWORD_PATTERN = re.compile(r"\b(" + "|".join(re.escape(k) for k in sorted(URGENCY_KEYWORDS, key=len, reverse=True)) + r")\b")
+
+queue_wait_seconds = registry.histogram(
+    "call_queue_wait_seconds", "Time from call arrival to operator assignment (or abandonment)",
+    buckets=(1, 2, 5, 10, 15, 20, 30, 45, 60, 90, 120, 300)
+)
+queue_offers = registry.counter("call_queue_offers_total", "Call offers sent to operators")
+
+
+def score_transcript(text: str) -> Tuple[int, Optional[str]]:
+    """Urgency points and most likely agency for a transcript fragment"""
+    best_points, agency = 0, None
+    for match in _KEYWORD_PATTERN.finditer(text.lower()):
+        points, keyword_agency = URGENCY_KEYWORDS[match.group(1)]
+        if points > best_points:
+            best_points = points
+            if keyword_agency:
+                agency = keyword_agency
+        elif keyword_agency and agency is None:
+            agency = keyword_agency
+    return best_points, agency
+
+
+@dataclass
+class QueuedCall:
+    call_sid: str
+    caller_number: str
+    enqueued_at: float
+    urgency: int = 0
+    agency: Optional[str] = None
+    version: int = 0
+    declined_by: Dict[str, float] = field(default_factory=dict)  # operator_id -> when they declined
+    offered_to: Optional[str] = None
+    assigned_to: Optional[str] = None
+
+    def priority(self) -> float:
+        # Smaller is served first: waiting time + urgency credit, as a static key
+        return self.enqueued_at - self.urgency * URGENCY_SECONDS_PER_POINT
+
+    def backing_off(self, now: float) -> Set[str]:
+        """Operators who declined this call within the re-offer backoff"""
+        return {op for op, declined_at in self.declined_by.items() if now - declined_at < REOFFER_BACKOFF_SECONDS}
+
+    def snapshot(self, now: float) -> dict:
+        return {
+            "call_sid": self.call_sid,
+            "caller_number": self.caller_number,
+            "urgency": self.urgency,
+            "agency": self.agency,
+            "waiting_seconds": round(now - self.enqueued_at, 1),
+            "offered_to": self.offered_to,
+            "assigned_to": self.assigned_to,
+        }
+
+
+@dataclass
+class Operator:
+    operator_id: str
+    send: Callable[[dict], Awaitable[None]]
+    active_calls: Set[str] = field(default_factory=set)
+    pending_offer: Optional[str] = None
+    last_assigned_at: float = 0.0
+    version: int = 0
+    online: bool = True
+
+    @property
+    def available(self) -> bool:
+        return self.online and self.pending_offer is None and len(self.active_calls) < OPERATOR_MAX_CALLS
+
+
+class CallQueue:
+    """
+    Waiting calls in a priority heap and operators in a least-loaded heap.
+
+    Both heaps use lazy invalidation (entries carry a version) so enqueue,
+    re-prioritisation and assignment are O(log n).
+    """
+
+    def __init__(self):
+        self.calls: Dict[str, QueuedCall] = {}
+        self.operators: Dict[str, Operator] = {}
+        self._call_heap: List[Tuple[float, int, str, int]] = []
+        self._operator_heap: List[Tuple[int, float, int, str, int]] = []
+        self._seq = itertools.count()
+        self._offer_timers: Dict[str, asyncio.TimerHandle] = {}
+        self._retry_timer: Optional[asyncio.TimerHandle] = None
+        registry.gauge("call_queue_depth", "Calls waiting for an operator", self.depth)
+        registry.gauge("operators_available", "Connected operators able to take a call",
+                       lambda: sum(1 for op in self.operators.values() if op.available))
+
+    # --- calls ---
+
+    def depth(self) -> int:
+        return sum(1 for c in self.calls.values() if c.assigned_to is None)
+
+    def _push_call(self, call: QueuedCall):
+        call.version += 1
+        heapq.heappush(self._call_heap, (call.priority(), next(self._seq), call.call_sid, call.version))
+
+    def enqueue(self, call_sid: str, caller_number: str):
+        """Add a new incoming call and try to offer it"""
+        if call_sid in self.calls:
+            return
+        call = QueuedCall(call_sid, caller_number, time.time())
+        self.calls[call_sid] = call
+        self._push_call(call)
+        self.dispatch()
+
+    def observe_transcript(self, call_sid: str, text: str) -> Optional[QueuedCall]:
+        """Raise a waiting call's urgency from early caller speech"""
+        call = self.calls.get(call_sid)
+        if not call or call.assigned_to:
+            return None
+        points, agency = score_transcript(text)
+        if agency and not call.agency:
+            call.agency = agency
+        if points > call.urgency:
+            call.urgency = points
+            if call.offered_to is None:
+                self._push_call(call)
+            logger.info(f"🚨 Urgency for {call_sid} raised to {points} ({call.agency or 'unclassified'})")
+        return call
+
+    def remove(self, call_sid: str):
+        """Call ended: drop it from the queue or release its operator"""
+        call = self.calls.pop(call_sid, None)
+        if not call:
+            return
+        self._cancel_offer_timer(call_sid)
+        if call.assigned_to is None:
+            queue_wait_seconds.observe(time.time() - call.enqueued_at, outcome="abandoned")
+        for operator_id in (call.offered_to, call.assigned_to):
+            operator = self.operators.get(operator_id) if operator_id else None
+            if operator:
+                operator.active_calls.discard(call_sid)
+                if operator.pending_offer == call_sid:
+                    operator.pending_offer = None
+                self._push_operator(operator)
+                self._forget_if_idle(operator)
+        self.dispatch()
+
+    def _pop_call(self) -> Optional[QueuedCall]:
+        while self._call_heap:
+            _, _, call_sid, version = heapq.heappop(self._call_heap)
+            call = self.calls.get(call_sid)
+            if call and call.version == version and call.assigned_to is None and call.offered_to is None:
+                return call
+        return None
+
+    # --- operators ---
+
+    def _push_operator(self, operator: Operator):
+        if self.operators.get(operator.operator_id) is not operator or not operator.available:
+            return
+        operator.version += 1
+        heapq.heappush(self._operator_heap, (
+            len(operator.active_calls), operator.last_assigned_at, next(self._seq),
+            operator.operator_id, operator.version
+        ))
+
+    def _pop_operator(self, exclude: Set[str]) -> Optional[Operator]:
+        skipped = []
+        found = None
+        while self._operator_heap:
+            entry = heapq.heappop(self._operator_heap)
+            operator = self.operators.get(entry[3])
+            if not operator or operator.version != entry[4] or not operator.available:
+                continue
+            if operator.operator_id in exclude:
+                skipped.append(entry)
+                continue
+            found = operator
+            break
+        for entry in skipped:
+            heapq.heappush(self._operator_heap, entry)
+        return found
+
+    def connect_operator(self, operator_id: str, send: Callable[[dict], Awaitable[None]]) -> Operator:
+        """Register an operator's notification socket (reconnect keeps their calls)"""
+        operator = self.operators.get(operator_id)
+        if operator:
+            operator.send = send
+            operator.online = True
+        else:
+            operator = self.operators[operator_id] = Operator(operator_id, send)
+        self._push_operator(operator)
+        logger.info(f"🎧 Operator {operator_id} online ({len(operator.active_calls)} active call(s))")
+        self.dispatch()
+        return operator
+
+    def disconnect_operator(self, operator_id: str, send: Optional[Callable] = None):
+        """
+        Operator's notification socket went away; pass `send` so a stale socket
+        can't drop a newer connection. They get no more offers until they
+        reconnect, but calls they already answered stay theirs: a dropped
+        socket doesn't mean a dropped call
+        """
+        operator = self.operators.get(operator_id)
+        if not operator or not operator.online or (send is not None and operator.send != send):
+            return
+        operator.online = False
+        if operator.pending_offer:
+            self._requeue(operator.pending_offer, operator_id)
+        logger.info(f"🎧 Operator {operator_id} offline ({len(operator.active_calls)} active call(s) kept)")
+        self._forget_if_idle(operator)
+        self.dispatch()
+
+    def release(self, call_sid: str, operator_id: str) -> bool:
+        """Operator handed an answered call back to the queue (e.g. transfer to another operator)"""
+        call = self.calls.get(call_sid)
+        operator = self.operators.get(operator_id)
+        if not call or not operator or call.assigned_to != operator_id:
+            return False
+        operator.active_calls.discard(call_sid)
+        call.assigned_to = None
+        self._push_call(call)
+        self._push_operator(operator)
+        logger.info(f"↩️ Operator {operator_id} released {call_sid} back to the queue")
+        self.dispatch()
+        return True
+
+    def _forget_if_idle(self, operator: Operator):
+        if not operator.online and not operator.active_calls and self.operators.get(operator.operator_id) is operator:
+            del self.operators[operator.operator_id]
+
+    # --- offers ---
+
+    def dispatch(self):
+        """Offer waiting calls to available operators, highest priority first"""
+        now = time.time()
+        deferred = []
+        while True:
+            call = self._pop_call()
+            if not call:
+                break
+            operator = self._pop_operator(set(call.declined_by))
+            if not operator and call.declined_by:
+                # Only operators who declined it are free: re-offer once their backoff has passed
+                operator = self._pop_operator(call.backing_off(now))
+            if operator:
+                self._offer(call, operator)
+            elif call.backing_off(now):
+                # Lower-priority calls may still go to the operator this one is backing off from
+                deferred.append(call)
+            else:
+                self._push_call(call)
+                break
+        for call in deferred:
+            self._push_call(call)
+        if deferred:
+            declined_at = min(call.declined_by[op] for call in deferred for op in call.backing_off(now))
+            self._schedule_retry(declined_at + REOFFER_BACKOFF_SECONDS - now)
+
+    def _schedule_retry(self, delay: float):
+        loop = asyncio.get_event_loop()
+        if self._retry_timer and self._retry_timer.when() <= loop.time() + delay:
+            return
+        if self._retry_timer:
+            self._retry_timer.cancel()
+        self._retry_timer = loop.call_later(delay, self._retry)
+
+    def _retry(self):
+        self._retry_timer = None
+        self.dispatch()
+
+    def _offer(self, call: QueuedCall, operator: Operator):
+        call.offered_to = operator.operator_id
+        operator.pending_offer = call.call_sid
+        queue_offers.inc()
+        message = {
+            "type": "call_offer",
+            "timeout": OFFER_TIMEOUT_SECONDS,
+            "timestamp": time.time(),
+            **call.snapshot(time.time()),
+        }
+        loop = asyncio.get_event_loop()
+        loop.create_task(self._send(operator, message))
+        self._offer_timers[call.call_sid] = loop.call_later(
+            OFFER_TIMEOUT_SECONDS, self._offer_expired, call.call_sid, operator.operator_id
+        )
+        logger.info(f"📨 Offered {call.call_sid} (urgency {call.urgency}) to operator {operator.operator_id}")
+
+    async def _send(self, operator: Operator, message: dict):
+        try:
+            await operator.send(message)
+        except Exception as e:
+            logger.error(f"❌ Failed to send offer to operator {operator.operator_id}: {e}")
+            self.disconnect_operator(operator.operator_id)
+
+    def _cancel_offer_timer(self, call_sid: str):
+        timer = self._offer_timers.pop(call_sid, None)
+        if timer:
+            timer.cancel()
+
+    def _offer_expired(self, call_sid: str, operator_id: str):
+        self._offer_timers.pop(call_sid, None)
+        call = self.calls.get(call_sid)
+        if call and call.offered_to == operator_id:
+            logger.info(f"⏰ Offer of {call_sid} to {operator_id} timed out, re-offering")
+            self._requeue(call_sid, operator_id)
+            self.dispatch()
+
+    def _requeue(self, call_sid: str, operator_id: str):
+        self._cancel_offer_timer(call_sid)
+        call = self.calls.get(call_sid)
+        operator = self.operators.get(operator_id)
+        if operator and operator.pending_offer == call_sid:
+            operator.pending_offer = None
+            self._push_operator(operator)
+        if call and call.offered_to == operator_id:
+            call.offered_to = None
+            call.declined_by[operator_id] = time.time()
+            self._push_call(call)
+
+    def accept(self, call_sid: str, operator_id: str) -> bool:
+        """Operator accepted an offered (or, if still waiting, any queued) call"""
+        call = self.calls.get(call_sid)
+        operator = self.operators.get(operator_id)
+        if not call or not operator or call.assigned_to:
+            return False
+        if call.offered_to and call.offered_to != operator_id:
+            return False
+
+        self._cancel_offer_timer(call_sid)
+        if call.offered_to is None:
+            call.version += 1  # invalidate its heap entry
+        call.offered_to = None
+        call.assigned_to = operator_id
+        if operator.pending_offer == call_sid:
+            operator.pending_offer = None
+        operator.active_calls.add(call_sid)
+        operator.last_assigned_at = time.time()
+        self._push_operator(operator)
+
+        wait = time.time() - call.enqueued_at
+        queue_wait_seconds.observe(wait, outcome="answered")
+        logger.info(f"✅ Operator {operator_id} took {call_sid} after {wait:.1f}s in queue")
+        self.dispatch()
+        return True
+
+    def decline(self, call_sid: str, operator_id: str):
+        call = self.calls.get(call_sid)
+        if call and call.offered_to == operator_id:
+            self._requeue(call_sid, operator_id)
+            self.dispatch()
+
+    def status(self) -> dict:
+        now = time.time()
+        waiting = sorted(
+            (c for c in self.calls.values() if c.assigned_to is None), key=lambda c: c.priority()
+        )
+        return {
+            "waiting": [c.snapshot(now) for c in waiting],
+            "operators": [
+                {
+                    "operator_id": op.operator_id,
+                    "active_calls": sorted(op.active_calls),
+                    "pending_offer": op.pending_offer,
+                    "available": op.available,
+                    "online": op.online,
+                }
+                for op in self.operators.values()
+            ],
+        }
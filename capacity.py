@@ -0,0 +1,164 @@
+"""
+Admission Control
+Tracks live load on this node against configurable budgets and decides whether
+a new call is connected here or routed to overflow (AI triage / hold queue)
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from config import config
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Capacity budgets (0 disables a budget)
+MAX_ACTIVE_CALLS = int(config.get("MAX_ACTIVE_CALLS", "25"))
+MAX_LOOP_LAG_MS = float(config.get("MAX_LOOP_LAG_MS", "250"))
+MAX_OUTBOUND_QUEUE_DEPTH = int(config.get("MAX_OUTBOUND_QUEUE_DEPTH", "400"))
+MAX_PROVIDER_LATENCY_MS = float(config.get("MAX_PROVIDER_LATENCY_MS", "4000"))
+
+# Provider latency is judged on the p95 of the last window, and only with enough samples;
+# old samples age out by wall clock so an overloaded (no new calls) node recovers on its own
+PROVIDER_LATENCY_WINDOW_SECONDS = float(config.get("PROVIDER_LATENCY_WINDOW_SECONDS", "60"))
+PROVIDER_LATENCY_MIN_SAMPLES = int(config.get("PROVIDER_LATENCY_MIN_SAMPLES", "5"))
+
+# Overflow routing: "triage" (ConversationRelay AI triage) or "queue" (Twilio hold queue)
+OVERFLOW_MODE = config.get("OVERFLOW_MODE", "triage")
+OVERFLOW_TRIAGE_URL = config.get("OVERFLOW_TRIAGE_URL", "")  # e.g. https://<triage-host>/twiml (online_text_speech.py)
+OVERFLOW_QUEUE_NAME = config.get("OVERFLOW_QUEUE_NAME", "overflow")
+OVERFLOW_WAIT_URL = config.get("OVERFLOW_WAIT_URL", "")  # Optional TwiML for hold music/announcements
+
+admission_decisions = registry.counter("call_admission_decisions_total", "Admission decisions for incoming calls")
+provider_latency_gauge = registry.gauge("provider_latency_ms", "Provider latency p95 over the recent window (ms)")
+
+
+@dataclass
+class AdmissionDecision:
+    admit: bool
+    route: str  # "accept", "triage" or "queue"
+    reasons: List[str] = field(default_factory=list)
+
+
+class CapacityManager:
+    """
+    Live load vs. budgets for this node.
+
+    `active_calls`, `outbound_depth` and `loop_lag_ms` are callables so the
+    manager reads the current call registry and the loop monitor instead of
+    keeping a second copy of them.
+    """
+
+    def __init__(self, active_calls: Callable[[], int], outbound_depth: Callable[[], int],
+                 loop_lag_ms: Callable[[], float] = lambda: 0.0):
+        self.active_calls = active_calls
+        self.outbound_depth = outbound_depth
+        self.loop_lag_ms = loop_lag_ms
+        self.provider_samples: Dict[str, Deque[Tuple[float, float]]] = {}  # provider -> (monotonic time, ms)
+        self.draining = False
+        self.drain_started_at: Optional[float] = None
+
+    def record_provider_latency(self, provider: str, seconds: float):
+        """Feed a provider round-trip time (translation, TTS, STT connect...)"""
+        self.provider_samples.setdefault(provider, deque()).append((time.monotonic(), seconds * 1000))
+        p95 = self.provider_latency_ms().get(provider)
+        if p95 is not None:
+            provider_latency_gauge.set(round(p95, 1), provider=provider)
+
+    def provider_latency_ms(self) -> Dict[str, float]:
+        """p95 per provider over the window; providers with too few recent samples are left out"""
+        cutoff = time.monotonic() - PROVIDER_LATENCY_WINDOW_SECONDS
+        latencies = {}
+        for provider, samples in self.provider_samples.items():
+            while samples and samples[0][0] < cutoff:
+                samples.popleft()
+            if len(samples) >= PROVIDER_LATENCY_MIN_SAMPLES:
+                ordered = sorted(ms for _, ms in samples)
+                latencies[provider] = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+        return latencies
+
+    def overload_reasons(self) -> List[str]:
+        """Budgets currently exceeded"""
+        reasons = []
+        if MAX_ACTIVE_CALLS and self.active_calls() >= MAX_ACTIVE_CALLS:
+            reasons.append("active_calls")
+        if MAX_LOOP_LAG_MS and self.loop_lag_ms() > MAX_LOOP_LAG_MS:
+            reasons.append("loop_lag")
+        if MAX_OUTBOUND_QUEUE_DEPTH and self.outbound_depth() > MAX_OUTBOUND_QUEUE_DEPTH:
+            reasons.append("outbound_queue")
+        if MAX_PROVIDER_LATENCY_MS:
+            slow = [p for p, ms in self.provider_latency_ms().items() if ms > MAX_PROVIDER_LATENCY_MS]
+            reasons.extend(f"provider_latency:{p}" for p in slow)
+        return reasons
+
+    def decide(self) -> AdmissionDecision:
+        """Admission decision for a new incoming call"""
+        reasons = ["draining"] if self.draining else self.overload_reasons()
+        if not reasons:
+            decision = AdmissionDecision(admit=True, route="accept")
+        else:
+            route = "triage" if OVERFLOW_MODE == "triage" and OVERFLOW_TRIAGE_URL else "queue"
+            decision = AdmissionDecision(admit=False, route=route, reasons=reasons)
+            logger.warning(f"🚦 Call routed to {route} overflow: {', '.join(reasons)}")
+        admission_decisions.inc(route=decision.route)
+        return decision
+
+    def overflow_twiml(self, decision: AdmissionDecision) -> str:
+        """TwiML for a call that is not admitted on this node"""
+        if decision.route == "triage":
+            return f"""<?xml version="1.0" encoding="UTF-8"?>
+        <Response>
+          <Redirect method="POST">{OVERFLOW_TRIAGE_URL}</Redirect>
+        </Response>"""
+
+        wait_url = f' waitUrl="{OVERFLOW_WAIT_URL}"' if OVERFLOW_WAIT_URL else ""
+        return f"""<?xml version="1.0" encoding="UTF-8"?>
+        <Response>
+          <Enqueue{wait_url}>{OVERFLOW_QUEUE_NAME}</Enqueue>
+        </Response>"""
+
+    def start_drain(self):
+        """Stop admitting new calls; live calls continue until they hang up"""
+        if not self.draining:
+            self.draining = True
+            self.drain_started_at = time.time()
+            logger.info(f"🚰 Drain started with {self.active_calls()} active call(s)")
+
+    def cancel_drain(self):
+        if self.draining:
+            self.draining = False
+            self.drain_started_at = None
+            logger.info("🚰 Drain cancelled, admitting calls again")
+
+    async def wait_drained(self, timeout: Optional[float] = None, poll_interval: float = 1.0) -> bool:
+        """Wait until every live call has ended (or timeout); True when drained"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.active_calls() > 0:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(poll_interval)
+        return True
+
+    def status(self) -> dict:
+        reasons = self.overload_reasons()
+        return {
+            "draining": self.draining,
+            "drain_started_at": self.drain_started_at,
+            "accepting": not self.draining and not reasons,
+            "overload_reasons": reasons,
+            "load": {
+                "active_calls": self.active_calls(),
+                "loop_lag_ms": round(self.loop_lag_ms(), 2),
+                "outbound_queue_depth": self.outbound_depth(),
+                "provider_latency_ms": {p: round(ms, 1) for p, ms in self.provider_latency_ms().items()},
+            },
+            "budgets": {
+                "max_active_calls": MAX_ACTIVE_CALLS,
+                "max_loop_lag_ms": MAX_LOOP_LAG_MS,
+                "max_outbound_queue_depth": MAX_OUTBOUND_QUEUE_DEPTH,
+                "max_provider_latency_ms": MAX_PROVIDER_LATENCY_MS,
+            },
+        }
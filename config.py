@@ -39,6 +39,68 @@ class ConfigManager:
             "RECORDINGS_DIR": os.getenv("RECORDINGS_DIR", "recordings"),
             "TRANSCRIPTS_DIR": os.getenv("TRANSCRIPTS_DIR", "transcripts"),
             "AUDIO_RATE": os.getenv("AUDIO_RATE", "16000"),
+            "LANGUAGE_ID_ENABLED": os.getenv("LANGUAGE_ID_ENABLED", "true"),
+            "LANGUAGE_ID_MODEL": os.getenv("LANGUAGE_ID_MODEL", "tiny"),
+            "LANGUAGE_ID_SECONDS": os.getenv("LANGUAGE_ID_SECONDS", "2.5"),
+            "LANGUAGE_ID_THRESHOLD": os.getenv("LANGUAGE_ID_THRESHOLD", "0.6"),
+            "LANGUAGE_ID_WORKERS": os.getenv("LANGUAGE_ID_WORKERS", "2"),
+            "MAX_ACTIVE_CALLS": os.getenv("MAX_ACTIVE_CALLS", "25"),
+            "MAX_LOOP_LAG_MS": os.getenv("MAX_LOOP_LAG_MS", "250"),
+            "MAX_OUTBOUND_QUEUE_DEPTH": os.getenv("MAX_OUTBOUND_QUEUE_DEPTH", "400"),
+            "MAX_PROVIDER_LATENCY_MS": os.getenv("MAX_PROVIDER_LATENCY_MS", "4000"),
+            "PROVIDER_LATENCY_WINDOW_SECONDS": os.getenv("PROVIDER_LATENCY_WINDOW_SECONDS", "60"),
+            "PROVIDER_LATENCY_MIN_SAMPLES": os.getenv("PROVIDER_LATENCY_MIN_SAMPLES", "5"),
+            "OVERFLOW_MODE": os.getenv("OVERFLOW_MODE", "triage"),
+            "OVERFLOW_TRIAGE_URL": os.getenv("OVERFLOW_TRIAGE_URL", ""),
+            "OVERFLOW_QUEUE_NAME": os.getenv("OVERFLOW_QUEUE_NAME", "overflow"),
+            "ADMIN_TOKEN": os.getenv("ADMIN_TOKEN", ""),
+            "CALL_OFFER_TIMEOUT_SECONDS": os.getenv("CALL_OFFER_TIMEOUT_SECONDS", "15"),
+            "CALL_REOFFER_BACKOFF_SECONDS": os.getenv("CALL_REOFFER_BACKOFF_SECONDS", "30"),
+            "OPERATOR_MAX_CALLS": os.getenv("OPERATOR_MAX_CALLS", "1"),
+            "REPLAY_TRANSCRIPT_EVENTS": os.getenv("REPLAY_TRANSCRIPT_EVENTS", "200"),
+            "REPLAY_AUDIO_SECONDS": os.getenv("REPLAY_AUDIO_SECONDS", "15"),
+            "INTERIM_TICK_MS": os.getenv("INTERIM_TICK_MS", "100"),
+            "CONSOLE_QUEUE_SIZE": os.getenv("CONSOLE_QUEUE_SIZE", "512"),
+            "VAD_ENABLED": os.getenv("VAD_ENABLED", "true"),
+            "VAD_MIN_RMS": os.getenv("VAD_MIN_RMS", "250"),
+            "VAD_HANGOVER_MS": os.getenv("VAD_HANGOVER_MS", "400"),
+            "JITTER_DEPTH_FRAMES": os.getenv("JITTER_DEPTH_FRAMES", "3"),
+            "OUTBOUND_BATCH_MS": os.getenv("OUTBOUND_BATCH_MS", "200"),
+            "MONITOR_FRAME_MS": os.getenv("MONITOR_FRAME_MS", "100"),
+            "MONITOR_CHANNELS": os.getenv("MONITOR_CHANNELS", "1"),
+            "LOOP_STALL_THRESHOLD_MS": os.getenv("LOOP_STALL_THRESHOLD_MS", "100"),
+            "BARGE_IN_ENABLED": os.getenv("BARGE_IN_ENABLED", "true"),
+            "BARGE_IN_MIN_SPEECH_MS": os.getenv("BARGE_IN_MIN_SPEECH_MS", "200"),
+            "BARGE_IN_HOLD_SECONDS": os.getenv("BARGE_IN_HOLD_SECONDS", "8"),
+            "PROFILE_MAX_SECONDS": os.getenv("PROFILE_MAX_SECONDS", "60"),
+            "PROFILE_SAMPLE_MS": os.getenv("PROFILE_SAMPLE_MS", "5"),
+            "TRACE_EXPORTER": os.getenv("TRACE_EXPORTER", "none"),
+            "TRACE_FILE": os.getenv("TRACE_FILE", "traces.jsonl"),
+            "OTLP_ENDPOINT": os.getenv("OTLP_ENDPOINT", "http://localhost:4318"),
+            "TRAINING_MODEL": os.getenv("TRAINING_MODEL", "gemini-2.5-flash"),
+            "TRAINING_MAX_CONCURRENT": os.getenv("TRAINING_MAX_CONCURRENT", "8"),
+            "TRAINING_TIMEOUT_SECONDS": os.getenv("TRAINING_TIMEOUT_SECONDS", "30"),
+            "TRAINING_POOL_SIZE": os.getenv("TRAINING_POOL_SIZE", "3"),
+            "TRAINING_POOL_REFILL_PER_MINUTE": os.getenv("TRAINING_POOL_REFILL_PER_MINUTE", "12"),
+            "TRAINING_POOL_FILE": os.getenv("TRAINING_POOL_FILE", "training_pool.json"),
+            "TRAINING_SCENARIOS_FILE": os.getenv("TRAINING_SCENARIOS_FILE", "911_calls.json"),
+            "SCENARIO_STORE_DIR": os.getenv("SCENARIO_STORE_DIR", "911_calls.store"),
+            "TRAINING_SESSION_DB": os.getenv("TRAINING_SESSION_DB", "training_sessions.db"),
+            "TRAINING_SESSION_TTL_SECONDS": os.getenv("TRAINING_SESSION_TTL_SECONDS", "3600"),
+            "TRAINING_SESSION_MAX": os.getenv("TRAINING_SESSION_MAX", "1000"),
+            "TRAINING_SESSION_RETENTION_DAYS": os.getenv("TRAINING_SESSION_RETENTION_DAYS", "7"),
+            "TRAINING_SESSION_FLUSH_SECONDS": os.getenv("TRAINING_SESSION_FLUSH_SECONDS", "1"),
+            "GRADING_MODEL": os.getenv("GRADING_MODEL", "gemini-2.5-flash"),
+            "GRADING_DB": os.getenv("GRADING_DB", "grading.db"),
+            "GRADING_CONCURRENCY": os.getenv("GRADING_CONCURRENCY", "4"),
+            "GRADING_REQUESTS_PER_MINUTE": os.getenv("GRADING_REQUESTS_PER_MINUTE", "60"),
+            "GRADING_TIMEOUT_SECONDS": os.getenv("GRADING_TIMEOUT_SECONDS", "60"),
+            "MEMORY_TOKEN_BUDGET": os.getenv("MEMORY_TOKEN_BUDGET", "2000"),
+            "MEMORY_KEEP_TURNS": os.getenv("MEMORY_KEEP_TURNS", "3"),
+            "MEMORY_SUMMARY_MODEL": os.getenv("MEMORY_SUMMARY_MODEL", "gemini-2.5-flash-lite"),
+            "PROMPT_CACHE_TTL_SECONDS": os.getenv("PROMPT_CACHE_TTL_SECONDS", "3600"),
+            "MONITOR_QUEUE_SIZE": os.getenv("MONITOR_QUEUE_SIZE", "256"),
+            "MONITOR_REPLAY_EVENTS": os.getenv("MONITOR_REPLAY_EVENTS", "500"),
             "VITE_MAPBOX_TOKEN": os.getenv("VITE_MAPBOX_TOKEN", "") # Frontend setting we might want to persist
         }
 
@@ -0,0 +1,179 @@
+"""
+Conversation Memory
+Bounded model context for long AI-handled calls. Recent turns are sent
+verbatim; once they exceed a token budget the oldest exchanges are folded into
+structured case notes (location, nature, caller, ...) by a background
+summarization call, so the reply path never waits on it. The static system
+prompt goes through Gemini context caching when the model accepts it
+"""
+import asyncio
+import json
+import logging
+import time
+from typing import List, Optional, Tuple
+
+from config import config
+from prompts import CALL_SUMMARY_PROMPT
+
+logger = logging.getLogger(__name__)
+
+MEMORY_TOKEN_BUDGET = int(config.get("MEMORY_TOKEN_BUDGET", "2000"))
+MEMORY_KEEP_TURNS = int(config.get("MEMORY_KEEP_TURNS", "3"))
+MEMORY_SUMMARY_MODEL = config.get("MEMORY_SUMMARY_MODEL", "gemini-2.5-flash-lite")
+PROMPT_CACHE_TTL_SECONDS = int(config.get("PROMPT_CACHE_TTL_SECONDS", "3600"))
+
+# Rough tokens-per-character for budgeting without a tokenizer round trip
+CHARS_PER_TOKEN = 4
+# Past this multiple of the budget the oldest turns are dropped even if no summary is ready yet
+HARD_LIMIT_FACTOR = 3
+# Don't retry creating the prompt cache more often than this after it fails
+PROMPT_CACHE_RETRY_SECONDS = 600
+# Nor summarizing a call's oldest turns, so a failing model isn't hit on every exchange
+SUMMARY_RETRY_SECONDS = 30
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+class ConversationMemory:
+    """
+    Per-call history as (caller, assistant) exchanges plus rolling case notes.
+    contents() builds the request; add() records a finished exchange and may
+    start a background fold of the oldest exchanges into the notes
+    """
+
+    def __init__(self, client, token_budget: int = MEMORY_TOKEN_BUDGET, keep_turns: int = MEMORY_KEEP_TURNS,
+                 summary_model: str = MEMORY_SUMMARY_MODEL):
+        self.client = client
+        self.token_budget = token_budget
+        self.keep_turns = keep_turns
+        self.summary_model = summary_model
+        self.exchanges: List[Tuple[str, str]] = []
+        self.notes: Optional[dict] = None
+        self.folded = 0  # exchanges already merged into the notes
+        self._task: Optional[asyncio.Task] = None
+        self._retry_at = 0.0
+
+    def tokens(self) -> int:
+        notes = estimate_tokens(json.dumps(self.notes)) if self.notes else 0
+        return notes + sum(estimate_tokens(user) + estimate_tokens(model) for user, model in self.exchanges)
+
+    def contents(self, user_prompt: str) -> list:
+        """Request contents: case notes (if any), recent exchanges verbatim, then the new caller turn"""
+        from google.genai import types
+        contents = []
+        for user, model in self.exchanges:
+            contents.append(types.Content(role="user", parts=[types.Part(text=user)]))
+            contents.append(types.Content(role="model", parts=[types.Part(text=model)]))
+        contents.append(types.Content(role="user", parts=[types.Part(text=user_prompt)]))
+        if self.notes:
+            # Notes ride on the first user turn so roles still alternate
+            first = contents[0].parts[0].text
+            notes = json.dumps(self.notes, ensure_ascii=False)
+            contents[0] = types.Content(role="user", parts=[types.Part(
+                text=f"[Case notes from earlier in this call: {notes}]\n\n{first}")])
+        return contents
+
+    def add(self, user_prompt: str, response: str):
+        self.exchanges.append((user_prompt, response))
+        if self.tokens() <= self.token_budget or len(self.exchanges) <= self.keep_turns:
+            return
+        summarizing = self._task is not None and not self._task.done()
+        if not summarizing and time.monotonic() >= self._retry_at:
+            fold = len(self.exchanges) - self.keep_turns
+            self._task = asyncio.create_task(self._fold(fold))
+        elif self.tokens() > self.token_budget * HARD_LIMIT_FACTOR:
+            # The summarizer is behind or backing off after a failure; bound the request size regardless
+            dropped = self.exchanges.pop(0)
+            logger.warning(f"⚠️ Dropped an unsummarized exchange to stay under the context limit: {dropped[0][:60]!r}")
+
+    async def _fold(self, count: int):
+        """Merge the oldest `count` exchanges into the notes, then drop them from the verbatim history"""
+        from google.genai import types
+        batch = self.exchanges[:count]
+        turns = "\n".join(f"Caller: {user}\nAssistant: {model}" for user, model in batch)
+        prompt = CALL_SUMMARY_PROMPT.format(notes=json.dumps(self.notes or {}, ensure_ascii=False), turns=turns)
+        started = time.perf_counter()
+        try:
+            response = await self.client.aio.models.generate_content(
+                model=self.summary_model, contents=prompt,
+                config=types.GenerateContentConfig(response_mime_type="application/json", temperature=0),
+            )
+            notes = json.loads(response.text)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._retry_at = time.monotonic() + SUMMARY_RETRY_SECONDS
+            logger.error(f"❌ Call summarization failed, keeping turns verbatim (retrying in {SUMMARY_RETRY_SECONDS}s): {e}")
+            return
+        # Exchanges may have been dropped by the hard limit meanwhile; only remove what is still there
+        for exchange in batch:
+            if self.exchanges and self.exchanges[0] == exchange:
+                self.exchanges.pop(0)
+                self.folded += 1
+        self.notes = notes
+        logger.info(f"🧠 Folded {count} exchanges into case notes in {(time.perf_counter() - started) * 1000:.0f}ms "
+                    f"(~{self.tokens()} context tokens now)")
+
+    def close(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+
+    def stats(self) -> dict:
+        return {"context_tokens": self.tokens(), "verbatim_turns": len(self.exchanges), "folded_turns": self.folded}
+
+
+class PromptCache:
+    """
+    Explicit Gemini context cache for a static system prompt, recreated before
+    it expires. Models reject caches below their minimum size; then (and after
+    any failure) requests carry the prompt inline and rely on implicit caching
+    """
+
+    def __init__(self, client, model: str, system_prompt: str, ttl: int = PROMPT_CACHE_TTL_SECONDS):
+        self.client = client
+        self.model = model
+        self.system_prompt = system_prompt
+        self.ttl = ttl
+        self.name: Optional[str] = None
+        self._expires = 0.0
+        self._retry_at = 0.0
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    async def _refresh(self):
+        from google.genai import types
+        async with self._lock:
+            now = time.monotonic()
+            if self.name and now < self._expires or now < self._retry_at:
+                return
+            try:
+                cache = await self.client.aio.caches.create(
+                    model=self.model,
+                    config=types.CreateCachedContentConfig(system_instruction=self.system_prompt,
+                                                           ttl=f"{self.ttl}s", display_name="system-prompt"),
+                )
+                self.name = cache.name
+                # Refresh a minute early so no request races the expiry
+                self._expires = now + self.ttl - 60
+                logger.info(f"🗄️ System prompt cached as {self.name}")
+            except Exception as e:
+                self.invalidate()
+                self._retry_at = now + PROMPT_CACHE_RETRY_SECONDS
+                logger.warning(f"⚠️ System prompt not cached, sending it inline: {e}")
+
+    def invalidate(self):
+        self.name = None
+        self._expires = 0.0
+
+    def generation_config(self, **settings):
+        """GenerateContentConfig using the cached prompt when available, else the inline system instruction"""
+        from google.genai import types
+        now = time.monotonic()
+        if now >= self._expires and now >= self._retry_at and not self._lock.locked():
+            # Created off the reply path; this turn goes inline if there is no live cache
+            self._task = asyncio.create_task(self._refresh())
+        if self.name and now < self._expires + 60:
+            return types.GenerateContentConfig(cached_content=self.name, **settings)
+        return types.GenerateContentConfig(system_instruction=self.system_prompt, **settings)
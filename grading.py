@@ -0,0 +1,318 @@
+"""
+Batch Grading
+Scores recorded call transcripts (TRANSCRIPTS_DIR) and completed training
+sessions against the dispatcher rubric, concurrently on a bounded worker pool
+under a requests-per-minute limit. The model returns structured JSON per rubric
+category; results are cached by transcript content hash in a SQLite table, so
+re-running over the same shift only grades what is new
+
+    python grading.py run --transcripts transcripts --sessions training_sessions.db
+    python grading.py report
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from config import config
+from prompts import BATCH_GRADING_PROMPT
+
+logger = logging.getLogger(__name__)
+
+GRADING_MODEL = config.get("GRADING_MODEL", "gemini-2.5-flash")
+GRADING_DB = config.get("GRADING_DB", "grading.db")
+GRADING_CONCURRENCY = int(config.get("GRADING_CONCURRENCY", "4"))
+GRADING_REQUESTS_PER_MINUTE = float(config.get("GRADING_REQUESTS_PER_MINUTE", "60"))
+GRADING_TIMEOUT_SECONDS = float(config.get("GRADING_TIMEOUT_SECONDS", "60"))
+GRADING_RETRIES = 2
+
+# (key, label, max points) - same weights as the live TRAINING_GRADING_PROMPT
+RUBRIC: List[Tuple[str, str, int]] = [
+    ("information_gathering", "Information Gathering", 25),
+    ("communication_clarity", "Communication Clarity", 20),
+    ("response_speed", "Response Speed & Efficiency", 15),
+    ("calmness", "Calmness & Composure", 15),
+    ("empathy", "Empathy & Reassurance", 10),
+    ("protocol_adherence", "Protocol Adherence", 10),
+    ("problem_solving", "Problem-Solving", 5),
+]
+# Bump when the rubric or prompt changes so cached grades are not reused
+RUBRIC_VERSION = 1
+
+TRANSCRIPT_FILE = re.compile(r"^transcript_(caller|dispatch)_(.+)\.txt$")
+TRANSCRIPT_LINE_TIME = re.compile(r"^\[(\d{2}:\d{2}:\d{2})\]")
+
+
+# ---- sources ----
+
+def _line_time(line: str) -> str:
+    match = TRANSCRIPT_LINE_TIME.match(line)
+    return match.group(1) if match else ""
+
+
+def transcript_items(transcripts_dir: str) -> List[Tuple[str, str, str]]:
+    """(source, item_id, text) per recorded call, merging the caller and dispatch files of each call"""
+    calls: Dict[str, List[str]] = {}
+    for name in sorted(os.listdir(transcripts_dir)):
+        if not name.endswith(".txt"):
+            continue
+        match = TRANSCRIPT_FILE.match(name)
+        call_id = match.group(2) if match else name[:-4]
+        with open(os.path.join(transcripts_dir, name), "r", encoding="utf-8") as f:
+            calls.setdefault(call_id, []).extend(line for line in f.read().splitlines() if line.strip())
+    items = []
+    for call_id, lines in calls.items():
+        # Both legs stamp lines [HH:MM:SS]; a stable sort interleaves them into one conversation
+        lines.sort(key=_line_time)
+        items.append(("call", call_id, "\n".join(lines)))
+    return items
+
+
+def session_items(sessions_db: str) -> List[Tuple[str, str, str]]:
+    """(source, item_id, text) per completed training session in the session store's database"""
+    conn = sqlite3.connect(sessions_db)
+    try:
+        rows = conn.execute("SELECT session_id, data FROM training_sessions WHERE status = 'completed'").fetchall()
+    finally:
+        conn.close()
+    items = []
+    for session_id, data in rows:
+        session = json.loads(data)
+        title = (session.get("scenario") or {}).get("title", "Unknown Emergency")
+        lines = [f"Incident: {title}"]
+        for entry in session.get("conversation", []):
+            sender = "Dispatcher" if entry.get("sender") == "Dispatch" else entry.get("sender", "Caller")
+            lines.append(f"{sender}: {entry.get('message', '')}")
+        items.append(("training", session_id, "\n".join(lines)))
+    return items
+
+
+# ---- results table ----
+
+class GradeDB:
+    """grades (one row per graded content hash), grade_categories (per rubric category) and graded_items (source/id -> hash)"""
+
+    def __init__(self, path: str = GRADING_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS grades (
+                content_hash TEXT PRIMARY KEY, model TEXT, score REAL, result TEXT, graded_at REAL);
+            CREATE TABLE IF NOT EXISTS grade_categories (
+                content_hash TEXT, category TEXT, score INTEGER, max_points INTEGER,
+                PRIMARY KEY (content_hash, category));
+            CREATE TABLE IF NOT EXISTS graded_items (
+                source TEXT, item_id TEXT, content_hash TEXT, seen_at REAL,
+                PRIMARY KEY (source, item_id));
+            CREATE INDEX IF NOT EXISTS grades_graded_at ON grades (graded_at);
+        """)
+        self.conn.commit()
+
+    def cached(self, hashes: Iterable[str]) -> set:
+        hashes = list(hashes)
+        found = set()
+        with self._lock:
+            for i in range(0, len(hashes), 500):
+                chunk = hashes[i:i + 500]
+                placeholders = ",".join("?" * len(chunk))
+                found.update(row[0] for row in self.conn.execute(
+                    f"SELECT content_hash FROM grades WHERE content_hash IN ({placeholders})", chunk))
+        return found
+
+    def link(self, items: List[Tuple[str, str, str]]):
+        """Point each (source, item_id) at the grade for its current content"""
+        now = time.time()
+        with self._lock, self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO graded_items VALUES (?, ?, ?, ?)",
+                                  [(source, item_id, content_hash, now) for source, item_id, content_hash in items])
+
+    def save(self, content_hash: str, model: str, grade: dict):
+        with self._lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO grades VALUES (?, ?, ?, ?, ?)",
+                              (content_hash, model, grade["score"], json.dumps(grade, ensure_ascii=False), time.time()))
+            self.conn.executemany("INSERT OR REPLACE INTO grade_categories VALUES (?, ?, ?, ?)", [
+                (content_hash, key, category["score"], category["max_points"])
+                for key, category in grade["categories"].items()
+            ])
+
+    def report(self, since: Optional[float] = None) -> dict:
+        since = since or 0
+        sources = self.conn.execute(
+            "SELECT i.source, COUNT(*), ROUND(AVG(g.score), 1), MIN(g.score), MAX(g.score) "
+            "FROM graded_items i JOIN grades g USING (content_hash) WHERE i.seen_at >= ? GROUP BY i.source", (since,)
+        ).fetchall()
+        categories = self.conn.execute(
+            "SELECT c.category, ROUND(AVG(100.0 * c.score / c.max_points), 1) "
+            "FROM graded_items i JOIN grade_categories c USING (content_hash) WHERE i.seen_at >= ? "
+            "GROUP BY c.category ORDER BY 2", (since,)
+        ).fetchall()
+        return {
+            "sources": {source: {"count": count, "avg": avg, "min": low, "max": high}
+                        for source, count, avg, low, high in sources},
+            "category_avg_percent": dict(categories),
+        }
+
+    def close(self):
+        self.conn.close()
+
+
+# ---- grading ----
+
+def content_hash(text: str, model: str) -> str:
+    return hashlib.sha256(f"{RUBRIC_VERSION}\n{model}\n{text.strip()}".encode("utf-8")).hexdigest()
+
+
+def parse_grade(raw: str) -> dict:
+    """Validate the model's JSON against the rubric; the total is computed here, not trusted from the model"""
+    data = json.loads(raw)
+    returned = data.get("categories") or {}
+    categories = {}
+    for key, label, max_points in RUBRIC:
+        entry = returned.get(key) or {}
+        try:
+            score = int(round(float(entry.get("score", 0))))
+        except (TypeError, ValueError):
+            score = 0
+        categories[key] = {
+            "label": label,
+            "score": max(0, min(max_points, score)),
+            "max_points": max_points,
+            "comment": str(entry.get("comment", "")),
+        }
+    total = sum(c["score"] for c in categories.values())
+    return {
+        "score": round(100.0 * total / sum(m for _, _, m in RUBRIC), 1),
+        "categories": categories,
+        "strengths": list(data.get("strengths") or []),
+        "improvements": list(data.get("improvements") or []),
+        "summary": str(data.get("summary", "")),
+    }
+
+
+class RateLimiter:
+    """Spaces request starts evenly to stay under a provider requests-per-minute quota"""
+
+    def __init__(self, per_minute: float):
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class BatchGrader:
+    def __init__(self, client, db: GradeDB, model: str = GRADING_MODEL, concurrency: int = GRADING_CONCURRENCY,
+                 requests_per_minute: float = GRADING_REQUESTS_PER_MINUTE, timeout: float = GRADING_TIMEOUT_SECONDS):
+        self.client = client
+        self.db = db
+        self.model = model
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.limiter = RateLimiter(requests_per_minute)
+        self._rubric = "\n".join(f"- {key} ({label}): 0-{max_points}" for key, label, max_points in RUBRIC)
+
+    async def grade_text(self, text: str) -> dict:
+        from google.genai import types
+        prompt = BATCH_GRADING_PROMPT.format(rubric=self._rubric, transcript=text)
+        generation = types.GenerateContentConfig(response_mime_type="application/json", temperature=0)
+        for attempt in range(GRADING_RETRIES + 1):
+            await self.limiter.wait()
+            try:
+                async with asyncio.timeout(self.timeout):
+                    response = await self.client.aio.models.generate_content(
+                        model=self.model, contents=prompt, config=generation)
+                return parse_grade(response.text)
+            except Exception as e:
+                if attempt == GRADING_RETRIES:
+                    raise
+                logger.warning(f"⚠️ Grading attempt {attempt + 1} failed ({e}), retrying")
+                await asyncio.sleep(2 ** attempt * 5)
+
+    async def run(self, items: List[Tuple[str, str, str]]) -> dict:
+        """Grade (source, item_id, text) items not already cached; returns a run summary"""
+        started = time.perf_counter()
+        hashed = [(source, item_id, text, content_hash(text, self.model)) for source, item_id, text in items if text.strip()]
+        cached = self.db.cached(h for *_, h in hashed)
+        self.db.link([(source, item_id, h) for source, item_id, _, h in hashed if h in cached])
+
+        # Identical transcripts (e.g. a re-exported call) are graded once
+        todo: Dict[str, List[Tuple[str, str, str]]] = {}
+        for source, item_id, text, h in hashed:
+            if h not in cached:
+                todo.setdefault(h, []).append((source, item_id, text))
+
+        queue: asyncio.Queue = asyncio.Queue()
+        for h, group in todo.items():
+            queue.put_nowait((h, group))
+        summary = {"items": len(hashed), "cached": len(hashed) - sum(len(g) for g in todo.values()),
+                   "graded": 0, "failed": 0}
+
+        async def worker():
+            while True:
+                try:
+                    h, group = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                source, item_id, text = group[0]
+                try:
+                    grade = await self.grade_text(text)
+                except Exception as e:
+                    summary["failed"] += len(group)
+                    logger.error(f"❌ Could not grade {source}/{item_id}: {e}")
+                    continue
+                await asyncio.to_thread(self.db.save, h, self.model, grade)
+                await asyncio.to_thread(self.db.link, [(s, i, h) for s, i, _ in group])
+                summary["graded"] += len(group)
+                logger.info(f"📋 Graded {source}/{item_id}: {grade['score']}%")
+
+        await asyncio.gather(*(worker() for _ in range(max(1, self.concurrency))))
+        summary["seconds"] = round(time.perf_counter() - started, 1)
+        return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Batch-grade recorded calls and training sessions")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_cmd = commands.add_parser("run", help="Grade new transcripts")
+    run_cmd.add_argument("--transcripts", default=config.get("TRANSCRIPTS_DIR", "transcripts"), help="Recorded call transcripts directory ('' to skip)")
+    run_cmd.add_argument("--sessions", default=config.get("TRAINING_SESSION_DB", "training_sessions.db"), help="Training session database ('' to skip)")
+    run_cmd.add_argument("--concurrency", type=int, default=GRADING_CONCURRENCY)
+    run_cmd.add_argument("--rpm", type=float, default=GRADING_REQUESTS_PER_MINUTE, help="Provider requests per minute")
+    run_cmd.add_argument("--db", default=GRADING_DB)
+    report_cmd = commands.add_parser("report", help="Average scores per source and rubric category")
+    report_cmd.add_argument("--hours", type=float, default=None, help="Only items seen in the last N hours")
+    report_cmd.add_argument("--db", default=GRADING_DB)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    db = GradeDB(args.db)
+    if args.command == "report":
+        since = time.time() - args.hours * 3600 if args.hours else None
+        print(json.dumps(db.report(since), indent=2))
+    else:
+        from google import genai
+        items = []
+        if args.transcripts and os.path.isdir(args.transcripts):
+            items += transcript_items(args.transcripts)
+        if args.sessions and os.path.exists(args.sessions):
+            items += session_items(args.sessions)
+        grader = BatchGrader(genai.Client(api_key=config.get("GOOGLE_API_KEY")), db,
+                             concurrency=args.concurrency, requests_per_minute=args.rpm)
+        print(json.dumps(asyncio.run(grader.run(items)), indent=2))
+    db.close()
@@ -0,0 +1,150 @@
+"""
+Inbound Jitter Buffer
+Reorders Twilio media frames by chunk number within a small window, conceals
+lost frames (repeat last frame with fade) so the audio clock stays continuous,
+and tracks RFC 3550 inter-arrival jitter and loss per stream
+"""
+import audioop
+import time
+from typing import Dict, List, Optional, Tuple
+
+from config import config
+from metrics import registry
+
+# Frames held back waiting for a missing chunk before it is declared lost
+JITTER_DEPTH_FRAMES = int(config.get("JITTER_DEPTH_FRAMES", "3"))
+# Consecutive lost frames concealed by repetition; longer gaps are filled with silence
+MAX_CONCEAL_FRAMES = 5
+# Gaps longer than this are treated as a stream discontinuity (resync, no fill)
+MAX_GAP_FRAMES = 250
+CONCEAL_FADE = 0.6  # Gain applied per repeated frame
+
+FRAME_MS = 20
+
+inbound_frames = registry.counter("inbound_media_frames_total", "Inbound Twilio media frames by outcome")
+
+
+class InboundJitterBuffer:
+    """
+    Per-stream reorder window over 20ms PCM16 frames.
+
+    push() returns frames ready for processing in chunk order as
+    (pcm, concealed) tuples. Frames arriving in order are released
+    immediately; a gap only adds latency (up to JITTER_DEPTH_FRAMES) while a
+    late frame could still fill it.
+    """
+
+    def __init__(self, depth: int = JITTER_DEPTH_FRAMES):
+        self.depth = depth
+        self.next_chunk: Optional[int] = None
+        self.pending: Dict[int, bytes] = {}
+        self.last_frame: Optional[bytes] = None
+        self.conceal_run = 0
+
+        # RFC 3550 interarrival jitter (ms), from Twilio timestamps vs arrival time
+        self.jitter_ms = 0.0
+        self._last_transit: Optional[float] = None
+
+        self.received = 0
+        self.concealed = 0
+        self.late = 0
+        self.duplicate = 0
+        self.reordered = 0
+        self.resyncs = 0
+
+    def push(self, chunk: Optional[int], timestamp_ms: Optional[float], pcm: bytes,
+             arrival: Optional[float] = None) -> List[Tuple[bytes, bool]]:
+        """Add a frame; returns the frames that are now ready, in order"""
+        self._update_jitter(timestamp_ms, time.monotonic() if arrival is None else arrival)
+
+        if chunk is None:
+            # No sequencing information - pass through
+            self.received += 1
+            inbound_frames.inc(outcome="received")
+            self.last_frame = pcm
+            return [(pcm, False)]
+
+        if self.next_chunk is None:
+            self.next_chunk = chunk
+        if chunk < self.next_chunk:
+            self.late += 1
+            inbound_frames.inc(outcome="late")
+            return []
+        if chunk in self.pending:
+            self.duplicate += 1
+            inbound_frames.inc(outcome="duplicate")
+            return []
+        if chunk - self.next_chunk > MAX_GAP_FRAMES:
+            # Stream jumped (e.g. long network outage): start over from here
+            self.resyncs += 1
+            ready = self._drain_pending()
+            self.next_chunk = chunk
+            self.pending[chunk] = pcm
+            self.received += 1
+            inbound_frames.inc(outcome="received")
+            return ready + self._release()
+
+        if self.pending and chunk < max(self.pending):
+            self.reordered += 1
+        self.pending[chunk] = pcm
+        self.received += 1
+        inbound_frames.inc(outcome="received")
+        return self._release()
+
+    def _release(self) -> List[Tuple[bytes, bool]]:
+        ready = []
+        while True:
+            frame = self.pending.pop(self.next_chunk, None)
+            if frame is not None:
+                ready.append((frame, False))
+                self.last_frame = frame
+                self.conceal_run = 0
+                self.next_chunk += 1
+                continue
+            # Next frame missing: wait while the window allows a late arrival
+            if not self.pending or max(self.pending) - self.next_chunk < self.depth:
+                return ready
+            ready.append((self._conceal(), True))
+            self.next_chunk += 1
+
+    def _drain_pending(self) -> List[Tuple[bytes, bool]]:
+        ready = [(self.pending[chunk], False) for chunk in sorted(self.pending)]
+        self.pending.clear()
+        return ready
+
+    def _conceal(self) -> bytes:
+        """Stand-in for a lost frame: the last frame repeated with decaying gain, then silence"""
+        self.concealed += 1
+        inbound_frames.inc(outcome="concealed")
+        self.conceal_run += 1
+        if self.last_frame is None:
+            return b"\x00" * (8 * FRAME_MS * 2)
+        if self.conceal_run > MAX_CONCEAL_FRAMES:
+            return b"\x00" * len(self.last_frame)
+        return audioop.mul(self.last_frame, 2, CONCEAL_FADE ** self.conceal_run)
+
+    def _update_jitter(self, timestamp_ms: Optional[float], arrival: float):
+        if timestamp_ms is None:
+            return
+        transit = arrival * 1000 - timestamp_ms
+        if self._last_transit is not None:
+            d = abs(transit - self._last_transit)
+            self.jitter_ms += (d - self.jitter_ms) / 16
+        self._last_transit = transit
+
+    @property
+    def loss_fraction(self) -> float:
+        expected = self.received + self.concealed
+        return self.concealed / expected if expected else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "jitter_ms": round(self.jitter_ms, 1),
+            "received": self.received,
+            "concealed": self.concealed,
+            "loss_fraction": round(self.loss_fraction, 4),
+            "late": self.late,
+            "duplicate": self.duplicate,
+            "reordered": self.reordered,
+            "resyncs": self.resyncs,
+        }
@@ -0,0 +1,254 @@
+"""
+Early Audio Language Identification
+Detects the caller's spoken language from the first seconds of call audio
+using faster-whisper's language detector on a small CPU model
+"""
+import asyncio
+import audioop
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Language identification configuration
+LANGUAGE_ID_ENABLED = str(config.get("LANGUAGE_ID_ENABLED", "true")).lower() == "true"
+LANGUAGE_ID_MODEL = config.get("LANGUAGE_ID_MODEL", "tiny")
+LANGUAGE_ID_SECONDS = float(config.get("LANGUAGE_ID_SECONDS", "2.5"))
+LANGUAGE_ID_MAX_WAIT_SECONDS = float(config.get("LANGUAGE_ID_MAX_WAIT_SECONDS", "10"))
+LANGUAGE_ID_THRESHOLD = float(config.get("LANGUAGE_ID_THRESHOLD", "0.6"))
+LANGUAGE_ID_WORKERS = int(config.get("LANGUAGE_ID_WORKERS", "2"))
+LANGUAGE_ID_CANDIDATES = [
+    code.strip()
+    for code in config.get("LANGUAGE_ID_CANDIDATES", "en,hi,bn,ta,te,kn,ml,gu,pa,mr,ur").split(",")
+    if code.strip()
+]
+
+# Whisper models expect 16kHz mono float32 audio
+WHISPER_SAMPLE_RATE = 16000
+
+# Frames quieter than this RMS (PCM16) are treated as silence/ringing and not counted
+SPEECH_RMS_THRESHOLD = 300
+
+_model = None
+_model_lock = threading.Lock()
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """Get the shared worker pool used for language detection"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=LANGUAGE_ID_WORKERS,
+            thread_name_prefix="language-id"
+        )
+    return _executor
+
+
+def _get_model():
+    """Load the faster-whisper model once (CPU, int8)"""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                from faster_whisper import WhisperModel
+
+                started = time.perf_counter()
+                _model = WhisperModel(
+                    LANGUAGE_ID_MODEL,
+                    device="cpu",
+                    compute_type="int8",
+                    cpu_threads=1,
+                )
+                logger.info(f"✅ Language ID model '{LANGUAGE_ID_MODEL}' loaded in {time.perf_counter() - started:.2f}s")
+    return _model
+
+
+def detect_language_from_audio(pcm16: bytes, sample_rate: int = WHISPER_SAMPLE_RATE) -> Tuple[Optional[str], float]:
+    """
+    Detect the spoken language of a PCM16 mono buffer (blocking, run in a worker)
+
+    Args:
+        pcm16: Raw PCM16 little-endian mono audio
+        sample_rate: Sample rate of the audio
+
+    Returns:
+        (language_code, probability) restricted to LANGUAGE_ID_CANDIDATES,
+        or (None, 0.0) if nothing could be detected
+    """
+    import numpy as np
+
+    if sample_rate != WHISPER_SAMPLE_RATE:
+        pcm16 = audioop.ratecv(pcm16, 2, 1, sample_rate, WHISPER_SAMPLE_RATE, None)[0]
+
+    audio = np.frombuffer(pcm16, dtype=np.int16).astype(np.float32) / 32768.0
+    if audio.size == 0:
+        return None, 0.0
+
+    model = _get_model()
+
+    if hasattr(model, "detect_language"):
+        _, _, all_probs = model.detect_language(audio)
+    else:
+        # Older faster-whisper: language info is computed before any segment is decoded
+        _, info = model.transcribe(audio, beam_size=1, without_timestamps=True)
+        all_probs = info.all_language_probs or [(info.language, info.language_probability)]
+
+    candidates: List[Tuple[str, float]] = [
+        (lang, prob) for lang, prob in all_probs
+        if not LANGUAGE_ID_CANDIDATES or lang in LANGUAGE_ID_CANDIDATES
+    ]
+    if not candidates:
+        return None, 0.0
+
+    language, probability = max(candidates, key=lambda item: item[1])
+    return language, float(probability)
+
+
+def warm_up():
+    """Load the model in the worker pool so the first call doesn't pay for it"""
+    if not LANGUAGE_ID_ENABLED:
+        return None
+    return _get_executor().submit(_get_model)
+
+
+def shutdown():
+    """Stop the worker pool"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+class EarlyLanguageIdentifier:
+    """
+    Collects the caller's first seconds of speech and runs language detection once.
+
+    Audio is fed from the media handler on the event loop; detection runs in the
+    shared worker pool and `on_detected(language, probability)` is called on the
+    loop when the result clears the confidence threshold. `spawn` schedules the
+    detection coroutine (defaults to the loop's create_task).
+    """
+
+    def __init__(self, caller_number: str, sample_rate: int, on_detected,
+                 event_loop: asyncio.AbstractEventLoop = None, spawn=None):
+        self.caller_number = caller_number
+        self.sample_rate = sample_rate
+        self.on_detected = on_detected
+        self.event_loop = event_loop or asyncio.get_event_loop()
+        self.spawn = spawn or self.event_loop.create_task
+        self.buffer = bytearray()
+        self.target_bytes = int(LANGUAGE_ID_SECONDS * sample_rate) * 2
+        self.min_bytes = sample_rate * 2  # At least 1s of speech for a fallback decision
+        self.started_at = time.monotonic()
+        self.submitted = False
+        self.result: Optional[Dict] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def feed(self, pcm16: bytes):
+        """Add a caller audio frame (PCM16 at self.sample_rate)"""
+        if self.submitted:
+            return
+
+        if audioop.rms(pcm16, 2) >= SPEECH_RMS_THRESHOLD:
+            self.buffer.extend(pcm16)
+
+        waited = time.monotonic() - self.started_at
+        if len(self.buffer) >= self.target_bytes or (
+            waited >= LANGUAGE_ID_MAX_WAIT_SECONDS and len(self.buffer) >= self.min_bytes
+        ):
+            self.submitted = True
+            self._task = self.spawn(self._detect(bytes(self.buffer)))
+            self.buffer = bytearray()
+
+    async def _detect(self, audio: bytes):
+        started = time.perf_counter()
+        try:
+            language, probability = await self.event_loop.run_in_executor(
+                _get_executor(), detect_language_from_audio, audio, self.sample_rate
+            )
+        except ImportError:
+            logger.error("faster-whisper not installed. Install with: pip install faster-whisper")
+            return
+        except Exception as e:
+            logger.error(f"❌ Language ID failed for {self.caller_number}: {e}")
+            return
+
+        latency_ms = (time.perf_counter() - started) * 1000
+        self.result = {
+            "language": language,
+            "probability": probability,
+            "latency_ms": latency_ms,
+            "audio_seconds": len(audio) / (2 * self.sample_rate),
+        }
+        logger.info(
+            f"🗣️ Audio language ID for {self.caller_number}: {language} "
+            f"(p={probability:.2f}, {latency_ms:.0f} ms)"
+        )
+
+        if language and probability >= LANGUAGE_ID_THRESHOLD:
+            try:
+                await self.on_detected(language, probability)
+            except Exception as e:
+                logger.error(f"❌ Error applying detected language for {self.caller_number}: {e}")
+
+    def cancel(self):
+        """Drop pending detection (call ended)"""
+        self.submitted = True
+        self.buffer = bytearray()
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+
+
+def benchmark(wav_path: Optional[str] = None, runs: int = 20):
+    """
+    Measure CPU decision latency for early language identification.
+
+    Uses the first LANGUAGE_ID_SECONDS of `wav_path` (PCM16 mono) or synthetic
+    noise when no file is given, and prints model load time and p50/p95 latency.
+    """
+    import wave
+    import numpy as np
+
+    if wav_path:
+        with wave.open(wav_path, "rb") as wf:
+            sample_rate = wf.getframerate()
+            pcm = wf.readframes(int(LANGUAGE_ID_SECONDS * sample_rate))
+    else:
+        sample_rate = WHISPER_SAMPLE_RATE
+        rng = np.random.default_rng(0)
+        pcm = (rng.standard_normal(int(LANGUAGE_ID_SECONDS * sample_rate)) * 3000).astype(np.int16).tobytes()
+
+    started = time.perf_counter()
+    _get_model()
+    load_s = time.perf_counter() - started
+
+    latencies = []
+    language, probability = None, 0.0
+    for _ in range(runs):
+        started = time.perf_counter()
+        language, probability = detect_language_from_audio(pcm, sample_rate)
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2]
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    print(f"Model: {LANGUAGE_ID_MODEL} (cpu, int8) | load {load_s:.2f}s")
+    print(f"Audio: {len(pcm) / (2 * sample_rate):.2f}s | runs {runs}")
+    print(f"Decision latency: p50 {p50:.1f} ms | p95 {p95:.1f} ms | max {latencies[-1]:.1f} ms")
+    print(f"Last result: {language} (p={probability:.2f})")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark early language identification on CPU")
+    parser.add_argument("wav", nargs="?", help="PCM16 mono WAV file (optional)")
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+    benchmark(args.wav, args.runs)
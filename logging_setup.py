@@ -0,0 +1,146 @@
+"""
+Logging Pipeline
+Records are handed to a bounded queue on the event loop thread and formatted /
+written to console and file by a background listener thread. Hot paths use
+rate-limited loggers, and every record carries the current call's fields
+"""
+import atexit
+import contextvars
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+from typing import Dict, Optional
+
+from metrics import registry
+
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - [%(call_sid)s %(caller_number)s] %(message)s"
+LOG_QUEUE_SIZE = 10000
+
+# Per-call fields; tasks spawned inside a call's task group inherit them
+current_call_sid: contextvars.ContextVar[str] = contextvars.ContextVar("call_sid", default="-")
+current_caller_number: contextvars.ContextVar[str] = contextvars.ContextVar("caller_number", default="-")
+
+log_records_dropped = registry.counter("log_records_dropped_total", "Log records dropped because the log queue was full")
+log_records_suppressed = registry.counter("log_records_suppressed_total", "Hot-path log records suppressed by rate limiting")
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def bind_call(call_sid: str, caller_number: str = "-"):
+    """Tag every log record in the current context (and tasks it spawns) with the call"""
+    current_call_sid.set(call_sid or "-")
+    current_caller_number.set(caller_number or "-")
+
+
+class CallContextFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, "call_sid"):
+            record.call_sid = current_call_sid.get()
+        if not hasattr(record, "caller_number"):
+            record.caller_number = current_caller_number.get()
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Enqueue without formatting: message %-args and tracebacks are rendered by
+    the listener thread. When the queue is full the record is dropped and
+    counted instead of blocking the caller.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            log_records_dropped.inc()
+
+
+def configure_logging(level: int = logging.INFO, log_file: Optional[str] = "server.log") -> logging.handlers.QueueListener:
+    """Route the root logger through a bounded queue to a background listener (idempotent)"""
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        handlers.append(logging.FileHandler(log_file))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    queue_handler = NonBlockingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    queue_handler.addFilter(CallContextFilter())
+
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+
+def stop_logging():
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class RateLimitedLogger:
+    """
+    Wrapper for per-packet / per-request log lines: each key logs at most once
+    per `interval` seconds, and the next emitted line reports how many were
+    suppressed in between. Use %-style args so suppressed lines cost no formatting.
+    """
+
+    def __init__(self, logger: logging.Logger, interval: float = 10.0):
+        self.logger = logger
+        self.interval = interval
+        self._last: Dict[str, float] = {}
+        self._suppressed: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _allow(self, key: str) -> int:
+        """-1 if suppressed, else the number of records suppressed since the last one"""
+        now = time.monotonic()
+        with self._lock:
+            last = self._last.get(key)
+            if last is not None and now - last < self.interval:
+                self._suppressed[key] = self._suppressed.get(key, 0) + 1
+                log_records_suppressed.inc()
+                return -1
+            if len(self._last) > 1000:
+                # Keys may include call SIDs; forget stale ones
+                self._last = {k: t for k, t in self._last.items() if now - t < self.interval}
+            self._last[key] = now
+            return self._suppressed.pop(key, 0)
+
+    def log(self, level: int, key: str, msg: str, *args, **kwargs):
+        if not self.logger.isEnabledFor(level):
+            return
+        suppressed = self._allow(key)
+        if suppressed < 0:
+            return
+        if suppressed:
+            msg = f"{msg} (+{suppressed} similar suppressed)"
+        self.logger.log(level, msg, *args, **kwargs)
+
+    def debug(self, key: str, msg: str, *args, **kwargs):
+        self.log(logging.DEBUG, key, msg, *args, **kwargs)
+
+    def info(self, key: str, msg: str, *args, **kwargs):
+        self.log(logging.INFO, key, msg, *args, **kwargs)
+
+    def warning(self, key: str, msg: str, *args, **kwargs):
+        self.log(logging.WARNING, key, msg, *args, **kwargs)
+
+    def error(self, key: str, msg: str, *args, **kwargs):
+        self.log(logging.ERROR, key, msg, *args, **kwargs)
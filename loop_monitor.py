@@ -0,0 +1,169 @@
+"""
+Event Loop Health Monitor
+A heartbeat coroutine measures scheduling lag; a watchdog thread notices when
+the heartbeat stalls and samples the loop thread's stack and current task, so
+blocking time is attributed to the endpoint / call that caused it
+"""
+import asyncio
+import contextvars
+import re
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Deque, Dict, Optional
+
+from config import config
+from logging_setup import current_call_sid
+from metrics import registry
+
+LOOP_HEARTBEAT_INTERVAL = 0.05
+# EWMA weight per heartbeat for the smoothed lag admission control reads (~1s time constant)
+LAG_SMOOTHING = 0.05
+LOOP_STALL_THRESHOLD_MS = float(config.get("LOOP_STALL_THRESHOLD_MS", "100"))
+RECENT_STALLS = 50
+STACK_DEPTH = 15
+
+# Route of the HTTP request / WebSocket a task is serving (set by EndpointTagMiddleware)
+current_endpoint: contextvars.ContextVar[str] = contextvars.ContextVar("endpoint", default="background")
+
+loop_lag_histogram = registry.histogram(
+    "event_loop_lag_seconds", "Heartbeat scheduling lag",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+loop_blocked_seconds = registry.counter("event_loop_blocked_seconds_total", "Time the event loop was blocked, by endpoint")
+loop_stalls = registry.counter("event_loop_stalls_total", "Event loop stalls over the threshold, by endpoint")
+
+_ID_SEGMENT = re.compile(r"/[^/]*\d[^/]*")
+
+
+def endpoint_label(scope: dict) -> str:
+    """Low-cardinality endpoint name: path segments with digits (numbers, SIDs, dates) collapse to {id}"""
+    path = _ID_SEGMENT.sub("/{id}", scope.get("path", ""))
+    return f"{'WS' if scope.get('type') == 'websocket' else scope.get('method', 'GET')} {path}"
+
+
+class EndpointTagMiddleware:
+    """ASGI middleware that tags the serving task's context with its endpoint"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] in ("http", "websocket"):
+            current_endpoint.set(endpoint_label(scope))
+        await self.app(scope, receive, send)
+
+
+class LoopMonitor:
+    def __init__(self, threshold_ms: float = LOOP_STALL_THRESHOLD_MS):
+        self.threshold = threshold_ms / 1000
+        self.lag_ms = 0.0
+        self.smoothed_lag_ms = 0.0
+        self.max_lag_ms = 0.0
+        self.stalls: Deque[dict] = deque(maxlen=RECENT_STALLS)
+        self.blocked_by: Dict[str, float] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._last_beat = 0.0
+        self._sample: Optional[dict] = None
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        if self._heartbeat_task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stopped.clear()
+        self._heartbeat_task = asyncio.create_task(self._heartbeat())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._heartbeat_task:
+            self._heartbeat_task.cancel()
+            self._heartbeat_task = None
+
+    async def _heartbeat(self):
+        try:
+            while True:
+                expected = time.monotonic() + LOOP_HEARTBEAT_INTERVAL
+                await asyncio.sleep(LOOP_HEARTBEAT_INTERVAL)
+                now = time.monotonic()
+                lag = max(0.0, now - expected)
+                self._last_beat = now
+                self.lag_ms = lag * 1000
+                self.smoothed_lag_ms += LAG_SMOOTHING * (self.lag_ms - self.smoothed_lag_ms)
+                self.max_lag_ms = max(self.max_lag_ms, self.lag_ms)
+                loop_lag_histogram.observe(lag)
+                if lag >= self.threshold:
+                    self._record_stall(lag)
+                else:
+                    self._sample = None
+        except asyncio.CancelledError:
+            pass
+
+    def _record_stall(self, lag: float):
+        sample, self._sample = self._sample, None
+        stall = {
+            "at": time.time(),
+            "blocked_ms": round(lag * 1000, 1),
+            "endpoint": "unknown",
+            "call_sid": "-",
+            "task": None,
+            "stack": [],
+        }
+        if sample:
+            stall.update(sample)
+        loop_blocked_seconds.inc(lag, endpoint=stall["endpoint"])
+        loop_stalls.inc(endpoint=stall["endpoint"])
+        self.blocked_by[stall["endpoint"]] = self.blocked_by.get(stall["endpoint"], 0.0) + lag
+        self.stalls.append(stall)
+
+    def _watch(self):
+        """Watchdog thread: sample the loop thread once per stall while it is still blocked"""
+        while not self._stopped.wait(self.threshold / 2):
+            overdue = time.monotonic() - self._last_beat - LOOP_HEARTBEAT_INTERVAL
+            if overdue >= self.threshold and self._sample is None:
+                try:
+                    self._sample = self._capture()
+                except Exception:
+                    # Never let the watchdog die over a racy read of loop state
+                    pass
+
+    def _capture(self) -> dict:
+        sample = {"endpoint": "background", "call_sid": "-", "task": None, "stack": []}
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is not None:
+            sample["stack"] = [
+                f"{entry.filename}:{entry.lineno} {entry.name}"
+                for entry in traceback.extract_stack(frame)[-STACK_DEPTH:]
+            ]
+        try:
+            # Read-only peek at the task the loop is running right now
+            task = asyncio.tasks._current_tasks.get(self._loop)
+        except Exception:
+            task = None
+        if task is not None:
+            sample["task"] = task.get_name()
+            get_context = getattr(task, "get_context", None)  # Python 3.12+
+            if get_context is not None:
+                context = get_context()
+                sample["endpoint"] = context.get(current_endpoint, "background")
+                sample["call_sid"] = context.get(current_call_sid, "-")
+        return sample
+
+    def status(self) -> dict:
+        return {
+            "lag_ms": round(self.lag_ms, 2),
+            "smoothed_lag_ms": round(self.smoothed_lag_ms, 2),
+            "max_lag_ms": round(self.max_lag_ms, 2),
+            "threshold_ms": round(self.threshold * 1000, 1),
+            "blocked_seconds_by_endpoint": {k: round(v, 3) for k, v in sorted(self.blocked_by.items(), key=lambda kv: -kv[1])},
+            "recent_stalls": list(self.stalls),
+        }
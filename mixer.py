@@ -0,0 +1,95 @@
+"""
+Call Monitor Mixer
+Time-aligns the dispatcher leg to the caller leg's 20ms media clock and mixes
+them into one monitoring stream (mono, or stereo with caller left / dispatcher
+right) that is encoded once per monitor frame and shared by every listener
+"""
+import audioop
+import base64
+from typing import Callable, Optional
+
+from config import config
+
+MONITOR_FRAME_MS = int(config.get("MONITOR_FRAME_MS", "100"))
+MONITOR_CHANNELS = int(config.get("MONITOR_CHANNELS", "1"))
+
+# Dispatcher audio buffered ahead of the caller clock; beyond this the oldest is dropped
+MAX_DISPATCHER_LEAD_MS = 500
+
+
+class CallMixer:
+    """
+    Per-call mixer driven by the caller leg.
+
+    The caller leg arrives as a continuous 20ms frame clock (after the jitter
+    buffer); dispatcher audio arrives in irregular HTTP chunks and is drained
+    from a FIFO one caller-frame's worth at a time, padded with silence when
+    the dispatcher is quiet. Every caller frame's mono mix also goes to `sink`
+    (the call's replay buffer) whether or not anyone is monitoring.
+    """
+
+    __slots__ = ("sample_rate", "channels", "frame_bytes", "sink", "_dispatcher", "_max_lead", "_pending", "seq")
+
+    def __init__(self, sample_rate: int = 16000, channels: int = MONITOR_CHANNELS,
+                 sink: Optional[Callable[[bytes], None]] = None):
+        self.sample_rate = sample_rate
+        self.sink = sink
+        self.channels = 2 if channels == 2 else 1
+        self.frame_bytes = sample_rate * MONITOR_FRAME_MS // 1000 * 2 * self.channels
+        self._dispatcher = bytearray()
+        self._max_lead = sample_rate * MAX_DISPATCHER_LEAD_MS // 1000 * 2
+        self._pending = bytearray()
+        self.seq = 0
+
+    def push_dispatcher(self, pcm16: bytes):
+        """Buffer dispatcher PCM16 (same sample rate as the caller leg)"""
+        self._dispatcher += pcm16
+        overflow = len(self._dispatcher) - self._max_lead
+        if overflow > 0:
+            overflow += overflow % 2
+            del self._dispatcher[:overflow]
+
+    def _take_dispatcher(self, length: int) -> bytes:
+        chunk = bytes(self._dispatcher[:length])
+        del self._dispatcher[:length]
+        if len(chunk) < length:
+            chunk += b"\x00" * (length - len(chunk))
+        return chunk
+
+    def skip(self, caller_pcm: bytes):
+        """Advance the clock without building monitor frames (nobody is listening)"""
+        dispatcher_pcm = self._take_dispatcher(len(caller_pcm))
+        if self.sink:
+            self.sink(audioop.add(caller_pcm, dispatcher_pcm, 2))
+        self._pending.clear()
+
+    def mix(self, caller_pcm: bytes) -> Optional[bytes]:
+        """Mix one caller frame with the aligned dispatcher audio; returns a monitor frame when one is complete"""
+        dispatcher_pcm = self._take_dispatcher(len(caller_pcm))
+        mono = audioop.add(caller_pcm, dispatcher_pcm, 2)
+        if self.sink:
+            self.sink(mono)
+        if self.channels == 2:
+            left = audioop.tostereo(caller_pcm, 2, 1, 0)
+            right = audioop.tostereo(dispatcher_pcm, 2, 0, 1)
+            self._pending += audioop.add(left, right, 2)
+        else:
+            self._pending += mono
+
+        if len(self._pending) < self.frame_bytes:
+            return None
+        frame = bytes(self._pending[:self.frame_bytes])
+        del self._pending[:self.frame_bytes]
+        self.seq += 1
+        return frame
+
+    def encode(self, frame: bytes) -> dict:
+        """Monitor message body for a mixed frame (serialized once by the hub for all listeners)"""
+        return {
+            "type": "monitor_audio",
+            "seq": self.seq,
+            "audio": base64.b64encode(frame).decode("utf-8"),
+            "sample_rate": self.sample_rate,
+            "channels": self.channels,
+            "encoding": "pcm16",
+        }
@@ -0,0 +1,117 @@
+"""
+Monitor Hub
+Fan-out for the AI-call /monitor sockets. Every event gets a sequence number
+and is serialized once; conversation events carry only the new exchange, not
+the whole history. A monitor gets a snapshot of all live calls when it
+connects (or just the events it missed, when resuming from a recent seq).
+Each monitor has its own bounded send queue and sender task, so a slow
+dashboard never delays the others; one that falls too far behind is resynced
+with a fresh snapshot
+"""
+import asyncio
+import json
+import logging
+import os
+from collections import deque
+from typing import Callable, Deque, Optional, Set, Tuple
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+MONITOR_QUEUE_SIZE = int(config.get("MONITOR_QUEUE_SIZE", "256"))
+MONITOR_REPLAY_EVENTS = int(config.get("MONITOR_REPLAY_EVENTS", "500"))
+
+
+class MonitorClient:
+    def __init__(self, hub: "MonitorHub", websocket, queue_size: int = MONITOR_QUEUE_SIZE):
+        self.hub = hub
+        self.websocket = websocket
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.resyncs = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._send_loop())
+
+    def offer(self, text: str):
+        try:
+            self.queue.put_nowait(text)
+        except asyncio.QueueFull:
+            # Deltas can't be skipped: drop the backlog and start over from a snapshot
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.resyncs += 1
+            self.queue.put_nowait(self.hub.snapshot_text())
+
+    async def _send_loop(self):
+        try:
+            while True:
+                text = await self.queue.get()
+                await self.websocket.send_text(text)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.warning(f"⚠️ Dropping monitor client: {e}")
+            self.hub.remove(self)
+
+    def close(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+
+class MonitorHub:
+    """
+    `calls` returns the current live calls (for snapshots) as a list of dicts.
+    Clients apply events with seq greater than the snapshot's seq
+    """
+
+    def __init__(self, calls: Callable[[], list], replay_events: int = MONITOR_REPLAY_EVENTS):
+        self.calls = calls
+        self.clients: Set[MonitorClient] = set()
+        self.seq = 0
+        # Identifies this process's seq numbering, so a monitor can't resume across a restart
+        self.epoch = os.urandom(4).hex()
+        self._recent: Deque[Tuple[int, str]] = deque(maxlen=replay_events)
+
+    def __len__(self):
+        return len(self.clients)
+
+    def snapshot_text(self) -> str:
+        return json.dumps({"event": "snapshot", "epoch": self.epoch, "seq": self.seq, "calls": self.calls()})
+
+    def connect(self, websocket, epoch: Optional[str] = None, last_seq: Optional[int] = None) -> MonitorClient:
+        """Register a monitor and queue its catch-up: missed events if still buffered, else a snapshot"""
+        client = MonitorClient(self, websocket)
+        oldest = self._recent[0][0] if self._recent else self.seq + 1
+        if epoch == self.epoch and last_seq is not None and oldest - 1 <= last_seq <= self.seq:
+            for seq, text in self._recent:
+                if seq > last_seq:
+                    client.offer(text)
+        else:
+            client.offer(self.snapshot_text())
+        self.clients.add(client)
+        client.start()
+        return client
+
+    def remove(self, client: MonitorClient):
+        self.clients.discard(client)
+        client.close()
+
+    def publish(self, event: dict) -> int:
+        """Stamp the next seq, serialize once and queue for every monitor"""
+        self.seq += 1
+        text = json.dumps({**event, "seq": self.seq})
+        self._recent.append((self.seq, text))
+        for client in self.clients:
+            client.offer(text)
+        return self.seq
+
+    def stats(self) -> dict:
+        return {
+            "clients": len(self.clients),
+            "seq": self.seq,
+            "max_backlog": max((c.queue.qsize() for c in self.clients), default=0),
+            "resyncs": sum(c.resyncs for c in self.clients),
+        }
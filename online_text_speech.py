@@ -1,4 +1,5 @@
 import os
+import re
 import json
 import uvicorn
 import requests
@@ -11,7 +12,8 @@ from fastapi.responses import Response
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 from prompts import EMERGENCY_SERVICES_GREETING,EMERGENCY_SERVICES_SYSTEM_PROMPT
-from typing import List
+from conversation_memory import ConversationMemory, PromptCache
+from monitor_hub import MonitorHub
 import asyncio
 # Load environment variables from .env file
 load_dotenv()
@@ -151,14 +153,21 @@ client = genai.Client(api_key=GOOGLE_API_KEY)
 MODEL_ID = 'gemini-2.5-flash'
 
 # Store active chat sessions
-# We will now store Gemini's chat session objects
+# Each call's ConversationMemory: recent turns verbatim, older ones folded into case notes
 sessions = {}
 
+# Static system prompt, served from a Gemini context cache when possible
+prompt_cache = PromptCache(client, MODEL_ID, SYSTEM_PROMPT)
+
 # Store call metadata for each session
 call_metadata = {}
 
-# Store connected monitoring WebSocket clients
-monitoring_clients: List[WebSocket] = []
+def live_calls():
+    """Snapshot of every live call for a (re)connecting monitor"""
+    return [{"caller_id": call_sid, "AI_model": MODEL_ID, **metadata} for call_sid, metadata in call_metadata.items()]
+
+# Connected monitoring WebSocket clients: sequenced delta events, per-client bounded send queues
+monitor_hub = MonitorHub(live_calls)
 
 # Create FastAPI app
 app = FastAPI()
@@ -180,47 +189,48 @@ async def shutdown_event():
         await client.aio._client_session.close()
 
 async def broadcast_call_data(call_sid: str, data: dict):
-    """Broadcast call data to all connected monitoring clients"""
-    disconnected = []
-    for client in monitoring_clients:
-        try:
-            await client.send_json(data)
-        except:
-            disconnected.append(client)
-    
-    # Remove disconnected clients
-    for client in disconnected:
-        monitoring_clients.remove(client)
+    """Broadcast call data to all connected monitoring clients (queued; never waits on a slow monitor)"""
+    monitor_hub.publish(data)
+
+# ConversationRelay starts synthesizing once it has a clause; used to estimate time to first audio
+CLAUSE_END = re.compile(r"[.!?;:,。！？।](\s|$)")
 
-async def gemini_response(chat_history, user_prompt):
-    """Get a response from the Gemini API."""
+async def gemini_response_stream(memory, user_prompt):
+    """Stream a response from the Gemini API, yielding text chunks as they are generated."""
     try:
-        print(f"[DEBUG] Adding user message to history")
-        # Add user message to history
-        chat_history.append(types.Content(
-            role='user',
-            parts=[types.Part(text=user_prompt)]
-        ))
+        # Bounded context: case notes + recent turns + this prompt
+        contents = memory.contents(user_prompt)
+        generation = prompt_cache.generation_config(temperature=0.7)
         
-        print(f"[DEBUG] Calling Gemini API with model: {MODEL_ID}")
-        # Generate response with system instruction and chat history
-        response = await client.aio.models.generate_content(
-            model=MODEL_ID,
-            contents=chat_history,
-            config=types.GenerateContentConfig(
-                system_instruction=SYSTEM_PROMPT,
-                temperature=0.7
-            )
-        )
+        print(f"[DEBUG] Streaming from Gemini API with model: {MODEL_ID} ({memory.tokens()} context tokens)")
+        attempts = [generation]
+        if generation.cached_content:
+            # Cache expired or was deleted server-side: retry this turn with the prompt inline
+            attempts.append(types.GenerateContentConfig(system_instruction=SYSTEM_PROMPT, temperature=0.7))
         
-        print(f"[DEBUG] Received response from Gemini")
-        # Add assistant response to history
-        chat_history.append(types.Content(
-            role='model',
-            parts=[types.Part(text=response.text)]
-        ))
+        parts = []
+        for attempt, attempt_config in enumerate(attempts):
+            try:
+                stream = await client.aio.models.generate_content_stream(
+                    model=MODEL_ID,
+                    contents=contents,
+                    config=attempt_config
+                )
+                async for chunk in stream:
+                    if chunk.text:
+                        parts.append(chunk.text)
+                        yield chunk.text
+                break
+            except Exception as e:
+                # The rejection may only surface on the first chunk; retry only while nothing was spoken
+                if parts or attempt == len(attempts) - 1:
+                    raise
+                print(f"⚠️ Cached system prompt rejected ({e}), retrying inline")
+                prompt_cache.invalidate()
         
-        return response.text
+        print(f"[DEBUG] Received full response from Gemini")
+        # Record the exchange only once it completed; may fold older turns in the background
+        memory.add(user_prompt, "".join(parts))
     except Exception as e:
         print(f"[ERROR] Gemini API error: {type(e).__name__}: {str(e)}")
         import traceback
@@ -256,18 +266,31 @@ async def twiml_endpoint():
 
 @app.websocket("/monitor")
 async def monitor_endpoint(websocket: WebSocket):
-    """WebSocket endpoint for monitoring calls in real-time"""
+    """
+    WebSocket endpoint for monitoring calls in real-time.
+    
+    Starts with a snapshot of live calls (or, with ?epoch=..&last_seq=N from a
+    previous connection, just the events after N), then sequenced events;
+    conversation events carry only the new exchange at its index.
+    """
     await websocket.accept()
-    monitoring_clients.append(websocket)
-    print(f"📊 Monitoring client connected. Total clients: {len(monitoring_clients)}")
+    last_seq = websocket.query_params.get("last_seq")
+    client = monitor_hub.connect(
+        websocket,
+        epoch=websocket.query_params.get("epoch"),
+        last_seq=int(last_seq) if last_seq and last_seq.isdigit() else None
+    )
+    print(f"📊 Monitoring client connected. Total clients: {len(monitor_hub)}")
     
     try:
         # Keep connection alive and listen for any client messages
         while True:
             await websocket.receive_text()
     except WebSocketDisconnect:
-        monitoring_clients.remove(websocket)
-        print(f"📊 Monitoring client disconnected. Total clients: {len(monitoring_clients)}")
+        pass
+    finally:
+        monitor_hub.remove(client)
+        print(f"📊 Monitoring client disconnected. Total clients: {len(monitor_hub)}")
 
     
 @app.websocket("/ws")
@@ -287,8 +310,8 @@ async def websocket_endpoint(websocket: WebSocket):
                 caller_number = message.get("from", "Unknown")
                 print(f"Setup for call: {call_sid} from {caller_number}")
                 
-                # Initialize chat history for this call
-                sessions[call_sid] = []
+                # Initialize conversation memory for this call
+                sessions[call_sid] = ConversationMemory(client)
                 
                 # Initialize call metadata
                 call_metadata[call_sid] = {
@@ -316,16 +339,45 @@ async def websocket_endpoint(websocket: WebSocket):
                 user_prompt = message["voicePrompt"]
                 print(f"Processing prompt: {user_prompt}")
                 
+                tokens_sent = False
                 try:
-                    chat_history = sessions[call_sid]
-                    response_text = await gemini_response(chat_history, user_prompt)
+                    memory = sessions[call_sid]
+                    
+                    # Forward tokens as they arrive so ConversationRelay's TTS starts on the first clause
+                    started = time.perf_counter()
+                    ttft_ms = ttfa_ms = None
+                    response_text = ""
+                    async for token in gemini_response_stream(memory, user_prompt):
+                        now_ms = round((time.perf_counter() - started) * 1000, 1)
+                        if ttft_ms is None:
+                            ttft_ms = now_ms
+                        response_text += token
+                        await websocket.send_text(
+                            json.dumps({
+                                "type": "text",
+                                "token": token,
+                                "last": False
+                            })
+                        )
+                        tokens_sent = True
+                        if ttfa_ms is None and CLAUSE_END.search(response_text):
+                            ttfa_ms = now_ms
+                    
+                    # Close the turn; Twilio speaks whatever is still buffered
+                    await websocket.send_text(json.dumps({"type": "text", "token": "", "last": True}))
+                    total_ms = round((time.perf_counter() - started) * 1000, 1)
+                    if ttfa_ms is None:
+                        ttfa_ms = total_ms
+                    print(f"⏱️ Turn latency for {call_sid}: first token {ttft_ms}ms, first clause to TTS {ttfa_ms}ms, total {total_ms}ms")
+                    latency = {"ttft_ms": ttft_ms, "ttfa_ms": ttfa_ms, "total_ms": total_ms, **memory.stats()}
                     
                     # Store conversation in metadata
                     if call_sid in call_metadata:
                         call_metadata[call_sid]["conversation"].append({
                             "message_human": user_prompt,
                             "message_AI": response_text,
-                            "timestamp": time.time()
+                            "timestamp": time.time(),
+                            **latency
                         })
                     
                     # Broadcast conversation update
@@ -337,18 +389,10 @@ async def websocket_endpoint(websocket: WebSocket):
                         "message_human": user_prompt,
                         "message_AI": response_text,
                         "timestamp": time.time(),
-                        "conversation_history": call_metadata[call_sid]["conversation"]
+                        **latency,
+                        # Position of this exchange in the call; monitors append instead of receiving the history
+                        "index": len(call_metadata[call_sid]["conversation"]) - 1
                     })
-                    
-                    # Send the complete response back to Twilio.
-                    # Twilio's ConversationRelay will handle the text-to-speech conversion.
-                    await websocket.send_text(
-                        json.dumps({
-                            "type": "text",
-                            "token": response_text,
-                            "last": True  # Indicate this is the full and final message
-                        })
-                    )
                     print(f"Sent response: {response_text}")
                     
                 except Exception as e:
@@ -356,6 +400,9 @@ async def websocket_endpoint(websocket: WebSocket):
                     import traceback
                     traceback.print_exc()
                     error_message = "I'm sorry, I encountered an error processing your request. Please try again."
+                    if tokens_sent:
+                        # Part of the answer was already spoken
+                        error_message = " " + error_message
                     try:
                         await websocket.send_text(
                             json.dumps({
@@ -390,7 +437,7 @@ async def websocket_endpoint(websocket: WebSocket):
             })
         
         if call_sid in sessions:
-            sessions.pop(call_sid)
+            sessions.pop(call_sid).close()
             print(f"Cleared session for call {call_sid}")
         
         if call_sid in call_metadata:
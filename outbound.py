@@ -0,0 +1,100 @@
+"""
+Outbound Media Batching
+Aggregates queued 20ms μ-law frames for the phone leg into larger Twilio
+media messages when a backlog exists (TTS), while live passthrough audio
+still goes out frame by frame. Each batch is base64-encoded once and
+rendered from a template instead of json.dumps
+"""
+import argparse
+import asyncio
+import base64
+import json
+import time
+from typing import Optional, Tuple
+
+from config import config
+from metrics import registry
+
+FRAME_BYTES = 160  # 20ms of 8kHz μ-law
+FRAME_MS = 20
+
+# Batch size while the queue has a backlog (e.g. a translated sentence) - long backlogs get the larger batch
+OUTBOUND_BATCH_MS = int(config.get("OUTBOUND_BATCH_MS", "200"))
+SHORT_BATCH_MS = min(100, OUTBOUND_BATCH_MS)
+
+# Payload is base64 and streamSid is an SID, so neither needs JSON escaping
+MEDIA_TEMPLATE = '{"event":"media","streamSid":"%s","media":{"payload":"%s","track":"outbound"}}'
+
+outbound_messages = registry.counter("outbound_media_messages_total", "Media messages sent to Twilio")
+outbound_frames = registry.counter("outbound_media_frames_total", "20ms audio frames sent to Twilio")
+
+
+def media_message(stream_sid: str, ulaw: bytes) -> str:
+    return MEDIA_TEMPLATE % (stream_sid, base64.b64encode(ulaw).decode("ascii"))
+
+
+def take_batch(first: bytes, queue: asyncio.Queue) -> Tuple[bytes, Optional[dict]]:
+    """
+    `first` plus audio already waiting in the queue, up to the batch size.
+
+    Stops at a control item (mark/clear) and returns it so it is sent right
+    after the audio that preceded it.
+    """
+    backlog = queue.qsize()
+    if backlog == 0:
+        return first, None
+
+    batch_ms = OUTBOUND_BATCH_MS if backlog * FRAME_MS >= OUTBOUND_BATCH_MS else SHORT_BATCH_MS
+    limit = batch_ms // FRAME_MS * FRAME_BYTES
+    parts = [first]
+    size = len(first)
+    while size < limit and not queue.empty():
+        item = queue.get_nowait()
+        if isinstance(item, dict):
+            return b"".join(parts), item
+        parts.append(item)
+        size += len(item)
+    return b"".join(parts), None
+
+
+def record_sent(ulaw: bytes):
+    outbound_messages.inc()
+    outbound_frames.inc(len(ulaw) / FRAME_BYTES)
+
+
+def benchmark(seconds: float = 60.0, stream_sid: str = "MZ" + "0" * 32) -> dict:
+    """Messages and CPU to serialize `seconds` of queued TTS audio: per-frame vs batched"""
+    frames = int(seconds * 1000 / FRAME_MS)
+    audio = [bytes([0xFF]) * FRAME_BYTES for _ in range(frames)]
+
+    started = time.process_time()
+    per_frame = 0
+    for chunk in audio:
+        payload = base64.b64encode(chunk).decode("utf-8")
+        json.dumps({"event": "media", "streamSid": stream_sid, "media": {"payload": payload, "track": "outbound"}})
+        per_frame += 1
+    per_frame_cpu = time.process_time() - started
+
+    queue: asyncio.Queue = asyncio.Queue()
+    for chunk in audio:
+        queue.put_nowait(chunk)
+    started = time.process_time()
+    batched = 0
+    while not queue.empty():
+        ulaw, _ = take_batch(queue.get_nowait(), queue)
+        media_message(stream_sid, ulaw)
+        batched += 1
+    batched_cpu = time.process_time() - started
+
+    scale = 60.0 / seconds
+    return {
+        "per_frame": {"messages_per_minute": round(per_frame * scale), "cpu_ms_per_minute": round(per_frame_cpu * scale * 1000, 2)},
+        "batched": {"messages_per_minute": round(batched * scale), "cpu_ms_per_minute": round(batched_cpu * scale * 1000, 2)},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark outbound Twilio media serialization")
+    parser.add_argument("--seconds", type=float, default=60.0, help="Seconds of queued audio to serialize")
+    args = parser.parse_args()
+    print(json.dumps(benchmark(args.seconds), indent=2))
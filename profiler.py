@@ -0,0 +1,250 @@
+"""
+On-Demand Runtime Profiler
+Bounded in-process profiling windows for /debug/profile: a sampling profiler
+that attributes stacks to the asyncio task running on the loop (cpu / wall),
+cProfile for a pstats download, and tracemalloc for allocations. Reports are
+collapsed stacks (flamegraph.pl / speedscope input) rooted at the task name
+"""
+import asyncio
+import cProfile
+import json
+import marshal
+import os
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Dict, Optional, Tuple
+
+from config import config
+
+MODES = ("cpu", "wall", "alloc")
+FORMATS = ("collapsed", "json", "pstats")
+
+PROFILE_MAX_SECONDS = float(config.get("PROFILE_MAX_SECONDS", "60"))
+PROFILE_SAMPLE_MS = float(config.get("PROFILE_SAMPLE_MS", "5"))
+MAX_STACK_DEPTH = 64
+ALLOC_FRAMES = 25
+TOP_STACKS = 50
+
+IDLE = "(idle)"
+_DEFAULT_TASK_NAME = re.compile(r"Task-\d+$")
+# Where an idle loop / worker thread sits between events
+_LOOP_IDLE_FUNCS = {"select", "poll", "run_forever", "run_until_complete", "_run_once", "run"}
+_WORKER_IDLE_FILES = ("threading.py", "queue.py")
+_WORKER_IDLE_FUNCS = {"_worker"}
+
+
+class ProfilerBusy(Exception):
+    """Another profiling window is already running"""
+
+
+def task_label(task: Optional[asyncio.Task]) -> str:
+    """Task name from call.spawn(name=...), or the coroutine name for unnamed tasks"""
+    if task is None:
+        return IDLE
+    name = task.get_name()
+    if _DEFAULT_TASK_NAME.match(name):
+        coro = task.get_coro()
+        name = getattr(coro, "__qualname__", None) or name
+    return name
+
+
+def _frame_name(code) -> str:
+    return f"{os.path.basename(code.co_filename)}:{code.co_qualname}"
+
+
+class StackSampler:
+    """
+    Samples the loop thread every PROFILE_SAMPLE_MS from a background thread.
+
+    cpu: only samples where the loop is running Python code (idle selector
+    waits are dropped). wall: idle time is kept as "(idle)" and executor
+    threads (asyncio.to_thread / run_in_executor work) are sampled too.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, loop_thread_id: int, mode: str):
+        self.loop = loop
+        self.loop_thread_id = loop_thread_id
+        self.mode = mode
+        self.samples: Counter = Counter()
+        self.total = 0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        interval = PROFILE_SAMPLE_MS / 1000
+        own_id = threading.get_ident()
+        while not self._stopped.wait(interval):
+            try:
+                self._sample(own_id)
+            except Exception:
+                # Racy reads of another thread's state must not kill the sampler
+                pass
+
+    def _stack(self, frame) -> Tuple:
+        codes = []
+        while frame is not None and len(codes) < MAX_STACK_DEPTH:
+            codes.append(frame.f_code)
+            frame = frame.f_back
+        codes.reverse()
+        return tuple(codes)
+
+    def _sample(self, own_id: int):
+        frames = sys._current_frames()
+        self.total += 1
+
+        frame = frames.get(self.loop_thread_id)
+        if frame is not None:
+            task = asyncio.tasks._current_tasks.get(self.loop)
+            idle = task is None and (
+                frame.f_code.co_name in _LOOP_IDLE_FUNCS or frame.f_code.co_filename.endswith("selectors.py")
+            )
+            if idle:
+                if self.mode == "wall":
+                    self.samples[(IDLE, ())] += 1
+            else:
+                self.samples[(f"task:{task_label(task)}" if task else "loop:callbacks", self._stack(frame))] += 1
+
+        if self.mode != "wall":
+            return
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in frames.items():
+            if ident in (self.loop_thread_id, own_id):
+                continue
+            name = names.get(ident, str(ident))
+            if not name.startswith("asyncio_"):
+                continue
+            if frame.f_code.co_name in _WORKER_IDLE_FUNCS or frame.f_code.co_filename.endswith(_WORKER_IDLE_FILES):
+                continue
+            self.samples[(f"thread:{name}", self._stack(frame))] += 1
+
+    def collapsed(self) -> Dict[str, int]:
+        lines: Counter = Counter()
+        for (root, codes), count in self.samples.items():
+            lines[";".join([root, *(_frame_name(code) for code in codes)])] += count
+        return dict(lines)
+
+    def by_task(self) -> Dict[str, int]:
+        totals: Counter = Counter()
+        for (root, _), count in self.samples.items():
+            totals[root] += count
+        return dict(totals)
+
+
+class RuntimeProfiler:
+    """One bounded profiling window at a time for this process"""
+
+    def __init__(self):
+        self._lock = asyncio.Lock()
+
+    @property
+    def busy(self) -> bool:
+        return self._lock.locked()
+
+    async def run(self, seconds: float, mode: str = "cpu", fmt: str = "collapsed") -> Tuple[bytes, dict]:
+        """Profile for `seconds` and return (report, summary)"""
+        if self._lock.locked():
+            raise ProfilerBusy("a profile is already running")
+        seconds = max(0.1, min(float(seconds), PROFILE_MAX_SECONDS))
+        async with self._lock:
+            if fmt == "pstats":
+                return await self._run_cprofile(seconds, mode)
+            if mode == "alloc":
+                return await self._run_tracemalloc(seconds, fmt)
+            return await self._run_sampler(seconds, mode, fmt)
+
+    async def _run_sampler(self, seconds: float, mode: str, fmt: str) -> Tuple[bytes, dict]:
+        sampler = StackSampler(asyncio.get_running_loop(), threading.get_ident(), mode)
+        started = time.monotonic()
+        sampler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            await asyncio.to_thread(sampler.stop)
+        summary = {
+            "mode": mode,
+            "seconds": round(time.monotonic() - started, 2),
+            "sample_interval_ms": PROFILE_SAMPLE_MS,
+            "samples": sampler.total,
+            "by_task": dict(sorted(sampler.by_task().items(), key=lambda kv: -kv[1])),
+        }
+        return _render(sampler.collapsed(), summary, fmt), summary
+
+    async def _run_cprofile(self, seconds: float, mode: str) -> Tuple[bytes, dict]:
+        """
+        cProfile over the loop thread; the pstats file is per-function, so it
+        cannot be split by task - use the collapsed report for that
+        """
+        if mode == "alloc":
+            raise ValueError("pstats output is only available for cpu and wall modes")
+        profile = cProfile.Profile(time.process_time) if mode == "cpu" else cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError as e:
+            raise ProfilerBusy(str(e))
+        started = time.monotonic()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profile.disable()
+        profile.create_stats()
+        summary = {"mode": mode, "seconds": round(time.monotonic() - started, 2), "functions": len(profile.stats)}
+        return marshal.dumps(profile.stats), summary
+
+    async def _run_tracemalloc(self, seconds: float, fmt: str) -> Tuple[bytes, dict]:
+        """Bytes allocated during the window and still live at its end, by allocating stack"""
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start(ALLOC_FRAMES)
+        # Snapshots and the diff walk every live trace; keep them off the event loop
+        baseline = await asyncio.to_thread(tracemalloc.take_snapshot)
+        started = time.monotonic()
+        try:
+            await asyncio.sleep(seconds)
+            snapshot = await asyncio.to_thread(tracemalloc.take_snapshot)
+        finally:
+            if started_tracing:
+                tracemalloc.stop()
+
+        lines = await asyncio.to_thread(_alloc_stacks, baseline, snapshot)
+        summary = {
+            "mode": "alloc",
+            "seconds": round(time.monotonic() - started, 2),
+            "unit": "bytes",
+            "allocated_live_bytes": sum(lines.values()),
+        }
+        return _render(dict(lines), summary, fmt), summary
+
+
+def _alloc_stacks(baseline: tracemalloc.Snapshot, snapshot: tracemalloc.Snapshot) -> Counter:
+    """Bytes gained between two snapshots, keyed by folded allocating stack"""
+    ignore = (
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+    )
+    snapshot = snapshot.filter_traces(ignore)
+    baseline = baseline.filter_traces(ignore)
+    lines: Counter = Counter()
+    for diff in snapshot.compare_to(baseline, "traceback"):
+        if diff.size_diff <= 0:
+            continue
+        frames = [f"{os.path.basename(frame.filename)}:{frame.lineno}" for frame in diff.traceback]
+        lines[";".join(["alloc", *frames])] += diff.size_diff
+    return lines
+
+
+def _render(stacks: Dict[str, int], summary: dict, fmt: str) -> bytes:
+    if fmt == "json":
+        top = sorted(stacks.items(), key=lambda kv: -kv[1])[:TOP_STACKS]
+        return json.dumps({**summary, "top_stacks": [{"stack": s, "weight": w} for s, w in top]}).encode("utf-8")
+    return "".join(f"{stack} {weight}\n" for stack, weight in sorted(stacks.items())).encode("utf-8")
@@ -0,0 +1,127 @@
+"""
+Call Replay Buffers
+Bounded per-call history of recent transcript events and audio so a console
+that joins mid-call gets a snapshot of what it missed before the live stream
+"""
+import base64
+import math
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+from config import config
+
+# Transcript events and seconds of audio kept per call
+REPLAY_TRANSCRIPT_EVENTS = int(config.get("REPLAY_TRANSCRIPT_EVENTS", "200"))
+REPLAY_AUDIO_SECONDS = float(config.get("REPLAY_AUDIO_SECONDS", "15"))
+
+SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2
+
+
+def catchup_seconds(value) -> float:
+    """Requested catch-up audio clamped to the replay window; ValueError if it isn't a number of seconds"""
+    if value is None or value == "":
+        return 0.0
+    if isinstance(value, bool):
+        raise ValueError("expected seconds, got a boolean")
+    try:
+        seconds = float(value)
+    except TypeError:
+        raise ValueError(f"expected seconds, got {type(value).__name__}")
+    if math.isnan(seconds):
+        raise ValueError("expected seconds, got NaN")
+    return min(max(seconds, 0.0), REPLAY_AUDIO_SECONDS)
+
+
+class CallReplay:
+    """
+    Ring buffers for one call.
+
+    Final transcripts are kept in order (oldest dropped first); only the latest
+    interim per speaker is kept since each one replaces the previous. Audio is
+    kept already mixed (the CallMixer output, one frame per caller frame), so a
+    late joiner only costs a join and one base64 encode shared with any other
+    joiner asking for the same window before the next frame.
+    """
+
+    __slots__ = ("seq", "finals", "interims", "audio", "audio_bytes", "audio_frames", "max_audio_bytes", "_encoded")
+
+    def __init__(self, max_events: int = REPLAY_TRANSCRIPT_EVENTS, audio_seconds: float = REPLAY_AUDIO_SECONDS):
+        self.seq = 0
+        self.finals: Deque[dict] = deque(maxlen=max_events)
+        self.interims: Dict[str, dict] = {}
+        self.audio: Deque[bytes] = deque()
+        self.audio_bytes = 0
+        self.audio_frames = 0  # frames ever recorded; keys the encoded snapshot cache
+        self.max_audio_bytes = int(audio_seconds * SAMPLE_RATE * SAMPLE_WIDTH)
+        self._encoded: Optional[Tuple[Tuple[int, float], str, float]] = None
+
+    def record_transcript(self, message: dict) -> int:
+        """Store a transcript event and stamp it with the call's sequence number"""
+        self.seq += 1
+        message["seq"] = self.seq
+        speaker = message.get("speaker", "")
+        if message.get("is_final", True):
+            self.finals.append(message)
+            self.interims.pop(speaker, None)
+        else:
+            self.interims[speaker] = message
+        return self.seq
+
+    def record_audio(self, pcm16: bytes):
+        """Keep a mixed caller + dispatcher 16kHz PCM16 frame (fed by the call's CallMixer)"""
+        if not self.max_audio_bytes or not pcm16:
+            return
+        self.audio.append(pcm16)
+        self.audio_bytes += len(pcm16)
+        self.audio_frames += 1
+        while self.audio_bytes > self.max_audio_bytes and self.audio:
+            self.audio_bytes -= len(self.audio.popleft())
+
+    def mixed_audio(self, seconds: Optional[float] = None) -> bytes:
+        """The last `seconds` (or all) of the buffered mix"""
+        pcm = b"".join(self.audio)
+        if seconds:
+            pcm = pcm[-(int(seconds * SAMPLE_RATE) * SAMPLE_WIDTH):]
+        return pcm
+
+    def encoded_audio(self, seconds: float) -> Tuple[str, float]:
+        """Base64 of the last `seconds` of mixed audio and its duration, shared by joiners until a new frame arrives"""
+        key = (self.audio_frames, seconds)
+        if self._encoded is None or self._encoded[0] != key:
+            pcm = self.mixed_audio(seconds)
+            self._encoded = (key, base64.b64encode(pcm).decode("utf-8"),
+                             round(len(pcm) / (SAMPLE_RATE * SAMPLE_WIDTH), 2))
+        return self._encoded[1], self._encoded[2]
+
+    def snapshot(self, audio_seconds: float = 0) -> dict:
+        """History for a late joiner; live events with seq <= snapshot seq are already included"""
+        snapshot = {
+            "type": "snapshot",
+            "seq": self.seq,
+            "transcripts": list(self.finals),
+            "interim": list(self.interims.values()),
+        }
+        if audio_seconds > 0:
+            audio, duration = self.encoded_audio(audio_seconds)
+            snapshot["audio"] = {
+                "audio": audio,
+                "sample_rate": SAMPLE_RATE,
+                "encoding": "pcm16",
+                "duration": duration,
+            }
+        return snapshot
+
+    def clear(self):
+        self.finals.clear()
+        self.interims.clear()
+        self.audio.clear()
+        self.audio_bytes = 0
+        self._encoded = None
+
+    def stats(self) -> dict:
+        return {
+            "seq": self.seq,
+            "transcript_events": len(self.finals),
+            "audio_seconds": round(self.audio_bytes / (SAMPLE_RATE * SAMPLE_WIDTH), 1),
+        }
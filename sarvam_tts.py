@@ -8,6 +8,8 @@ import base64
 import logging
 from typing import Optional
 import json
+import time
+import tracing
 from config import config
 
 logger = logging.getLogger(__name__)
@@ -71,6 +73,9 @@ async def text_to_speech_sarvam(text: str, language_code: str = 'hi') -> Optiona
         logger.warning("⚠️ Empty text provided to Sarvam TTS")
         return None
     
+    # Ended explicitly rather than entered: nothing below starts child spans
+    trace_span = tracing.span("tts_provider", provider="sarvam", language=language_code)
+    started = time.perf_counter()
     try:
         from sarvamai import AsyncSarvamAI, AudioOutput, EventResponse
         
@@ -119,6 +124,8 @@ async def text_to_speech_sarvam(text: str, language_code: str = 'hi') -> Optiona
                     # Decode base64 audio data
                     audio_chunk = base64.b64decode(message.data.audio)
                     audio_chunks.append(audio_chunk)
+                    if chunk_count == 1:
+                        trace_span.set(first_audio_ms=round((time.perf_counter() - started) * 1000, 1))
                     
                     # Log progress
                     if chunk_count % 10 == 0:
@@ -132,22 +139,28 @@ async def text_to_speech_sarvam(text: str, language_code: str = 'hi') -> Optiona
             
             if not audio_chunks:
                 logger.error("❌ No audio generated from Sarvam")
+                trace_span.fail("no audio")
                 return None
             
             # Combine all audio chunks
             audio_data = b"".join(audio_chunks)
             logger.info(f"✅ Sarvam TTS: Generated {len(audio_data)} bytes from {chunk_count} chunks")
+            trace_span.set(chunks=chunk_count, mp3_bytes=len(audio_data))
             
             return audio_data
     
     except ImportError:
         logger.error("❌ Sarvam SDK not installed. Install with: pip install sarvamai")
+        trace_span.fail("sarvamai not installed")
         return None
     except Exception as e:
         logger.error(f"❌ Sarvam TTS error: {e}")
         import traceback
         logger.error(traceback.format_exc())
+        trace_span.fail(str(e))
         return None
+    finally:
+        trace_span.end()
 
 
 async def text_to_speech_hybrid(text: str, language_code: str = 'en') -> Optional[bytes]:
@@ -166,4 +179,8 @@ async def text_to_speech_hybrid(text: str, language_code: str = 'en') -> Optiona
     from server import text_to_speech_elevenlabs
     
     logger.info(f"🌍 Using ElevenLabs for {language_code} (Sarvam disabled)")
-    return await text_to_speech_elevenlabs(text, language_code)
+    with tracing.span("tts_provider", provider="elevenlabs", language=language_code) as trace_span:
+        audio = await text_to_speech_elevenlabs(text, language_code)
+        if not audio:
+            trace_span.fail("no audio")
+        return audio
@@ -0,0 +1,179 @@
+"""
+Training Scenario Pool
+Keeps TRAINING_POOL_SIZE ready-made openings (scenario, chat history, caller's
+first line) per incident category, refilled in the background at a bounded
+rate and persisted to disk, so /training/start is a pop instead of a Gemini
+round trip. Filtered selection is delegated to the indexed ScenarioStore
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+from config import config
+from metrics import registry
+from scenario_store import ScenarioStore, township_of
+
+logger = logging.getLogger(__name__)
+
+TRAINING_POOL_SIZE = int(config.get("TRAINING_POOL_SIZE", "3"))
+TRAINING_POOL_REFILL_PER_MINUTE = float(config.get("TRAINING_POOL_REFILL_PER_MINUTE", "12"))
+TRAINING_POOL_FILE = config.get("TRAINING_POOL_FILE", "training_pool.json")
+
+# Back off this long when a pregeneration fails or trainees need the model slots
+REFILL_BACKOFF_SECONDS = 30.0
+
+pool_hits = registry.counter("training_pool_hits_total", "Training starts served from the pregenerated pool")
+pool_misses = registry.counter("training_pool_misses_total", "Training starts that had to generate their opening live")
+pool_generated = registry.counter("training_pool_generated_total", "Openings pregenerated for the pool")
+
+
+class ScenarioPool:
+    def __init__(self, store: ScenarioStore, llm, size: int = TRAINING_POOL_SIZE,
+                 path: Optional[str] = TRAINING_POOL_FILE, refill_per_minute: float = TRAINING_POOL_REFILL_PER_MINUTE):
+        self.store = store
+        self.llm = llm
+        self.size = size
+        self.path = path
+        self.interval = 60.0 / refill_per_minute if refill_per_minute > 0 else 0.0
+        self.ready: Dict[str, Deque[dict]] = {category: deque() for category in store.categories()}
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._dirty = False
+
+    # ---- selection ----
+
+    def categories(self) -> List[str]:
+        return self.store.categories()
+
+    def select(self, category: Optional[str] = None, township: Optional[str] = None,
+               title: Optional[str] = None) -> Optional[dict]:
+        """Random scenario matching the filters (None if nothing matches)"""
+        picked = self.store.sample(1, category=category, township=township, title=title)
+        return picked[0] if picked else None
+
+    def pop(self, category: Optional[str] = None, township: Optional[str] = None,
+            title: Optional[str] = None) -> Optional[dict]:
+        """A ready bundle matching the filters, or None (caller generates live)"""
+        if category:
+            queues = [self.ready.get(self.store.category_key(category) or category, deque())]
+        else:
+            # Draw from a random category so trainees don't all get the best-stocked one
+            queues = [q for q in self.ready.values() if q]
+            random.shuffle(queues)
+        wanted_township = township.strip().upper() if township else None
+        wanted_title = title.strip().lower() if title else None
+        for ready in queues:
+            for bundle in ready:
+                if wanted_township and township_of(bundle["scenario"]) != wanted_township:
+                    continue
+                if wanted_title and wanted_title not in (bundle["scenario"].get("title") or "").lower():
+                    continue
+                ready.remove(bundle)
+                pool_hits.inc()
+                self._dirty = True
+                self._wake.set()
+                return bundle
+        pool_misses.inc()
+        return None
+
+    # ---- persistence ----
+
+    def load(self):
+        """Restore bundles generated by a previous run (same model only)"""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        except Exception as e:
+            logger.error(f"❌ Could not load training pool from {self.path}: {e}")
+            return
+        restored = 0
+        for category, bundles in saved.get("ready", {}).items():
+            if category not in self.ready:
+                continue
+            for bundle in bundles[:self.size]:
+                if bundle.get("model") == self.llm.model:
+                    self.ready[category].append(bundle)
+                    restored += 1
+        logger.info(f"🎓 Restored {restored} pregenerated training openings from {self.path}")
+
+    def _write(self, snapshot: dict):
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+    async def save(self):
+        if not self.path or not self._dirty:
+            return
+        self._dirty = False
+        snapshot = {"saved_at": time.time(), "ready": {category: list(ready) for category, ready in self.ready.items()}}
+        try:
+            await asyncio.to_thread(self._write, snapshot)
+        except Exception as e:
+            logger.error(f"❌ Could not save training pool to {self.path}: {e}")
+
+    # ---- background refill ----
+
+    def start(self):
+        if self._task is None and self.size > 0 and self.ready:
+            self._task = asyncio.create_task(self._refill_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        await self.save()
+
+    def _neediest(self) -> Optional[str]:
+        category = min(self.ready, key=lambda c: len(self.ready[c]))
+        return category if len(self.ready[category]) < self.size else None
+
+    async def _refill_loop(self):
+        try:
+            while True:
+                category = self._neediest()
+                if category is None:
+                    await self.save()
+                    self._wake.clear()
+                    await self._wake.wait()
+                    continue
+                if self.llm.busy:
+                    # Live trainees first
+                    await asyncio.sleep(REFILL_BACKOFF_SECONDS)
+                    continue
+                scenario = self.select(category)
+                try:
+                    history, opening = await self.llm.opening(scenario)
+                except Exception as e:
+                    logger.warning(f"⚠️ Training pool pregeneration failed for {category}: {e}")
+                    await asyncio.sleep(REFILL_BACKOFF_SECONDS)
+                    continue
+                self.ready[category].append({
+                    "scenario": scenario,
+                    "history": history,
+                    "opening": opening,
+                    "model": self.llm.model,
+                    "created_at": time.time(),
+                })
+                pool_generated.inc(category=category)
+                self._dirty = True
+                await self.save()
+                # Rate limit: at most TRAINING_POOL_REFILL_PER_MINUTE generations
+                await asyncio.sleep(self.interval)
+        except asyncio.CancelledError:
+            pass
+
+    def stats(self) -> dict:
+        return {
+            "size_per_category": self.size,
+            "ready": {category: len(ready) for category, ready in sorted(self.ready.items())},
+            "scenarios": {category: self.store.count_matching(category=category) for category in self.categories()},
+            "refilling": self._task is not None,
+        }
@@ -0,0 +1,325 @@
+"""
+Training Scenario Store
+The 911 dataset compiled once into a directory of memory-mapped numpy columns
+(ids into small string tables, numeric fields, UTF-8 blobs for free text)
+plus sorted secondary indexes on title, category, township, zip and time.
+Opening it reads only the string tables; records are materialized on demand,
+so startup cost stays flat as the dataset grows
+"""
+import json
+import logging
+import os
+import shutil
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+SCENARIO_SOURCE = config.get("TRAINING_SCENARIOS_FILE", "911_calls.json")
+SCENARIO_STORE_DIR = config.get("SCENARIO_STORE_DIR", "911_calls.store")
+
+STORE_VERSION = 1
+INDEXED = ("title", "category", "twp", "zip", "ts")
+TEXT_FIELDS = ("desc", "addr")
+MISSING_ZIP = -1
+MISSING_TS = np.iinfo(np.int64).min
+
+# Generator.choice(replace=False) samples k of n without permuting all n rows
+_rng = np.random.default_rng()
+
+
+def category_of(title: str) -> str:
+    """Incident category from the dataset title, e.g. "EMS: CARDIAC EMERGENCY" -> "EMS" """
+    category = (title or "").split(":", 1)[0].strip()
+    return category or "Other"
+
+
+def township_of(scenario: dict) -> str:
+    return (scenario.get("twp") or "").strip().upper()
+
+
+def _parse_zip(value) -> int:
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return MISSING_ZIP
+
+
+def _parse_ts(value) -> int:
+    try:
+        return int(datetime.fromisoformat(str(value)).timestamp())
+    except (TypeError, ValueError):
+        return MISSING_TS
+
+
+def _source_signature(source: str) -> dict:
+    stat = os.stat(source)
+    return {"path": os.path.abspath(source), "size": stat.st_size, "mtime": int(stat.st_mtime)}
+
+
+def build_store(source: str, store_dir: str) -> str:
+    """Compile the JSON dataset into `store_dir` (written to a temp dir, then swapped in)"""
+    started = time.perf_counter()
+    with open(source, "r", encoding="utf-8") as f:
+        records = json.load(f)
+    count = len(records)
+
+    tables: Dict[str, Dict[str, int]] = {"title": {}, "category": {}, "twp": {}}
+
+    def intern(table: str, value: str) -> int:
+        ids = tables[table]
+        found = ids.get(value)
+        if found is None:
+            found = ids[value] = len(ids)
+        return found
+
+    columns = {
+        "title": np.empty(count, dtype=np.int32),
+        "category": np.empty(count, dtype=np.int16),
+        "twp": np.empty(count, dtype=np.int32),
+        "zip": np.empty(count, dtype=np.int32),
+        "ts": np.empty(count, dtype=np.int64),
+        "lat": np.empty(count, dtype=np.float32),
+        "lng": np.empty(count, dtype=np.float32),
+    }
+    blobs = {field: bytearray() for field in TEXT_FIELDS}
+    offsets = {field: np.empty(count + 1, dtype=np.int64) for field in TEXT_FIELDS}
+    for field in TEXT_FIELDS:
+        offsets[field][0] = 0
+
+    for row, record in enumerate(records):
+        title = (record.get("title") or "").strip()
+        columns["title"][row] = intern("title", title)
+        columns["category"][row] = intern("category", category_of(title))
+        columns["twp"][row] = intern("twp", township_of(record))
+        columns["zip"][row] = _parse_zip(record.get("zip"))
+        columns["ts"][row] = _parse_ts(record.get("timeStamp"))
+        columns["lat"][row] = record.get("lat") or np.nan
+        columns["lng"][row] = record.get("lng") or np.nan
+        for field in TEXT_FIELDS:
+            blobs[field] += (record.get(field) or "").encode("utf-8")
+            offsets[field][row + 1] = len(blobs[field])
+    del records
+
+    tmp_dir = f"{store_dir}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for name, column in columns.items():
+        np.save(os.path.join(tmp_dir, f"{name}.npy"), column)
+    for field in TEXT_FIELDS:
+        with open(os.path.join(tmp_dir, f"{field}.bin"), "wb") as f:
+            f.write(blobs[field])
+        np.save(os.path.join(tmp_dir, f"{field}.offsets.npy"), offsets[field])
+    for name in INDEXED:
+        order = np.argsort(columns[name], kind="stable").astype(np.int64)
+        np.save(os.path.join(tmp_dir, f"{name}.order.npy"), order)
+        np.save(os.path.join(tmp_dir, f"{name}.sorted.npy"), columns[name][order])
+
+    strings = {table: [value for value, _ in sorted(ids.items(), key=lambda kv: kv[1])] for table, ids in tables.items()}
+    with open(os.path.join(tmp_dir, "strings.json"), "w", encoding="utf-8") as f:
+        json.dump(strings, f, ensure_ascii=False)
+    with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"version": STORE_VERSION, "count": count, "source": _source_signature(source),
+                   "built_at": time.time()}, f)
+
+    shutil.rmtree(store_dir, ignore_errors=True)
+    os.replace(tmp_dir, store_dir)
+    logger.info(f"🗂️ Built scenario store {store_dir}: {count} records in {time.perf_counter() - started:.1f}s")
+    return store_dir
+
+
+class ScenarioStore:
+    """Read-only, memory-mapped view of a built store"""
+
+    def __init__(self, store_dir: str):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        with open(os.path.join(store_dir, "strings.json"), "r", encoding="utf-8") as f:
+            self.strings: Dict[str, List[str]] = json.load(f)
+        self.count = self.meta["count"]
+        self._lookup = {table: {value: i for i, value in enumerate(values)} for table, values in self.strings.items()}
+        self._arrays: Dict[str, np.ndarray] = {}
+        self._blobs: Dict[str, np.memmap] = {}
+
+    @classmethod
+    def ensure(cls, source: str, store_dir: Optional[str] = None) -> "ScenarioStore":
+        """Open the store for `source`, (re)building it if missing or older than the source"""
+        store_dir = store_dir or f"{os.path.splitext(source)[0]}.store"
+        meta_path = os.path.join(store_dir, "meta.json")
+        stale = True
+        if os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            current = _source_signature(source) if os.path.exists(source) else meta.get("source")
+            stale = meta.get("version") != STORE_VERSION or meta.get("source") != current
+        if stale:
+            build_store(source, store_dir)
+        return cls(store_dir)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _array(self, name: str) -> np.ndarray:
+        array = self._arrays.get(name)
+        if array is None:
+            array = self._arrays[name] = np.load(os.path.join(self.store_dir, f"{name}.npy"), mmap_mode="r")
+        return array
+
+    def _text(self, field: str, row: int) -> str:
+        blob = self._blobs.get(field)
+        if blob is None:
+            path = os.path.join(self.store_dir, f"{field}.bin")
+            if os.path.getsize(path) == 0:
+                return ""
+            blob = self._blobs[field] = np.memmap(path, dtype=np.uint8, mode="r")
+        offsets = self._array(f"{field}.offsets")
+        return bytes(blob[offsets[row]:offsets[row + 1]]).decode("utf-8")
+
+    # ---- records ----
+
+    def record(self, row: int) -> dict:
+        """Row as a dataset-shaped scenario dict (title / desc / twp / zip / addr / timeStamp / lat / lng)"""
+        row = int(row)
+        zip_code = int(self._array("zip")[row])
+        ts = int(self._array("ts")[row])
+        lat, lng = float(self._array("lat")[row]), float(self._array("lng")[row])
+        return {
+            "title": self.strings["title"][self._array("title")[row]],
+            "desc": self._text("desc", row),
+            "twp": self.strings["twp"][self._array("twp")[row]],
+            "zip": None if zip_code == MISSING_ZIP else zip_code,
+            "addr": self._text("addr", row),
+            "timeStamp": None if ts == MISSING_TS else datetime.fromtimestamp(ts).isoformat(sep=" "),
+            "lat": None if np.isnan(lat) else lat,
+            "lng": None if np.isnan(lng) else lng,
+        }
+
+    def categories(self) -> List[str]:
+        return sorted(self.strings["category"])
+
+    def townships(self) -> List[str]:
+        return sorted(t for t in self.strings["twp"] if t)
+
+    def category_key(self, category: str) -> Optional[str]:
+        """Dataset spelling of a category, matched case-insensitively"""
+        wanted = category.strip().lower()
+        return next((c for c in self.strings["category"] if c.lower() == wanted), None)
+
+    # ---- filtered lookup ----
+
+    def _ranges(self, name: str, low, high) -> List[Tuple[int, int]]:
+        """Positions in the sorted index with low <= key <= high"""
+        keys = self._array(f"{name}.sorted")
+        start = int(np.searchsorted(keys, low, side="left"))
+        end = int(np.searchsorted(keys, high, side="right"))
+        return [(start, end)] if end > start else []
+
+    def _id_ranges(self, name: str, ids: List[int]) -> List[Tuple[int, int]]:
+        ranges = []
+        for value in ids:
+            ranges.extend(self._ranges(name, value, value))
+        return ranges
+
+    def _constraints(self, category: Optional[str] = None, title: Optional[str] = None, township: Optional[str] = None,
+                     zip_code: Optional[int] = None, since: Optional[float] = None,
+                     until: Optional[float] = None) -> Optional[List[Tuple[str, List[Tuple[int, int]]]]]:
+        """Index ranges per filter, or None if a filter matches nothing"""
+        constraints = []
+        if category:
+            key = self.category_key(category)
+            if key is None:
+                return None
+            constraints.append(("category", self._id_ranges("category", [self._lookup["category"][key]])))
+        if title:
+            wanted = title.strip().lower()
+            ids = [i for i, value in enumerate(self.strings["title"]) if wanted in value.lower()]
+            constraints.append(("title", self._id_ranges("title", ids)))
+        if township:
+            twp_id = self._lookup["twp"].get(township.strip().upper())
+            if twp_id is None:
+                return None
+            constraints.append(("twp", self._id_ranges("twp", [twp_id])))
+        if zip_code is not None:
+            constraints.append(("zip", self._ranges("zip", int(zip_code), int(zip_code))))
+        if since is not None or until is not None:
+            low = int(since) if since is not None else MISSING_TS + 1
+            high = int(until) if until is not None else np.iinfo(np.int64).max
+            constraints.append(("ts", self._ranges("ts", low, high)))
+        if any(not ranges for _, ranges in constraints):
+            return None
+        return constraints
+
+    def match_rows(self, **filters) -> np.ndarray:
+        """
+        Row ids matching every filter: category, title (case-insensitive substring,
+        e.g. "cardiac"), township, zip_code, since / until (epoch seconds)
+        """
+        constraints = self._constraints(**filters)
+        if constraints is None:
+            return np.empty(0, dtype=np.int64)
+        if not constraints:
+            return np.arange(self.count, dtype=np.int64)
+
+        # Drive from the most selective index, then check the rest against the columns
+        constraints.sort(key=lambda c: sum(end - start for start, end in c[1]))
+        name, ranges = constraints[0]
+        order = self._array(f"{name}.order")
+        rows = np.concatenate([order[start:end] for start, end in ranges])
+        for name, ranges in constraints[1:]:
+            keys = self._array(f"{name}.sorted")
+            values = self._array(name)[rows]
+            mask = np.zeros(len(rows), dtype=bool)
+            for start, end in ranges:
+                mask |= (values >= keys[start]) & (values <= keys[end - 1])
+            rows = rows[mask]
+        return rows
+
+    def count_matching(self, **filters) -> int:
+        constraints = self._constraints(**filters)
+        if constraints is None:
+            return 0
+        if not constraints:
+            return self.count
+        if len(constraints) == 1:
+            # Answered from the index alone
+            return sum(end - start for start, end in constraints[0][1])
+        return len(self.match_rows(**filters))
+
+    def sample(self, k: int = 1, **filters) -> List[dict]:
+        """Up to k distinct random scenarios matching the filters (see match_rows)"""
+        constraints = self._constraints(**filters)
+        if constraints is None or not self.count:
+            return []
+        if not constraints:
+            rows = _rng.choice(self.count, size=min(k, self.count), replace=False)
+        elif len(constraints) == 1:
+            # Pick positions inside the index ranges without materializing the matches
+            _, ranges = constraints[0]
+            sizes = np.array([end - start for start, end in ranges])
+            picks = _rng.choice(int(sizes.sum()), size=min(k, int(sizes.sum())), replace=False)
+            bounds = np.cumsum(sizes)
+            which = np.searchsorted(bounds, picks, side="right")
+            starts = np.array([start for start, _ in ranges])
+            positions = starts[which] + picks - (bounds[which] - sizes[which])
+            rows = self._array(f"{constraints[0][0]}.order")[positions]
+        else:
+            matches = self.match_rows(**filters)
+            if not len(matches):
+                return []
+            rows = _rng.choice(matches, size=min(k, len(matches)), replace=False)
+        return [self.record(row) for row in rows]
+
+    def stats(self) -> dict:
+        return {
+            "records": self.count,
+            "titles": len(self.strings["title"]),
+            "townships": len(self.strings["twp"]),
+            "categories": {c: self.count_matching(category=c) for c in self.categories()},
+            "built_at": self.meta.get("built_at"),
+        }
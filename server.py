@@ -10,24 +10,39 @@ import base64
 import audioop
 import wave
 import logging
+import uuid
 from datetime import datetime
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Request, status
-from fastapi.responses import Response, JSONResponse, StreamingResponse
+from fastapi.responses import Response, JSONResponse, StreamingResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
 from dotenv import load_dotenv
 import asyncio
-import threading
-from queue import Queue
 from typing import Dict, Set, Optional
 from pydantic import BaseModel, Field, validator
 import websockets
-import traceback
 
 # Import training functions
-from training import load_scenarios, select_random_scenario
+from scenario_store import ScenarioStore, SCENARIO_SOURCE, SCENARIO_STORE_DIR
+from training_llm import TrainingLLM, TrainingTimeout, caller_prompt
+from session_store import TrainingSessionStore, add_exchange
+from scenario_pool import ScenarioPool
+import language_id
+from call_context import CallContext, CallRegistry, find_leaks, live_context_count
+from capacity import CapacityManager
+from call_queue import CallQueue
+from subscriptions import NOTIFICATIONS, Subscriber, SubscriptionHub, call_topics
+from vad import VAD_ENABLED, StreamingVAD
+from outbound import media_message, record_sent, take_batch
+from replay import catchup_seconds
+from audio_codecs import CODECS, MULAW, OPUS, OpusStream, audio_kind, audio_topic, negotiate
+from metrics import registry as metrics_registry
+from logging_setup import RateLimitedLogger, bind_call, configure_logging
+from loop_monitor import EndpointTagMiddleware, LoopMonitor
+from profiler import FORMATS, MODES, ProfilerBusy, RuntimeProfiler
+import tracing
 from google import genai
 from config import config
 
@@ -35,16 +50,14 @@ from config import config
 # Load environment variables
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler('server.log')
-    ]
-)
+# Configure logging (formatting and disk/console I/O happen on a background thread)
+configure_logging(logging.INFO, "server.log")
 logger = logging.getLogger(__name__)
+hot_log = RateLimitedLogger(logger, interval=10.0)  # Per-packet / per-request lines
+
+# Per-call spans (dispatcher turn -> translate -> TTS -> decode -> queue -> Twilio) to JSONL or OTLP
+tracing.configure_tracing(config.get("TRACE_EXPORTER", "none"), config.get("TRACE_FILE", "traces.jsonl"),
+                          config.get("OTLP_ENDPOINT", "http://localhost:4318"))
 
 # Environment variables with validation
 DEEPGRAM_API_KEY = config.get("DEEPGRAM_API_KEY")
@@ -56,6 +69,7 @@ PORT = int(config.get("PORT", "8000"))
 ENVIRONMENT = config.get("ENVIRONMENT", "development")
 ALLOWED_ORIGINS = config.get("ALLOWED_ORIGINS", "*").split(",")
 NGROK_URL = config.get("NGROK_URL")
+ADMIN_TOKEN = config.get("ADMIN_TOKEN", "")
 
 # Audio configuration - Using 16kHz for wideband quality (clearer voice)
 CHUNK = 320  # Doubled for 16kHz (was 160 for 8kHz)
@@ -64,28 +78,66 @@ CHANNELS = 1
 RATE = int(config.get("AUDIO_RATE", "16000"))  # 16kHz wideband quality (optimal for 8kHz upsampling)
 
 # Global state - BROWSER-ONLY MODE (no laptop audio)
-phone_audio_recording = []
-recording_lock = threading.Lock()
-audio_to_phone = Queue(maxsize=500)  # Large buffer for translated audio (71 chunks per sentence avg)
-sessions: Dict[str, dict] = {}
-transcription_clients: Dict[str, Set[WebSocket]] = {}
-notification_clients: Set[WebSocket] = set()
-active_transcribers: Dict[str, dict] = {}
-browser_transcribers: Dict[str, dict] = {}  # Separate transcribers for browser audio
+sessions: Dict[str, dict] = {}  # Maps call_sid -> caller metadata from /twiml until the stream starts
+calls = CallRegistry()  # Live calls (transcribers, outbound audio, recording, language state)
+console_hub = SubscriptionHub()  # Dashboard consoles by topic (notifications, call:*, agency:*, audio:*)
 ngrok_process = None
 WS_URL = None
 
+# Seconds after hangup before a still-referenced CallContext is reported as leaked
+CALL_LEAK_GRACE_SECONDS = 60
+
+# Seconds an admitted call may take to open its media stream before it stops counting against capacity
+PENDING_CALL_TIMEOUT = 30
+
+
+def admitted_call_count() -> int:
+    """Live calls plus calls admitted by /twiml whose stream hasn't started yet"""
+    now = time.time()
+    for call_sid in [sid for sid, s in sessions.items() if now - s.get("admitted_at", now) > PENDING_CALL_TIMEOUT]:
+        sessions.pop(call_sid, None)
+    return len(calls) + len(sessions)
+
+
+# Admission control: live load vs. budgets, consulted by /twiml
+capacity = CapacityManager(
+    active_calls=admitted_call_count,
+    outbound_depth=lambda: max((call.outbound.qsize() for call in calls.all()), default=0),
+    loop_lag_ms=lambda: loop_monitor.smoothed_lag_ms
+)
+metrics_registry.gauge("active_calls", "Live calls on this node", lambda: len(calls))
+
+# Triage-ordered queue of calls waiting for an operator
+call_queue = CallQueue()
+
+# Event loop stalls, attributed to the endpoint / call that was running (/debug/loop)
+loop_monitor = LoopMonitor()
+
+# On-demand cpu / wall / alloc profiling windows (/debug/profile)
+runtime_profiler = RuntimeProfiler()
+
+# Barge-in: caller speech over playing TTS clears it (Deepgram SpeechStarted or local VAD onset);
+# dispatcher speech is held and replayed once the caller finishes, or after BARGE_IN_HOLD_SECONDS
+BARGE_IN_ENABLED = config.get("BARGE_IN_ENABLED", "true").lower() == "true"
+BARGE_IN_MIN_SPEECH_MS = int(config.get("BARGE_IN_MIN_SPEECH_MS", "200"))
+BARGE_IN_HOLD_SECONDS = float(config.get("BARGE_IN_HOLD_SECONDS", "8"))
+barge_in_counter = metrics_registry.counter("barge_in_total", "TTS playback interrupted by caller speech")
+
+# Inbound network quality per call (reported to consoles every NETWORK_STATS_FRAMES frames)
+NETWORK_STATS_FRAMES = 250  # 5s of 20ms frames
+jitter_gauge = metrics_registry.gauge("inbound_jitter_ms", "RFC 3550 interarrival jitter of caller media (ms)")
+loss_gauge = metrics_registry.gauge("inbound_loss_fraction", "Fraction of caller media frames concealed as lost")
+
 # Translation and TTS state
-caller_languages: Dict[str, str] = {}  # Maps caller_number -> detected language code
-dispatcher_languages: Dict[str, str] = {}  # Maps caller_number -> dispatcher's detected language
-dispatcher_should_translate: Dict[str, bool] = {}  # Maps caller_number -> whether to translate
 ELEVENLABS_API_KEY = config.get("ELEVENLABS_API_KEY")
 ELEVENLABS_VOICE = config.get("ELEVENLABS_VOICE", "uYXf8XasLslADfZ2MB4u")
 
 # Training state
-training_sessions: Dict[str, dict] = {}  # Maps session_id -> training session data
-training_scenarios = None  # Will be loaded on startup
+training_sessions: Optional[TrainingSessionStore] = None  # session_id -> session, evicting and persisted to SQLite
+training_store: Optional[ScenarioStore] = None  # Memory-mapped 911 scenarios, opened on startup
 training_client = None  # Gemini client for training
+training_llm: Optional[TrainingLLM] = None  # Async chats with per-node concurrency cap and timeouts
+scenario_pool: Optional[ScenarioPool] = None  # Pregenerated openings per incident category
 
 
 
@@ -101,19 +153,27 @@ async def lifespan(app: FastAPI):
     logger.info("📱 All audio will be routed through web browser")
     
     # Initialize training system
-    global training_scenarios, training_client
+    global training_store, training_client, training_llm, scenario_pool, training_sessions
     try:
-        training_scenarios = load_scenarios("911_calls.json")
         if GOOGLE_API_KEY:
+            # Builds the store on first run / when the dataset changes, otherwise just maps it
+            training_store = await asyncio.to_thread(ScenarioStore.ensure, SCENARIO_SOURCE, SCENARIO_STORE_DIR)
             training_client = genai.Client(api_key=GOOGLE_API_KEY)
-            logger.info(f"✅ Training system initialized with {len(training_scenarios)} scenarios")
+            training_llm = TrainingLLM(training_client)
+            training_sessions = TrainingSessionStore(training_llm.new_chat)
+            scenario_pool = ScenarioPool(training_store, training_llm)
+            scenario_pool.load()
+            logger.info(f"✅ Training system initialized with {len(training_store)} scenarios")
         else:
             logger.warning("⚠️ GOOGLE_API_KEY not set, training system disabled")
-            training_scenarios = []
     except Exception as e:
-        logger.error(f"⚠️ Failed to initialize training system: {e}")
-        logger.error(traceback.format_exc())
-        training_scenarios = []
+        logger.error(f"⚠️ Failed to initialize training system: {e}", exc_info=True)
+        training_store = None
+    
+    # Warm up early language identification model in its worker pool
+    if language_id.LANGUAGE_ID_ENABLED:
+        language_id.warm_up()
+        logger.info(f"🗣️ Early language ID enabled (model: {language_id.LANGUAGE_ID_MODEL}, threshold: {language_id.LANGUAGE_ID_THRESHOLD})")
     
     # Setup ngrok if needed
     domain = NGROK_URL
@@ -138,8 +198,24 @@ async def lifespan(app: FastAPI):
     logger.info(f"📞 WebSocket URL: {WS_URL}")
     logger.info(f"🌐 Browser audio mode: All audio routed through web interface")
     
+    leak_task = asyncio.create_task(watch_call_leaks())
+    console_hub.start()
+    loop_monitor.start()
+    if scenario_pool:
+        scenario_pool.start()
+    if training_sessions:
+        training_sessions.start()
+    
     yield
     
+    leak_task.cancel()
+    console_hub.stop()
+    loop_monitor.stop()
+    if scenario_pool:
+        await scenario_pool.stop()
+    if training_sessions:
+        await training_sessions.stop()
+    
     # Shutdown
     logger.info("🛑 Shutting down server...")
     
@@ -151,23 +227,15 @@ async def lifespan(app: FastAPI):
         except Exception as e:
             logger.error(f"Error stopping ngrok: {e}")
     
-    # Stop transcribers
-    for transcribers in list(active_transcribers.values()):
-        if transcribers.get("phone_transcriber"):
-            try:
-                await transcribers["phone_transcriber"].stop()
-            except Exception as e:
-                logger.error(f"Error stopping phone transcriber: {e}")
-    
-    for transcribers in list(browser_transcribers.values()):
-        if transcribers.get("browser_transcriber"):
-            try:
-                await transcribers["browser_transcriber"].stop()
-            except Exception as e:
-                logger.error(f"Error stopping browser transcriber: {e}")
+    # End calls that are still live (stops transcribers, saves transcripts and recordings)
+    for call in calls.all():
+        try:
+            await end_call(call)
+        except Exception as e:
+            logger.error(f"Error ending call {call.call_sid}: {e}")
     
-    # Save recordings
-    save_recordings()
+    # Stop language identification workers
+    language_id.shutdown()
     
     logger.info("✅ Server shutdown complete")
 
@@ -193,6 +261,9 @@ app.add_middleware(
 
 app.add_middleware(GZipMiddleware, minimum_size=1000)
 
+# Tags each request/WebSocket task with its endpoint for loop stall attribution
+app.add_middleware(EndpointTagMiddleware)
+
 if ENVIRONMENT == "production":
     app.add_middleware(
         TrustedHostMiddleware,
@@ -204,6 +275,7 @@ if ENVIRONMENT == "production":
 class AudioStreamRequest(BaseModel):
     audio: str = Field(..., description="Base64 encoded audio data")
     caller_number: str = Field(..., description="Caller phone number")
+    call_sid: Optional[str] = Field(None, description="Call SID (disambiguates calls from the same number)")
     
     @validator('audio')
     def validate_audio(cls, v):
@@ -237,6 +309,9 @@ class RecordingResponse(BaseModel):
 # Training models
 class TrainingStartRequest(BaseModel):
     session_id: str = Field(..., description="Unique session identifier")
+    category: Optional[str] = Field(None, description="Incident category (e.g. EMS, Fire, Traffic)")
+    township: Optional[str] = Field(None, description="Township the incident happened in")
+    title: Optional[str] = Field(None, description="Substring of the incident title (e.g. cardiac)")
 
 
 class TrainingMessageRequest(BaseModel):
@@ -418,27 +493,27 @@ def update_twilio_webhook(domain):
         return False
 
 
-def save_recordings():
-    """Save audio recordings to WAV files"""
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+def save_recording(frames: list, caller_number: str, timestamp: str):
+    """Save a call's phone audio to a WAV file"""
+    if not frames:
+        return
+    
     recordings_dir = config.get("RECORDINGS_DIR", "recordings")
     
     # Create recordings directory if it doesn't exist
     os.makedirs(recordings_dir, exist_ok=True)
     
-    with recording_lock:
-        if phone_audio_recording:
-            phone_filename = os.path.join(recordings_dir, f"phone_{timestamp}.wav")
-            try:
-                wf = wave.open(phone_filename, "wb")
-                wf.setnchannels(CHANNELS)
-                wf.setsampwidth(2)
-                wf.setframerate(RATE)
-                wf.writeframes(b"".join(phone_audio_recording))
-                wf.close()
-                logger.info(f"💾 Phone audio saved: {phone_filename}")
-            except Exception as e:
-                logger.error(f"Failed to save phone recording: {e}")
+    phone_filename = os.path.join(recordings_dir, f"phone_{caller_number}_{timestamp}.wav")
+    try:
+        wf = wave.open(phone_filename, "wb")
+        wf.setnchannels(CHANNELS)
+        wf.setsampwidth(2)
+        wf.setframerate(RATE)
+        wf.writeframes(b"".join(frames))
+        wf.close()
+        logger.info(f"💾 Phone audio saved: {phone_filename}")
+    except Exception as e:
+        logger.error(f"Failed to save phone recording: {e}")
 
 
 def detect_language_from_text(text: str) -> str:
@@ -478,6 +553,36 @@ def detect_language_from_text(text: str) -> str:
     return 'en'
 
 
+def start_early_language_id(call: CallContext):
+    """Start audio-based language identification for a new caller"""
+    if not language_id.LANGUAGE_ID_ENABLED:
+        return
+    caller_number = call.caller_number
+
+    async def seed_caller_language(language: str, probability: float):
+        # Text-based detection from a final transcript takes precedence
+        if call.closed or call.caller_language:
+            return
+        call.caller_language = language
+        logger.info(f"🌍 Seeded caller language from audio: {language} (p={probability:.2f}) for {caller_number}")
+
+        message = {
+            "type": "language_detected",
+            "caller_number": caller_number,
+            "call_sid": call.call_sid,
+            "language": language,
+            "confidence": probability,
+            "source": "audio",
+            "timestamp": datetime.now().isoformat()
+        }
+        await console_hub.publish(call_topics(call.call_sid, caller_number, call.agency), message)
+
+    call.language_identifier = language_id.EarlyLanguageIdentifier(
+        caller_number, RATE, seed_caller_language, asyncio.get_event_loop(),
+        spawn=lambda coro: call.spawn(coro, name="language_id")
+    )
+
+
 async def translate_text(text: str, source_lang: str, target_lang: str) -> str:
     """Translate text using MyMemory API (free, no API key required)"""
     if not text or not text.strip():
@@ -487,25 +592,31 @@ async def translate_text(text: str, source_lang: str, target_lang: str) -> str:
     if source_lang == target_lang:
         return text
     
-    try:
-        lang_pair = f"{source_lang}|{target_lang}"
-        encoded_text = requests.utils.quote(text)
-        url = f"https://api.mymemory.translated.net/get?q={encoded_text}&langpair={lang_pair}"
-        
-        response = requests.get(url, timeout=5)
-        
-        if response.status_code == 200:
-            data = response.json()
-            if data.get("responseStatus") == 200:
-                translated = data.get("responseData", {}).get("translatedText", text)
-                logger.info(f"🌐 Translated ({source_lang}->{target_lang}): {text[:30]}... -> {translated[:30]}...")
-                return translated
-        
-        logger.warning(f"Translation failed, using original text")
-        return text
-    except Exception as e:
-        logger.error(f"Translation error: {e}")
-        return text
+    with tracing.span("translate", provider="mymemory", source_language=source_lang, target_language=target_lang) as trace_span:
+        try:
+            lang_pair = f"{source_lang}|{target_lang}"
+            encoded_text = requests.utils.quote(text)
+            url = f"https://api.mymemory.translated.net/get?q={encoded_text}&langpair={lang_pair}"
+            
+            started = time.perf_counter()
+            response = requests.get(url, timeout=5)
+            capacity.record_provider_latency("translation", time.perf_counter() - started)
+            trace_span.set(http_status=response.status_code)
+            
+            if response.status_code == 200:
+                data = response.json()
+                if data.get("responseStatus") == 200:
+                    translated = data.get("responseData", {}).get("translatedText", text)
+                    logger.info(f"🌐 Translated ({source_lang}->{target_lang}): {text[:30]}... -> {translated[:30]}...")
+                    return translated
+            
+            logger.warning(f"Translation failed, using original text")
+            trace_span.fail()
+            return text
+        except Exception as e:
+            logger.error(f"Translation error: {e}")
+            trace_span.fail(str(e))
+            return text
 
 
 async def text_to_speech_elevenlabs(text: str, language_code: str = 'en') -> Optional[bytes]:
@@ -582,20 +693,26 @@ async def text_to_speech_elevenlabs(text: str, language_code: str = 'en') -> Opt
         logger.error("❌ ElevenLabs library not installed. Install with: pip install elevenlabs")
         return None
     except Exception as e:
-        logger.error(f"❌ ElevenLabs TTS error: {e}")
-        import traceback
-        logger.error(traceback.format_exc())
+        logger.error(f"❌ ElevenLabs TTS error: {e}", exc_info=True)
         return None
 
 
-async def convert_and_queue_translated_audio(text: str, language_code: str, caller_number: str):
-    """Convert translated text to speech and queue it for phone delivery"""
+async def convert_and_queue_translated_audio(text: str, language_code: str, call: CallContext,
+                                             utterance_id: Optional[str] = None):
+    """Convert translated text to speech and queue it for phone delivery (followed by a mark)"""
     try:
         # Import Sarvam TTS hybrid function
         from sarvam_tts import text_to_speech_hybrid
         
         # Generate speech using hybrid TTS (Sarvam for Indian languages, ElevenLabs for others)
-        audio_mp3 = await text_to_speech_hybrid(text, language_code)
+        with tracing.span("tts", language=language_code, chars=len(text)) as trace_span:
+            started = time.perf_counter()
+            audio_mp3 = await text_to_speech_hybrid(text, language_code)
+            capacity.record_provider_latency("tts", time.perf_counter() - started)
+            if audio_mp3:
+                trace_span.set(mp3_bytes=len(audio_mp3))
+            else:
+                trace_span.fail("no audio")
         
         if not audio_mp3:
             logger.warning("Failed to generate audio, skipping")
@@ -606,77 +723,72 @@ async def convert_and_queue_translated_audio(text: str, language_code: str, call
             from pydub import AudioSegment
             import io
             
-            # Load MP3 audio
-            audio_segment = AudioSegment.from_mp3(io.BytesIO(audio_mp3))
-            
-            # Convert to 8kHz mono PCM16 (Twilio's native format)
-            audio_segment = audio_segment.set_frame_rate(8000).set_channels(1).set_sample_width(2)
-            
-            # Get raw PCM data
-            pcm_8khz = audio_segment.raw_data
-            
-            # Convert to μ-law for Twilio
-            ulaw_data = audioop.lin2ulaw(pcm_8khz, 2)
+            with tracing.span("decode", codec="mp3") as trace_span:
+                # Load MP3 audio
+                audio_segment = AudioSegment.from_mp3(io.BytesIO(audio_mp3))
+                
+                # Convert to 8kHz mono PCM16 (Twilio's native format)
+                audio_segment = audio_segment.set_frame_rate(8000).set_channels(1).set_sample_width(2)
+                
+                # Get raw PCM data
+                pcm_8khz = audio_segment.raw_data
+                
+                # Convert to μ-law for Twilio
+                ulaw_data = audioop.lin2ulaw(pcm_8khz, 2)
+                trace_span.set(audio_ms=len(ulaw_data) // 8)
             
             # Split into 20ms chunks (160 bytes at 8kHz μ-law = 20ms)
             # Twilio expects audio in small chunks, not all at once
             chunk_size = 160  # 20ms of μ-law audio at 8kHz
             total_chunks = len(ulaw_data) // chunk_size
             
-            logger.info(f"📤 Queueing {total_chunks} audio chunks for {caller_number} ({language_code})")
-            logger.info(f"📊 Queue size before queueing: {audio_to_phone.qsize()}")
+            logger.info(f"📤 Queueing {total_chunks} audio chunks for {call.caller_number} ({language_code})")
+            logger.info(f"📊 Queue size before queueing: {call.outbound.qsize()}")
             
-            chunks_queued = 0
-            for i in range(0, len(ulaw_data), chunk_size):
-                chunk = ulaw_data[i:i + chunk_size]
-                
-                # Only queue full chunks (skip partial last chunk)
-                if len(chunk) == chunk_size:
-                    chunk_base64 = base64.b64encode(chunk).decode("utf-8")
-                    
-                    try:
-                        audio_to_phone.put_nowait(chunk_base64)
-                        chunks_queued += 1
-                    except Exception as e:
-                        # Queue full, drop oldest and add new
-                        logger.warning(f"Queue full ({audio_to_phone.qsize()}), dropping oldest chunk")
-                        try:
-                            audio_to_phone.get_nowait()
-                            audio_to_phone.put_nowait(chunk_base64)
-                            chunks_queued += 1
-                        except Exception as e2:
-                            logger.warning(f"Failed to queue chunk {i//chunk_size}: {e2}")
-                            pass
+            # Raw μ-law, full chunks only (skip partial last chunk); the sender batches and
+            # base64-encodes once per message. Kept on the utterance so a barge-in can replay it
+            frames = [ulaw_data[i:i + chunk_size] for i in range(0, total_chunks * chunk_size, chunk_size)]
+            utterance = call.utterances.get(utterance_id) if utterance_id else None
+            if utterance:
+                # Queue wait and playout are traced when the sender / Twilio reach the mark
+                utterance["audio"] = frames
+                utterance["queued_ns"] = time.time_ns()
+                utterance["queue_depth"] = call.outbound.qsize()
             
-            logger.info(f"✅ Queued {chunks_queued}/{total_chunks} translated audio chunks for {caller_number}")
-            logger.info(f"📊 Queue size after queueing: {audio_to_phone.qsize()}")
+            # Queue full drops the oldest chunk
+            chunks_queued = call.queue_utterance(utterance_id, frames)
+            if call.held_utterances is not None and utterance_id in call.held_utterances:
+                logger.info(f"✋ Caller is talking, holding utterance {utterance_id} until they finish")
+            else:
+                logger.info(f"✅ Queued {chunks_queued}/{total_chunks} translated audio chunks for {call.caller_number}")
+            logger.info(f"📊 Queue size after queueing: {call.outbound.qsize()}")
                     
         except ImportError:
             logger.error("pydub not installed. Install with: pip install pydub")
         except Exception as e:
-            logger.error(f"Audio conversion error: {e}")
-            import traceback
-            logger.error(traceback.format_exc())
+            logger.error(f"Audio conversion error: {e}", exc_info=True)
             
     except Exception as e:
-        logger.error(f"Error in convert_and_queue_translated_audio: {e}")
-        import traceback
-        logger.error(traceback.format_exc())
+        logger.error(f"Error in convert_and_queue_translated_audio: {e}", exc_info=True)
 
 
 # --- Deepgram Realtime (direct WebSocket) transcriber ---
 # This does NOT require the Deepgram SDK. It connects directly to the Deepgram Realtime API.
 class DeepgramRealtimeTranscriber:
-    def __init__(self, speaker_label: str, caller_number: str, event_loop: asyncio.AbstractEventLoop = None):
+    def __init__(self, speaker_label: str, call: CallContext, event_loop: asyncio.AbstractEventLoop = None):
         self.speaker_label = speaker_label
-        self.caller_number = caller_number
+        self.call = call
+        self.caller_number = call.caller_number
         self.event_loop = event_loop or asyncio.get_event_loop()
         self.ws = None
         self.is_active = False
         self.full_transcript = []
         self.audio_queue: asyncio.Queue = asyncio.Queue()
+        # Silence is not sent upstream; the send loop's KeepAlive holds the socket open
+        self.vad = StreamingVAD(RATE, speaker_label) if VAD_ENABLED else None
         self._send_task = None
         self._recv_task = None
+        self.stream_started_ns: Optional[int] = None  # Wall clock of the first audio (Deepgram times are relative to it)
 
         # Build websocket url with query params that Deepgram accepts
         # Optimized for low latency real-time transcription
@@ -695,37 +807,43 @@ class DeepgramRealtimeTranscriber:
         )
 
     async def broadcast_to_clients(self, message_data: dict):
-        """Broadcast transcription to connected clients"""
-        clients_to_notify = set()
-        if self.caller_number in transcription_clients:
-            clients_to_notify.update(transcription_clients[self.caller_number])
-        if "all" in transcription_clients:
-            clients_to_notify.update(transcription_clients["all"])
-        if self.caller_number == "unknown" and "unknown" in transcription_clients:
-            clients_to_notify.update(transcription_clients["unknown"])
-
-        for client in clients_to_notify:
-            try:
-                await client.send_json(message_data)
-            except Exception as e:
-                logger.error(f"❌ Failed to send to client {client}: {e}")
-                for s in transcription_clients.values():
-                    s.discard(client)
+        """Broadcast transcription to consoles following this call (or its agency)"""
+        message_data.setdefault("call_sid", self.call.call_sid)
+        self.call.replay.record_transcript(message_data)
+        topics = call_topics(self.call.call_sid, self.caller_number, self.call.agency)
+        stream_key = f"{self.call.call_sid}:{self.speaker_label}"
+        if message_data.get("is_final", True):
+            await console_hub.publish(topics, message_data, stream_key=stream_key)
+        else:
+            # Interims are coalesced per console and flushed on the hub's tick
+            console_hub.publish_interim(topics, stream_key, message_data)
     
-    async def handle_dispatcher_translation(self, transcript: str):
+    async def handle_dispatcher_translation(self, transcript: str, audio_end: Optional[float] = None):
         """Handle translation and TTS for dispatcher messages based on caller's language"""
+        if self.speaker_label != "DISPATCH":
+            return
+        
+        # One trace per dispatcher turn, starting when the dispatcher stopped speaking
+        speech_end_ns = None
+        if audio_end is not None and self.stream_started_ns:
+            speech_end_ns = min(self.stream_started_ns + int(audio_end * 1e9), time.time_ns())
+        with tracing.start_trace("dispatcher_turn", start_ns=speech_end_ns, caller_number=self.caller_number) as turn:
+            if speech_end_ns:
+                tracing.record_span("deepgram.final", turn, speech_end_ns)
+            await self._translate_dispatcher_turn(transcript, turn)
+    
+    async def _translate_dispatcher_turn(self, transcript: str, turn):
         try:
-            if self.speaker_label != "DISPATCH":
-                return
-            
             # Detect dispatcher's language from their speech
             dispatcher_lang = detect_language_from_text(transcript)
+            turn.set(dispatcher_language=dispatcher_lang)
             
             # Store dispatcher's language
-            dispatcher_languages[self.caller_number] = dispatcher_lang
+            self.call.dispatcher_language = dispatcher_lang
             
             # Get caller's detected language (if any)
-            caller_lang = caller_languages.get(self.caller_number, 'en')
+            caller_lang = self.call.caller_language or 'en'
+            turn.set(caller_language=caller_lang, translated=dispatcher_lang != caller_lang)
             
             logger.info(f"🌐 Dispatcher message: '{transcript[:50]}...' | Dispatcher lang: {dispatcher_lang} | Caller lang: {caller_lang}")
             
@@ -760,6 +878,11 @@ class DeepgramRealtimeTranscriber:
                 if translated_text and translated_text != transcript:
                     logger.info(f"✅ Translated ({dispatcher_lang}→{caller_lang}): {transcript[:30]}... → {translated_text[:30]}...")
                     
+                    # Track playback so the console can show what the caller actually heard
+                    utterance_id = uuid.uuid4().hex[:12]
+                    self.call.utterances[utterance_id] = {"text": translated_text, "language": caller_lang, "status": "queued", "trace": turn}
+                    turn.set(utterance_id=utterance_id)
+                    
                     # Broadcast BOTH original and translated transcripts to dispatcher UI
                     await self.broadcast_to_clients({
                         "speaker": self.speaker_label,
@@ -771,12 +894,13 @@ class DeepgramRealtimeTranscriber:
                         "type": "transcription",
                         "language": dispatcher_lang,
                         "target_language": caller_lang,
-                        "translation_needed": True
+                        "translation_needed": True,
+                        "utterance_id": utterance_id
                     })
                     
                     # Convert translated text to speech in caller's language and queue for phone
                     logger.info(f"🎤 Starting TTS for translated text in {caller_lang}: {translated_text[:50]}...")
-                    await convert_and_queue_translated_audio(translated_text, caller_lang, self.caller_number)
+                    await convert_and_queue_translated_audio(translated_text, caller_lang, self.call, utterance_id)
                     logger.info(f"✅ TTS completed and queued for {self.caller_number}")
                 else:
                     logger.warning(f"⚠️ Translation returned same text or failed: {translated_text}")
@@ -793,9 +917,7 @@ class DeepgramRealtimeTranscriber:
                         "translation_failed": True
                     })
             except Exception as trans_error:
-                logger.error(f"❌ Translation/TTS error: {trans_error}")
-                import traceback
-                logger.error(traceback.format_exc())
+                logger.error(f"❌ Translation/TTS error: {trans_error}", exc_info=True)
                 # Broadcast original only if translation failed
                 await self.broadcast_to_clients({
                     "speaker": self.speaker_label,
@@ -810,9 +932,7 @@ class DeepgramRealtimeTranscriber:
                 })
                     
         except Exception as e:
-            logger.error(f"❌ Error in dispatcher translation: {e}")
-            import traceback
-            logger.error(traceback.format_exc())
+            logger.error(f"❌ Error in dispatcher translation: {e}", exc_info=True)
     
 
     async def connect(self):
@@ -823,13 +943,15 @@ class DeepgramRealtimeTranscriber:
 
         try:
             logger.info(f"🌐 Connecting to Deepgram Realtime API for {self.speaker_label}...")
+            started = time.perf_counter()
             self.ws = await websockets.connect(
                 self.dg_url,
                 additional_headers={"Authorization": f"Token {DEEPGRAM_API_KEY}"}
             )
+            capacity.record_provider_latency("deepgram_connect", time.perf_counter() - started)
             self.is_active = True
-            self._send_task = asyncio.create_task(self._send_audio_loop())
-            self._recv_task = asyncio.create_task(self._receive_loop())
+            self._send_task = self.call.spawn(self._send_audio_loop(), name=f"{self.speaker_label}_send_audio")
+            self._recv_task = self.call.spawn(self._receive_loop(), name=f"{self.speaker_label}_receive")
             logger.info(f"✅ Connected to Deepgram for {self.speaker_label}")
         except Exception as e:
             logger.error(f"❌ Deepgram connect failed for {self.speaker_label}: {e}")
@@ -857,7 +979,7 @@ class DeepgramRealtimeTranscriber:
                         except Exception:
                             pass
                 except Exception as e:
-                    logger.error(f"❌ Error sending audio for {self.speaker_label}: {e}")
+                    hot_log.error(f"deepgram_send:{self.call.call_sid}:{self.speaker_label}", "❌ Error sending audio for %s: %s", self.speaker_label, e)
                     break
         except asyncio.CancelledError:
             pass
@@ -874,6 +996,12 @@ class DeepgramRealtimeTranscriber:
                     # Non-JSON message - skip
                     continue
 
+                # Caller started talking over queued/playing TTS
+                if data.get("type") == "SpeechStarted":
+                    if self.speaker_label == "CALLER":
+                        self.call.spawn(barge_in(self.call, "deepgram"), name="barge_in")
+                    continue
+
                 # Attempt to extract transcript
                 transcript = ""
                 confidence = None
@@ -888,14 +1016,34 @@ class DeepgramRealtimeTranscriber:
                         confidence = alternatives[0].get("confidence")
                     is_final = data.get("is_final", False)
 
+                # Deepgram times are relative to the audio it was sent; map back past dropped silence
+                audio_start = data.get("start")
+                audio_end = None
+                if isinstance(audio_start, (int, float)):
+                    audio_end = audio_start + (data.get("duration") or 0)
+                    if self.vad:
+                        audio_start = self.vad.to_call_time(audio_start)
+                        audio_end = self.vad.to_call_time(audio_end)
+                    audio_start, audio_end = round(audio_start, 2), round(audio_end, 2)
+
                 if not transcript or not transcript.strip():
                     continue
 
+                # Early caller speech raises the call's queue priority while it waits
+                if self.speaker_label == "CALLER":
+                    queued = call_queue.observe_transcript(self.call.call_sid, transcript)
+                    if queued and queued.agency:
+                        self.call.agency = queued.agency
+
+                # Caller finished talking: replay dispatcher speech their barge-in cut off
+                if data.get("speech_final") and self.speaker_label == "CALLER" and self.call.held_utterances is not None:
+                    self.call.spawn(resume_playback(self.call, "caller finished"), name="barge_in_resume")
+
                 # Detect caller language from CALLER transcripts
                 if is_final and self.speaker_label == "CALLER":
                     detected_lang = detect_language_from_text(transcript)
                     if detected_lang != 'en':
-                        caller_languages[self.caller_number] = detected_lang
+                        self.call.caller_language = detected_lang
                         logger.info(f"🌍 Detected caller language: {detected_lang} for {self.caller_number}")
 
                 timestamp = datetime.now().isoformat()
@@ -906,20 +1054,17 @@ class DeepgramRealtimeTranscriber:
                     "caller_number": self.caller_number,
                     "is_final": is_final,
                     "confidence": confidence,
+                    "audio_start": audio_start,
+                    "audio_end": audio_end,
                     "type": "transcription",
                 }
 
                 # Handle dispatcher translation (which also broadcasts)
                 if is_final and self.speaker_label == "DISPATCH":
-                    if self.event_loop and self.event_loop.is_running():
-                        asyncio.run_coroutine_threadsafe(
-                            self.handle_dispatcher_translation(transcript), 
-                            self.event_loop
-                        )
+                    self.call.spawn(self.handle_dispatcher_translation(transcript, audio_end), name="dispatcher_translation")
                 else:
                     # For CALLER messages, broadcast normally (no translation needed)
-                    if self.event_loop and self.event_loop.is_running():
-                        asyncio.run_coroutine_threadsafe(self.broadcast_to_clients(message_data), self.event_loop)
+                    self.call.spawn(self.broadcast_to_clients(message_data), name="broadcast_transcript")
 
                 # Save to transcript (no logging to terminal)
                 if is_final:
@@ -937,13 +1082,26 @@ class DeepgramRealtimeTranscriber:
         if not self.is_active:
             # If not connected, we can drop or attempt to queue (but queue requires loop)
             return
+        if self.stream_started_ns is None:
+            self.stream_started_ns = time.time_ns()
+        if self.vad:
+            audio_data = self.vad.process(audio_data)
+            if audio_data:
+                self._queue_chunk(audio_data)
+            if self.vad.segment_ended:
+                # Flush the hypothesis now rather than waiting for audio that won't come
+                self._queue_chunk(json.dumps({"type": "Finalize"}))
+            return
+        self._queue_chunk(audio_data)
+
+    def _queue_chunk(self, chunk):
         try:
-            self.audio_queue.put_nowait(audio_data)
+            self.audio_queue.put_nowait(chunk)
         except Exception:
             # Queue full: drop oldest then put again
             try:
                 _ = self.audio_queue.get_nowait()
-                self.audio_queue.put_nowait(audio_data)
+                self.audio_queue.put_nowait(chunk)
             except Exception:
                 pass
 
@@ -996,16 +1154,26 @@ class DeepgramRealtimeTranscriber:
 
 
 # Settings Endpoints
+
+# These gate require_admin, so they only come from the environment / config file at startup
+RUNTIME_LOCKED_SETTINGS = ("ADMIN_TOKEN", "ENVIRONMENT")
+
+
 @app.post("/settings")
 async def update_settings(request: Request):
-    """Update server configuration"""
+    """Update server configuration (admin only)"""
+    require_admin(request)
     try:
         data = await request.json()
+        locked = [key for key in RUNTIME_LOCKED_SETTINGS if key in data]
+        if locked:
+            logger.warning(f"⚠️ Ignoring runtime change to {', '.join(locked)} (restart with the new value instead)")
+            data = {k: v for k, v in data.items() if k not in RUNTIME_LOCKED_SETTINGS}
         config.update(data)
         
         # Update globals
         global DEEPGRAM_API_KEY, TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, TWILIO_PHONE_NUMBER
-        global GOOGLE_API_KEY, PORT, ENVIRONMENT, ALLOWED_ORIGINS, NGROK_URL
+        global GOOGLE_API_KEY, PORT, ALLOWED_ORIGINS, NGROK_URL
         global ELEVENLABS_API_KEY, ELEVENLABS_VOICE, SARVAM_API_KEY
         
         DEEPGRAM_API_KEY = config.get("DEEPGRAM_API_KEY")
@@ -1014,7 +1182,6 @@ async def update_settings(request: Request):
         TWILIO_PHONE_NUMBER = config.get("TWILIO_PHONE_NUMBER")
         GOOGLE_API_KEY = config.get("GOOGLE_API_KEY")
         PORT = int(config.get("PORT", "8000"))
-        ENVIRONMENT = config.get("ENVIRONMENT", "development")
         ALLOWED_ORIGINS = config.get("ALLOWED_ORIGINS", "*").split(",")
         NGROK_URL = config.get("NGROK_URL")
         ELEVENLABS_API_KEY = config.get("ELEVENLABS_API_KEY")
@@ -1033,7 +1200,7 @@ async def get_settings():
     """Get current server configuration (masked)"""
     c = config._config.copy()
     # Mask keys
-    for key in ["DEEPGRAM_API_KEY", "TWILIO_AUTH_TOKEN", "GOOGLE_API_KEY", "ELEVENLABS_API_KEY", "SARVAM_API_KEY", "GROQ_API_KEY", "ASSEMBLYAI_API_KEY"]:
+    for key in ["DEEPGRAM_API_KEY", "TWILIO_AUTH_TOKEN", "GOOGLE_API_KEY", "ELEVENLABS_API_KEY", "SARVAM_API_KEY", "GROQ_API_KEY", "ASSEMBLYAI_API_KEY", "ADMIN_TOKEN"]:
         if c.get(key):
             val = str(c[key])
             if len(val) > 4:
@@ -1043,17 +1210,61 @@ async def get_settings():
     return c
 
 
+def require_admin(request: Request):
+    """Allow admin/debug endpoints only with the configured ADMIN_TOKEN (open in development if unset)"""
+    if not ADMIN_TOKEN:
+        if ENVIRONMENT == "development":
+            return
+        raise HTTPException(status_code=403, detail="Admin endpoints disabled (ADMIN_TOKEN not set)")
+    token = request.headers.get("X-Admin-Token") or request.query_params.get("token")
+    if token != ADMIN_TOKEN:
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+
 # Health check endpoint
 @app.get("/health", response_model=HealthResponse)
 async def health_check():
-    """Health check endpoint for monitoring"""
-    return HealthResponse(
-        status="healthy",
+    """Health check endpoint for monitoring (503 while draining so load balancers stop routing here)"""
+    health = HealthResponse(
+        status="draining" if capacity.draining else "healthy",
         timestamp=datetime.now().isoformat(),
         environment=ENVIRONMENT,
         deepgram_configured=bool(DEEPGRAM_API_KEY),
         twilio_configured=bool(TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN)
     )
+    if capacity.draining:
+        return JSONResponse(status_code=503, content=health.dict())
+    return health
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics"""
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/admin/capacity")
+async def capacity_status(request: Request):
+    """Current load, budgets and drain state"""
+    require_admin(request)
+    return capacity.status()
+
+
+@app.post("/admin/drain")
+async def start_drain(request: Request, wait: float = 0):
+    """Stop admitting calls for a rolling restart; optionally wait up to `wait` seconds for live calls to end"""
+    require_admin(request)
+    capacity.start_drain()
+    drained = await capacity.wait_drained(timeout=wait) if wait > 0 else len(calls) == 0
+    return {"status": "draining", "drained": drained, "active_calls": len(calls)}
+
+
+@app.delete("/admin/drain")
+async def cancel_drain(request: Request):
+    """Resume admitting calls"""
+    require_admin(request)
+    capacity.cancel_drain()
+    return {"status": "accepting", "active_calls": len(calls)}
 
 
 @app.get("/")
@@ -1065,11 +1276,19 @@ async def root():
         "status": "running",
         "endpoints": {
             "health": "/health",
+            "metrics": "/metrics",
+            "capacity": "/admin/capacity",
+            "drain": "/admin/drain (POST to start, DELETE to cancel)",
             "websocket_status": "/ws/status",
+            "loop_health": "/debug/loop",
+            "profile": "/debug/profile?seconds=10&mode=cpu|wall|alloc&format=collapsed|json|pstats",
             "twiml": "/twiml",
             "websocket": "/ws",
-            "transcription": "/client/{caller_number}",
-            "notifications": "/client/notifications",
+            "console_stream": "/client/stream?topics=notifications,call:*&delta=optional",
+            "transcription": "/client/{caller_number}?catchup_audio=optional_seconds",
+            "notifications": "/client/notifications?operator_id=optional",
+            "call_queue": "/queue/status",
+            "training_stream": "/training/start/stream, /training/message/stream (Server-Sent Events)",
             "audio_stream": "/audio/stream",
             "fetch_recordings_post": "/recordings/fetch (POST with date and optional call_sid)",
             "fetch_recordings_get": "/recordings/fetch/{date}?call_sid=optional"
@@ -1082,14 +1301,78 @@ async def websocket_status():
     """WebSocket status endpoint"""
     return {
         "status": "available",
-        "notification_clients": len(notification_clients),
-        "transcription_sessions": len(transcription_clients),
-        "active_calls": len([s for s in sessions.values() if s.get("active")]),
-        "caller_languages": dict(caller_languages),  # Show detected languages
+        "console_clients": console_hub.stats(),
+        "active_calls": len(calls),
+        "caller_languages": {call.caller_number: call.caller_language for call in calls.all() if call.caller_language},  # Show detected languages
+        "timestamp": datetime.now().isoformat()
+    }
+
+
+@app.get("/debug/calls")
+async def debug_calls(request: Request, collect: bool = False):
+    """Live call contexts and contexts still referenced after hangup"""
+    require_admin(request)
+    leaks = find_leaks(CALL_LEAK_GRACE_SECONDS, collect=collect)
+    return {
+        "active_calls": [
+            {
+                "call_sid": call.call_sid,
+                "caller_number": call.caller_number,
+                "duration": round(time.time() - call.started_at, 1),
+                "pending_tasks": call.pending_tasks(),
+                "outbound_queue": call.outbound.qsize(),
+                "caller_language": call.caller_language,
+                "dispatcher_language": call.dispatcher_language,
+                "replay": call.replay.stats(),
+                "network": call.jitter.stats(),
+                "vad": vad_stats(call)
+            }
+            for call in calls.all()
+        ],
+        "live_contexts": live_context_count(),
+        "leaked_contexts": leaks,
         "timestamp": datetime.now().isoformat()
     }
 
 
+@app.get("/debug/loop")
+async def debug_loop(request: Request):
+    """Event loop lag and recent stalls with the stack, endpoint and call that blocked the loop"""
+    require_admin(request)
+    return {**loop_monitor.status(), "timestamp": datetime.now().isoformat()}
+
+
+@app.get("/debug/profile")
+async def debug_profile(request: Request, seconds: float = 10, mode: str = "cpu", format: str = "collapsed"):
+    """
+    Profile this process for a bounded window. cpu/wall return collapsed stacks
+    rooted at the asyncio task name (e.g. task:send_laptop_audio); alloc weights
+    stacks by bytes allocated; format=pstats returns a cProfile stats file
+    """
+    require_admin(request)
+    if mode not in MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {', '.join(MODES)}")
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(FORMATS)}")
+    if format == "pstats" and mode == "alloc":
+        raise HTTPException(status_code=400, detail="pstats output is only available for cpu and wall modes")
+
+    logger.info(f"🔬 Profiling {mode} for {seconds}s ({format})")
+    try:
+        report, summary = await runtime_profiler.run(seconds, mode, format)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=f"Profiler busy: {e}")
+    logger.info(f"🔬 Profile done: {summary}" if format == "pstats" else f"🔬 Profile done: {mode} {summary['seconds']}s")
+
+    if format == "pstats":
+        filename = f"profile-{mode}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.pstats"
+        return Response(content=report, media_type="application/octet-stream",
+                        headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+    if format == "json":
+        return Response(content=report, media_type="application/json")
+    return PlainTextResponse(report)
+
+
 @app.post("/twiml")
 async def twiml_endpoint(request: Request):
     """Twilio webhook endpoint for incoming calls"""
@@ -1105,6 +1388,12 @@ async def twiml_endpoint(request: Request):
 
         logger.info(f"🔔 /twiml endpoint called - CallSid: {CallSid}, From: {From}")
 
+        # Admission control: route overflow away from this node when over budget or draining
+        decision = capacity.decide()
+        if not decision.admit:
+            logger.info(f"🚦 Not admitting {From} ({CallSid}) -> {decision.route}")
+            return Response(content=capacity.overflow_twiml(decision), media_type="text/xml")
+
         if CallSid and From:
             sessions[CallSid] = {
                 "caller_number": From,
@@ -1113,7 +1402,7 @@ async def twiml_endpoint(request: Request):
                 "caller_city": CallerCity,
                 "caller_state": CallerState,
                 "caller_country": CallerCountry,
-                "active": False
+                "admitted_at": time.time()
             }
             logger.info(f"📞 Incoming call: {From} -> {To}")
 
@@ -1132,83 +1421,213 @@ async def twiml_endpoint(request: Request):
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
+@app.get("/queue/status")
+async def queue_status(request: Request):
+    """Calls waiting for an operator (in priority order) and operator load"""
+    require_admin(request)
+    return {**call_queue.status(), "timestamp": datetime.now().isoformat()}
+
+
+async def handle_operator_message(operator_id: str, data: str):
+    """Apply an operator's accept/decline reply to a call offer, or hand an answered call back"""
+    try:
+        message = json.loads(data)
+    except (ValueError, TypeError):
+        return
+    if not isinstance(message, dict):
+        return
+    
+    call_sid = message.get("call_sid")
+    if message.get("type") == "accept_call" and call_sid:
+        if call_queue.accept(call_sid, operator_id):
+            await notify_clients({
+                "type": "call_assigned",
+                "call_sid": call_sid,
+                "operator_id": operator_id,
+                "timestamp": datetime.now().isoformat()
+            })
+    elif message.get("type") == "decline_call" and call_sid:
+        call_queue.decline(call_sid, operator_id)
+    elif message.get("type") == "release_call" and call_sid:
+        call_queue.release(call_sid, operator_id)
+
+
+def call_for_topic(topic: str) -> Optional[CallContext]:
+    """Live call named by a "call:<sid|number>" / "audio:<sid|number>" topic (wildcards excluded)"""
+    kind, _, key = topic.partition(":")
+    if kind.split(".")[0] not in ("call", "audio", "monitor") or not key or key == "*":
+        return None
+    return calls.get(key) or calls.by_number(key)
+
+
+async def send_call_snapshots(subscriber: Subscriber, topics, audio_seconds: float = 0):
+    """Catch a console up on the calls it just subscribed to, from the calls' replay buffers"""
+    sent = set()
+    for topic in topics:
+        call = call_for_topic(topic)
+        if not call or call.call_sid in sent:
+            continue
+        sent.add(call.call_sid)
+        snapshot = call.replay.snapshot(audio_seconds)
+        snapshot.update({
+            "call_sid": call.call_sid,
+            "caller_number": call.caller_number,
+            "agency": call.agency,
+            "caller_language": call.caller_language,
+            "timestamp": datetime.now().isoformat()
+        })
+        await subscriber.send_json(snapshot)
+
+
+def resync_console(subscriber: Subscriber):
+    """A console's send backlog overflowed and was dropped: resend snapshots of the calls it follows"""
+    asyncio.get_running_loop().create_task(send_call_snapshots(subscriber, sorted(subscriber.topics)))
+
+
+console_hub.on_resync = resync_console
+
+
+async def console_catchup(subscriber: Subscriber, value) -> float:
+    """A console's catchup_audio as seconds within the replay window; a bad value gets an error frame and no audio"""
+    try:
+        return catchup_seconds(value)
+    except ValueError as e:
+        await subscriber.send_json({
+            "type": "error",
+            "message": f"Invalid catchup_audio: {e}",
+            "timestamp": datetime.now().isoformat()
+        })
+        return 0.0
+
+
+async def serve_console(websocket: WebSocket, subscriber: Subscriber, operator_id: Optional[str] = None):
+    """Read loop shared by every console socket: topic (un)subscribe, operator replies, keepalive echo"""
+    if operator_id:
+        call_queue.connect_operator(operator_id, subscriber.send_json)
+    try:
+        while True:
+            data = await websocket.receive_text()
+            try:
+                message = json.loads(data)
+            except (ValueError, TypeError):
+                message = None
+            
+            action = message.get("action") if isinstance(message, dict) else None
+            if action in ("subscribe", "unsubscribe"):
+                topics = message.get("topics") or []
+                topics = [audio_topic(str(topic), subscriber.codec) for topic in (topics if isinstance(topics, list) else [topics])]
+                added = [topic for topic in topics if topic not in subscriber.topics]
+                for topic in topics:
+                    if action == "subscribe":
+                        console_hub.subscribe(subscriber, topic)
+                    else:
+                        console_hub.unsubscribe(subscriber, topic)
+                await subscriber.send_json({
+                    "type": "subscriptions",
+                    "topics": sorted(subscriber.topics),
+                    "timestamp": datetime.now().isoformat()
+                })
+                if action == "subscribe" and added:
+                    await send_call_snapshots(subscriber, added, await console_catchup(subscriber, message.get("catchup_audio")))
+                continue
+            
+            if operator_id:
+                await handle_operator_message(operator_id, data)
+            await subscriber.send_json({
+                "type": "keepalive",
+                "timestamp": datetime.now().isoformat()
+            })
+    finally:
+        console_hub.remove(subscriber)
+        if operator_id:
+            call_queue.disconnect_operator(operator_id, subscriber.send_json)
+
+
+@app.websocket("/client/stream")
+async def console_stream_websocket(websocket: WebSocket, topics: str = "", operator_id: Optional[str] = None,
+                                   catchup_audio: float = 0, delta: bool = False, codec: Optional[str] = None):
+    """
+    Multiplexed console socket. Subscribe with {"action": "subscribe", "topics": [...]}:
+    "notifications", "call:<call_sid|caller_number|*>", "agency:<ems|fire|police>",
+    "audio:<call_sid|caller_number|*>" (caller audio), "monitor:<call_sid|caller_number|*>"
+    (caller + dispatcher mixed) - unsubscribe the same way.
+    Subscribing to a live call first sends a "snapshot" of its recent transcripts
+    (plus `catchup_audio` seconds of mixed audio when requested).
+    Interim transcripts are coalesced per tick; `delta=true` sends only their changed suffix.
+    `codec` picks caller audio playback: mulaw (8kHz, ~5x smaller), pcm16 (16kHz, default) or opus.
+    """
+    await websocket.accept()
+    subscriber = Subscriber(websocket, name=f"console {operator_id or id(websocket)}", delta=delta,
+                            codec=negotiate(codec))
+    console_hub.add(subscriber, [audio_topic(t, subscriber.codec) for t in topics.split(",") if t])
+    logger.info(f"🖥️ Console connected to /client/stream (consoles: {len(console_hub)})")
+    
+    try:
+        await subscriber.send_json({
+            "type": "connected",
+            "topics": sorted(subscriber.topics),
+            "codec": subscriber.codec,
+            "timestamp": datetime.now().isoformat(),
+            "message": "Connected to console stream"
+        })
+        await send_call_snapshots(subscriber, sorted(subscriber.topics), await console_catchup(subscriber, catchup_audio))
+        await serve_console(websocket, subscriber, operator_id)
+    except WebSocketDisconnect:
+        logger.info(f"🖥️ Console disconnected from /client/stream (consoles: {len(console_hub)})")
+    except Exception as e:
+        logger.error(f"Error in console stream websocket: {e}")
+
+
 @app.websocket("/client/notifications")
-async def notification_websocket(websocket: WebSocket):
-    """WebSocket endpoint for call notifications"""
+async def notification_websocket(websocket: WebSocket, operator_id: Optional[str] = None):
+    """WebSocket endpoint for call notifications (operators pass operator_id to receive call offers)"""
     await websocket.accept()
-    notification_clients.add(websocket)
-    logger.info(f"🔔 Notification client connected (total: {len(notification_clients)})")
+    subscriber = Subscriber(websocket, name=f"notifications {operator_id or id(websocket)}")
+    console_hub.add(subscriber, [NOTIFICATIONS])
+    logger.info(f"🔔 Notification client connected (consoles: {len(console_hub)})")
     
     try:
-        await websocket.send_json({
+        await subscriber.send_json({
             "type": "connected",
             "timestamp": datetime.now().isoformat(),
             "message": "Connected to call notifications"
         })
-        
-        while True:
-            try:
-                # Add timeout to prevent hanging connections
-                data = await asyncio.wait_for(websocket.receive_text(), timeout=30.0)
-                await websocket.send_json({
-                    "type": "keepalive",
-                    "timestamp": datetime.now().isoformat()
-                })
-            except asyncio.TimeoutError:
-                # Send keepalive ping
-                await websocket.send_json({
-                    "type": "keepalive",
-                    "timestamp": datetime.now().isoformat()
-                })
+        await serve_console(websocket, subscriber, operator_id)
     except WebSocketDisconnect:
-        notification_clients.discard(websocket)
-        logger.info(f"🔔 Notification client disconnected (remaining: {len(notification_clients)})")
+        logger.info(f"🔔 Notification client disconnected (consoles: {len(console_hub)})")
     except Exception as e:
         logger.error(f"Error in notification websocket: {e}")
-        notification_clients.discard(websocket)
 
 
 @app.websocket("/client/{caller_number}")
-async def transcription_websocket(websocket: WebSocket, caller_number: str):
-    """WebSocket endpoint for transcription streams"""
+async def transcription_websocket(websocket: WebSocket, caller_number: str, catchup_audio: float = 0,
+                                 delta: bool = False, codec: Optional[str] = None):
+    """WebSocket endpoint for transcription streams ("all" follows every call)"""
     await websocket.accept()
     
-    if caller_number not in transcription_clients:
-        transcription_clients[caller_number] = set()
-    transcription_clients[caller_number].add(websocket)
+    # "all" follows every call's transcripts (no audio), as before
+    codec = negotiate(codec)
+    topics = ["call:*"] if caller_number == "all" else [f"call:{caller_number}", f"{audio_kind(codec)}:{caller_number}"]
+    subscriber = Subscriber(websocket, name=f"transcription {caller_number}", delta=delta, codec=codec)
+    console_hub.add(subscriber, topics)
     
-    logger.info(f"📱 Transcription client connected for {caller_number} (total: {len(transcription_clients[caller_number])})")
+    logger.info(f"📱 Transcription client connected for {caller_number} (consoles: {len(console_hub)})")
     
     try:
-        await websocket.send_json({
+        await subscriber.send_json({
             "type": "connected",
             "caller_number": caller_number,
+            "codec": codec,
             "timestamp": datetime.now().isoformat(),
             "message": f"Connected to transcription stream for {caller_number}"
         })
-        
-        while True:
-            try:
-                # Add timeout to prevent hanging connections
-                data = await asyncio.wait_for(websocket.receive_text(), timeout=30.0)
-                await websocket.send_json({
-                    "type": "keepalive",
-                    "timestamp": datetime.now().isoformat()
-                })
-            except asyncio.TimeoutError:
-                # Send keepalive ping
-                await websocket.send_json({
-                    "type": "keepalive",
-                    "timestamp": datetime.now().isoformat()
-                })
+        # Joining mid-call: replay what was said so far before the live stream
+        await send_call_snapshots(subscriber, topics[:1], await console_catchup(subscriber, catchup_audio))
+        await serve_console(websocket, subscriber)
     except WebSocketDisconnect:
-        transcription_clients[caller_number].discard(websocket)
-        logger.info(f"📱 Transcription client disconnected from {caller_number} (remaining: {len(transcription_clients.get(caller_number,[]))})")
-        if not transcription_clients.get(caller_number):
-            transcription_clients.pop(caller_number, None)
+        logger.info(f"📱 Transcription client disconnected from {caller_number} (consoles: {len(console_hub)})")
     except Exception as e:
         logger.error(f"Error in transcription websocket: {e}")
-        transcription_clients[caller_number].discard(websocket)
 
 
 @app.post("/audio/stream")
@@ -1226,10 +1645,15 @@ async def stream_audio_from_browser(request: AudioStreamRequest):
             logger.warning(f"Could not apply gain boost: {e}")
         
         caller_number = request.caller_number
+        call = calls.get(request.call_sid) or calls.by_number(caller_number)
+        if not call:
+            hot_log.warning(f"no_call:{caller_number}", "⚠️ No active call found for %s", caller_number)
+            return {"status": "ignored", "message": "No active call"}
+        bind_call(call.call_sid, call.caller_number)
         
         # Get caller's detected language
-        caller_lang = caller_languages.get(caller_number, 'en')
-        dispatcher_lang = dispatcher_languages.get(caller_number, 'en')
+        caller_lang = call.caller_language or 'en'
+        dispatcher_lang = call.dispatcher_language or 'en'
         
         # Determine if we need to block original audio and use translation instead
         # Block audio when languages don't match (translation will be sent via TTS)
@@ -1252,40 +1676,30 @@ async def stream_audio_from_browser(request: AudioStreamRequest):
             
             # Convert to μ-law for Twilio
             ulaw_data = audioop.lin2ulaw(audio_8khz, 2)
-            ulaw_base64 = base64.b64encode(ulaw_data).decode("utf-8")
             
-            # Queue audio to send to phone
-            try:
-                audio_to_phone.put_nowait(ulaw_base64)
-            except Exception:
-                # Queue full, drop oldest and add new
-                try:
-                    audio_to_phone.get_nowait()
-                    audio_to_phone.put_nowait(ulaw_base64)
-                except Exception:
-                    pass
+            # Queue audio to send to phone (drops oldest when full)
+            call.queue_outbound(ulaw_data)
+        
+        call.mixer.push_dispatcher(audio_data)
         
         # Send to browser transcriber (DISPATCH/CONTROL_ROOM audio)
-        if caller_number in browser_transcribers:
-            browser_trans = browser_transcribers[caller_number].get("browser_transcriber")
-            if browser_trans:
-                try:
-                    browser_trans.stream_audio(audio_data)
-                    # Log occasionally to verify audio flow
-                    import random
-                    if random.random() < 0.01:  # 1% of packets
-                        logger.info(f"📤 Streaming audio to DISPATCH transcriber: {len(audio_data)} bytes")
-                except Exception as e:
-                    logger.error(f"Error streaming to browser transcriber: {e}")
+        browser_trans = call.browser_transcriber
+        if browser_trans:
+            try:
+                browser_trans.stream_audio(audio_data)
+                # Log occasionally to verify audio flow
+                hot_log.info(f"dispatch_audio:{call.call_sid}", "📤 Streaming audio to DISPATCH transcriber: %d bytes", len(audio_data))
+            except Exception as e:
+                hot_log.error(f"dispatch_audio_error:{call.call_sid}", "Error streaming to browser transcriber: %s", e)
         else:
-            logger.warning(f"⚠️ No browser transcriber found for {caller_number}. Available: {list(browser_transcribers.keys())}")
+            hot_log.warning(f"no_transcriber:{call.call_sid}", "⚠️ No browser transcriber found for %s (call %s)", caller_number, call.call_sid)
         
         return {"status": "success", "message": "Audio queued and transcribed"}
     except ValueError as e:
-        logger.error(f"Invalid audio data: {e}")
+        hot_log.error("invalid_audio", "Invalid audio data: %s", e)
         raise HTTPException(status_code=400, detail="Invalid audio data")
     except Exception as e:
-        logger.error(f"Audio processing error: {e}")
+        hot_log.error("audio_processing", "Audio processing error: %s", e, exc_info=True)
         raise HTTPException(status_code=500, detail="Audio processing error")
 
 
@@ -1316,58 +1730,49 @@ async def fetch_recordings_by_date(date: str, call_sid: Optional[str] = None):
 async def start_training_session(request: TrainingStartRequest):
     """Start a new training session with a random scenario"""
     try:
-        if not training_scenarios or not training_client:
+        if not training_store or not training_llm:
             raise HTTPException(status_code=500, detail="Training system not initialized")
         
         session_id = request.session_id
         
-        # Check if session already exists
-        if session_id in training_sessions:
-            raise HTTPException(status_code=400, detail="Session already exists")
-        
-        # Select random scenario
-        scenario = select_random_scenario(training_scenarios)
-        
-        # Initialize chat session
-        title = scenario.get("title", "Unknown Emergency")
-        desc = scenario.get("desc", "No description")
-        location = scenario.get("twp", "Unknown Location")
-
-        intro_prompt = f"""
-You are simulating an emergency call for a 911 dispatcher training. Your role is to be the CALLER.
-
-**CRITICAL INSTRUCTIONS FOR YOUR ROLE:**
-1.  **NO DESCRIPTIVE ACTIONS:** Do NOT use parentheses or asterisks to describe sounds, actions, or emotions (e.g., no `(sobbing)`, `*sirens wail*`, `(gasping)`).
-2.  **STRAIGHT CONVERSATION ONLY:** Your responses must only contain the words spoken by the caller. It should be a direct, back-and-forth conversation.
-3.  **BE A DESCRIPTIVE REPORTER:** Act as a person urgently reporting an emergency. When you answer, provide relevant details about what you see, hear, and know. Your goal is to paint a clear picture of the scene with your words.
-4.  **ELABORATE WHEN ASKED:** Start with an urgent opening line. When the dispatcher asks a question, answer it fully. For example, if they ask for the location, don't just say "the train tracks." Say something like, "It's under the train tracks on Maple Avenue, just past the old factory." Provide the important details you have.
-
-**SCENARIO BRIEFING:**
-*   **INCIDENT TYPE:** {title}
-*   **DESCRIPTION:** {desc}
-*   **LOCATION:** {location}
-
-Begin the call now with your opening line. It should be urgent and give a key detail about the emergency.
-        """
-
-        chat = training_client.chats.create(model="gemini-2.5-flash")
-        response = chat.send_message(intro_prompt)
-        
-        # Store session data
-        training_sessions[session_id] = {
-            "scenario": scenario,
-            "chat": chat,
+        # Reserve the id first so a duplicate start is rejected without using up a pregenerated opening
+        session = {
+            "scenario": None,
             "conversation": [],
+            "history": [],
             "started_at": datetime.now().isoformat(),
-            "status": "active"
+            "status": "starting"
         }
+        if not await training_sessions.create(session_id, session):
+            raise HTTPException(status_code=400, detail="Session already exists")
+        
+        # Pregenerated opening if one matches, else a random matching scenario generated live
+        bundle = scenario_pool.pop(request.category, request.township, request.title)
+        scenario = bundle["scenario"] if bundle else scenario_pool.select(request.category, request.township, request.title)
+        if scenario is None:
+            await training_sessions.discard(session_id)
+            raise HTTPException(status_code=404, detail="No training scenarios match the requested filters")
+        session["scenario"] = scenario
+        title = scenario.get("title", "Unknown Emergency")
+        try:
+            if bundle:
+                opening = bundle["opening"]
+                session["history"] = list(bundle["history"])
+            else:
+                session["chat"], opening = await training_llm.start(scenario)
+                add_exchange(session, caller_prompt(scenario), opening)
+        except BaseException:
+            await training_sessions.discard(session_id)
+            raise
+        session["status"] = "active"
         
         # Add initial caller message to conversation
-        training_sessions[session_id]["conversation"].append({
+        session["conversation"].append({
             "sender": "Caller",
-            "message": response.text,
+            "message": opening,
             "timestamp": datetime.now().isoformat()
         })
+        training_sessions.save(session_id)
         
         logger.info(f"🎓 Started training session {session_id} with scenario: {title}")
         
@@ -1375,11 +1780,14 @@ Begin the call now with your opening line. It should be urgent and give a key de
             status="success",
             session_id=session_id,
             message="Training session started",
-            caller_response=response.text
+            caller_response=opening
         )
         
     except HTTPException:
         raise
+    except TrainingTimeout as e:
+        logger.warning(f"⏱️ Training start timed out for {request.session_id}: {e}")
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         logger.error(f"Error starting training session: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -1391,32 +1799,33 @@ async def send_training_message(request: TrainingMessageRequest):
     try:
         session_id = request.session_id
         
-        if session_id not in training_sessions:
+        session = await training_sessions.get(session_id) if training_sessions else None
+        if session is None:
             raise HTTPException(status_code=404, detail="Training session not found")
         
-        session = training_sessions[session_id]
-        
-        if session["status"] != "active":
-            raise HTTPException(status_code=400, detail="Training session is not active")
-        
-        chat = session["chat"]
+        sent_at = datetime.now().isoformat()
         
-        # Add dispatcher message to conversation
-        session["conversation"].append({
-            "sender": "Dispatch",
-            "message": request.message,
-            "timestamp": datetime.now().isoformat()
-        })
-        
-        # Get caller response
-        response = chat.send_message(request.message)
-        
-        # Add caller response to conversation
-        session["conversation"].append({
-            "sender": "Caller",
-            "message": response.text,
-            "timestamp": datetime.now().isoformat()
-        })
+        # One turn at a time per session: the chat history must stay in order
+        async with session["lock"]:
+            if session["status"] != "active":
+                raise HTTPException(status_code=400, detail="Training session is not active")
+            
+            # Get caller response
+            caller_response = await training_llm.reply(training_sessions.chat(session), request.message)
+            
+            # Add both sides once the turn succeeded (a timed-out turn leaves no half exchange)
+            session["conversation"].append({
+                "sender": "Dispatch",
+                "message": request.message,
+                "timestamp": sent_at
+            })
+            session["conversation"].append({
+                "sender": "Caller",
+                "message": caller_response,
+                "timestamp": datetime.now().isoformat()
+            })
+            add_exchange(session, request.message, caller_response)
+            training_sessions.save(session_id)
         
         logger.info(f"🎓 Training session {session_id}: Dispatcher sent message, got caller response")
         
@@ -1424,125 +1833,176 @@ async def send_training_message(request: TrainingMessageRequest):
             status="success",
             session_id=session_id,
             message="Message sent and response received",
-            caller_response=response.text
+            caller_response=caller_response
         )
         
     except HTTPException:
         raise
+    except TrainingTimeout as e:
+        logger.warning(f"⏱️ Training message timed out for {request.session_id}: {e}")
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         logger.error(f"Error sending training message: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/training/end", response_model=TrainingResponse)
-async def end_training_session(request: TrainingEndRequest):
-    """End a training session and get evaluation"""
-    try:
-        session_id = request.session_id
-        
-        if session_id not in training_sessions:
-            raise HTTPException(status_code=404, detail="Training session not found")
-        
-        session = training_sessions[session_id]
-        
-        if session["status"] != "active":
-            raise HTTPException(status_code=400, detail="Training session is not active")
-        
-        chat = session["chat"]
-        
-        # Get evaluation
-        grading_prompt = """
-You are evaluating a 911 DISPATCHER/OPERATOR trainee's performance in handling an emergency call. 
-Focus ONLY on the dispatcher's responses and actions, NOT the caller.
-
-Analyze the dispatcher's performance based on:
-
-**CRITICAL EVALUATION CRITERIA:**
-
-1. **Information Gathering (25 points)**
-   - Did they ask the right questions in the right order?
-   - Did they gather all essential information (location, nature of emergency, injuries, hazards)?
-   - Were questions clear and specific?
-   - Did they avoid redundant or unnecessary questions?
+def sse_event(event: str, data: dict) -> str:
+    """One Server-Sent Events frame"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
-2. **Communication Clarity (20 points)**
-   - Were instructions clear and easy to understand?
-   - Did they use simple, direct language?
-   - Did they avoid jargon or confusing terms?
-   - Were they concise without being rushed?
 
-3. **Response Speed & Efficiency (15 points)**
-   - Did they respond promptly to caller statements?
-   - Did they prioritize critical information first?
-   - Did they avoid wasting time on non-essential details?
-   - Was the pace appropriate for the emergency?
-
-4. **Calmness & Composure (15 points)**
-   - Did they maintain a calm, professional tone?
-   - Did they help calm an anxious or panicked caller?
-   - Did they stay focused under pressure?
-   - Did they project confidence and control?
-
-5. **Empathy & Reassurance (10 points)**
-   - Did they acknowledge the caller's distress?
-   - Did they provide appropriate reassurance?
-   - Did they show understanding and compassion?
-   - Did they maintain human connection while staying professional?
-
-6. **Protocol Adherence (10 points)**
-   - Did they follow standard emergency dispatch protocols?
-   - Did they gather information in logical sequence?
-   - Did they provide appropriate pre-arrival instructions?
-   - Did they document key details properly?
-
-7. **Problem-Solving (5 points)**
-   - Did they adapt to unexpected information?
-   - Did they handle caller confusion effectively?
-   - Did they think critically about the situation?
+async def stream_training_turn(session_id: str, session: dict, turn, expected_status: str = "active",
+                               dispatcher_message: Optional[str] = None):
+    """SSE frames for one streamed training turn: token... then done (with time to first token) or error"""
+    sent_at = datetime.now().isoformat()
+    try:
+        async with session["lock"]:
+            if session["status"] != expected_status:
+                yield sse_event("error", {"status": 400, "detail": "Training session is not active"})
+                return
+            async for text in turn:
+                yield sse_event("token", {"token": text})
+            
+            # Record the exchange only once the whole turn arrived
+            if dispatcher_message is not None:
+                session["conversation"].append({
+                    "sender": "Dispatch",
+                    "message": dispatcher_message,
+                    "timestamp": sent_at
+                })
+            session["conversation"].append({
+                "sender": "Caller",
+                "message": turn.text,
+                "timestamp": datetime.now().isoformat()
+            })
+            add_exchange(session, turn.message, turn.text)
+            session["status"] = "active"
+            training_sessions.save(session_id)
+        
+        logger.info(f"🎓 Training session {session_id}: streamed {turn.kind} turn (first token {turn.ttft_ms}ms, total {turn.total_ms}ms)")
+        yield sse_event("done", {
+            "session_id": session_id,
+            "caller_response": turn.text,
+            "ttft_ms": turn.ttft_ms,
+            "total_ms": turn.total_ms
+        })
+    except TrainingTimeout as e:
+        logger.warning(f"⏱️ Streamed training {turn.kind} timed out for {session_id}: {e}")
+        yield sse_event("error", {"status": 504, "detail": str(e)})
+    except Exception as e:
+        logger.error(f"Error streaming training {turn.kind} for {session_id}: {e}")
+        yield sse_event("error", {"status": 500, "detail": str(e)})
 
-**OUTPUT FORMAT:**
 
-Score: [XX]%
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
 
-**Evaluation:**
 
-**Strengths:**
-- [List 2-3 specific things the dispatcher did well]
+@app.post("/training/start/stream")
+async def start_training_session_stream(request: TrainingStartRequest):
+    """Start a training session, streaming the caller's opening line as Server-Sent Events"""
+    if not training_store or not training_llm:
+        raise HTTPException(status_code=500, detail="Training system not initialized")
+    
+    session_id = request.session_id
+    # Reserve the id first so a duplicate start is rejected without using up a pregenerated opening
+    session = {
+        "scenario": None,
+        "conversation": [],
+        "history": [],
+        "started_at": datetime.now().isoformat(),
+        "status": "starting"
+    }
+    if not await training_sessions.create(session_id, session):
+        raise HTTPException(status_code=400, detail="Session already exists")
+    bundle = scenario_pool.pop(request.category, request.township, request.title)
+    scenario = bundle["scenario"] if bundle else scenario_pool.select(request.category, request.township, request.title)
+    if scenario is None:
+        await training_sessions.discard(session_id)
+        raise HTTPException(status_code=404, detail="No training scenarios match the requested filters")
+    session["scenario"] = scenario
+    if bundle:
+        session["history"] = list(bundle["history"])
+    logger.info(f"🎓 Starting streamed training session {session_id} with scenario: {scenario.get('title', 'Unknown Emergency')}")
+    
+    async def events():
+        if bundle:
+            # Pregenerated: the whole opening is available immediately
+            session["status"] = "active"
+            session["conversation"].append({
+                "sender": "Caller",
+                "message": bundle["opening"],
+                "timestamp": datetime.now().isoformat()
+            })
+            training_sessions.save(session_id)
+            yield sse_event("token", {"token": bundle["opening"]})
+            yield sse_event("done", {"session_id": session_id, "caller_response": bundle["opening"],
+                                     "ttft_ms": 0, "total_ms": 0, "pregenerated": True})
+            return
+        try:
+            turn = training_llm.stream_start(training_sessions.chat(session), scenario)
+            async for frame in stream_training_turn(session_id, session, turn, expected_status="starting"):
+                yield frame
+        finally:
+            # Failed or abandoned before the opening line completed
+            if session["status"] == "starting":
+                await training_sessions.discard(session_id)
+    
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
 
-**Areas for Improvement:**
-- [List 2-3 specific areas where the dispatcher could improve]
 
-**Key Observations:**
-- [2-3 specific examples from the conversation showing good or poor performance]
+@app.post("/training/message/stream")
+async def send_training_message_stream(request: TrainingMessageRequest):
+    """Send a dispatcher message, streaming the caller's reply as Server-Sent Events"""
+    session_id = request.session_id
+    session = await training_sessions.get(session_id) if training_sessions else None
+    if session is None:
+        raise HTTPException(status_code=404, detail="Training session not found")
+    if session["status"] != "active":
+        raise HTTPException(status_code=400, detail="Training session is not active")
+    
+    turn = training_llm.stream_reply(training_sessions.chat(session), request.message)
+    return StreamingResponse(
+        stream_training_turn(session_id, session, turn, dispatcher_message=request.message),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
+    )
 
-**Overall Assessment:**
-[1-2 sentences summarizing the dispatcher's readiness and what they should focus on]
 
-**IMPORTANT:** 
-- Evaluate ONLY the dispatcher's performance, NOT the caller
-- Be specific with examples from the conversation
-- Focus on actionable feedback
-- Consider the context and severity of the emergency
-- Rate based on professional emergency dispatch standards
-        """
+@app.post("/training/end", response_model=TrainingResponse)
+async def end_training_session(request: TrainingEndRequest):
+    """End a training session and get evaluation"""
+    try:
+        session_id = request.session_id
         
-        eval_response = chat.send_message(grading_prompt)
+        session = await training_sessions.get(session_id) if training_sessions else None
+        if session is None:
+            raise HTTPException(status_code=404, detail="Training session not found")
         
-        # Extract confidence score from evaluation
-        confidence_score = 75  # Default score
-        try:
-            import re
-            score_match = re.search(r'(\d{1,3})%', eval_response.text)
-            if score_match:
-                confidence_score = int(score_match.group(1))
-        except (ValueError, AttributeError, TypeError) as e:
-            logger.warning(f"Could not parse confidence score from evaluation: {e}")
-        
-        # Update session
-        session["status"] = "completed"
-        session["ended_at"] = datetime.now().isoformat()
-        session["evaluation"] = eval_response.text
-        session["confidence_score"] = confidence_score
+        async with session["lock"]:
+            if session["status"] != "active":
+                raise HTTPException(status_code=400, detail="Training session is not active")
+            
+            # Get evaluation
+            evaluation = await training_llm.grade(training_sessions.chat(session))
+            
+            # Extract confidence score from evaluation
+            confidence_score = 75  # Default score
+            try:
+                import re
+                score_match = re.search(r'(\d{1,3})%', evaluation)
+                if score_match:
+                    confidence_score = int(score_match.group(1))
+            except (ValueError, AttributeError, TypeError) as e:
+                logger.warning(f"Could not parse confidence score from evaluation: {e}")
+            
+            # Update session
+            session["status"] = "completed"
+            session["ended_at"] = datetime.now().isoformat()
+            session["evaluation"] = evaluation
+            session["confidence_score"] = confidence_score
+            training_sessions.save(session_id)
+            # Completed sessions are only ever read back, so free the chat now
+            session["chat"] = None
         
         logger.info(f"🎓 Ended training session {session_id} with score: {confidence_score}%")
         
@@ -1551,24 +2011,35 @@ Score: [XX]%
             session_id=session_id,
             message="Training session ended",
             confidence_score=confidence_score,
-            evaluation=eval_response.text
+            evaluation=evaluation
         )
         
     except HTTPException:
         raise
+    except TrainingTimeout as e:
+        logger.warning(f"⏱️ Training evaluation timed out for {request.session_id}: {e}")
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         logger.error(f"Error ending training session: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/training/pool")
+async def training_pool_status():
+    """Pregenerated openings ready per incident category"""
+    if not scenario_pool:
+        raise HTTPException(status_code=500, detail="Training system not initialized")
+    return {**scenario_pool.stats(), "categories": scenario_pool.categories(), "store": training_store.stats(),
+            "sessions": training_sessions.stats()}
+
+
 @app.get("/training/session/{session_id}")
 async def get_training_session(session_id: str):
     """Get training session details"""
-    if session_id not in training_sessions:
+    session = await training_sessions.get(session_id) if training_sessions else None
+    if session is None:
         raise HTTPException(status_code=404, detail="Training session not found")
     
-    session = training_sessions[session_id]
-    
     return {
         "session_id": session_id,
         "scenario": session["scenario"],
@@ -1585,296 +2056,442 @@ async def get_training_session(session_id: str):
 
 
 
-# Main WebSocket endpoint for Twilio Stream
-@app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
-    """Main WebSocket endpoint for Twilio audio streaming"""
-    await websocket.accept()
-    call_sid = None
-    stream_sid = None
-    caller_number = None
-
-    async def send_laptop_audio():
-        packet_count = 0
-        logger.info(f"🎵 Audio sender task started - monitoring queue")
-        last_queue_check = 0
+async def notify_clients(message: dict):
+    """Send a call notification to every console subscribed to notifications"""
+    await console_hub.publish([NOTIFICATIONS], message)
+
+
+async def watch_call_leaks():
+    """Periodically report call contexts that are still alive after hangup"""
+    try:
+        while True:
+            await asyncio.sleep(CALL_LEAK_GRACE_SECONDS)
+            leaks = find_leaks(CALL_LEAK_GRACE_SECONDS)
+            if leaks:
+                logger.warning(f"⚠️ {len(leaks)} call context(s) still alive after hangup: {[leak['call_sid'] for leak in leaks]}")
+    except asyncio.CancelledError:
+        pass
+
+
+def upsample_to_wideband(pcm_data_8khz: bytes) -> bytes:
+    """Upsample 8kHz PCM16 phone audio to RATE (16kHz)"""
+    # Better upsampling from 8kHz to 16kHz
+    try:
+        # Try numpy for best quality
+        import numpy as np
+        
+        # Convert bytes to int16 array
+        audio_array = np.frombuffer(pcm_data_8khz, dtype=np.int16)
+        
+        # High-quality upsampling: duplicate + filter
+        upsampled = np.repeat(audio_array, 2)
+        
+        # Apply low-pass filter to smooth
+        kernel = np.array([0.25, 0.5, 0.25])
+        filtered = np.convolve(upsampled, kernel, mode='same')
+        
+        return filtered.astype(np.int16).tobytes()
+        
+    except ImportError:
+        # Fallback: Manual upsampling with linear interpolation
         try:
-            while True:
-                try:
-                    if not audio_to_phone.empty():
-                        audio_payload = audio_to_phone.get_nowait()
-                        message = {
-                            "event": "media",
-                            "streamSid": stream_sid,
-                            "media": {
-                                "payload": audio_payload,
-                                "track": "outbound"
-                            }
-                        }
-                        await websocket.send_text(json.dumps(message))
-                        packet_count += 1
-                        if packet_count % 50 == 0:
-                            logger.info(f"📤 Sent {packet_count} audio packets to phone")
-                        elif packet_count <= 5:
-                            logger.info(f"📤 Sent packet #{packet_count} to phone")
-                    else:
-                        # Log queue status periodically
-                        if packet_count - last_queue_check > 100:
-                            logger.info(f"⏳ Queue empty, waiting for audio... (sent {packet_count} so far)")
-                            last_queue_check = packet_count
-                        await asyncio.sleep(0.0005)
-                except Exception as e:
-                    logger.error(f"❌ Error sending audio to Twilio: {e}")
-                    break
-        except asyncio.CancelledError:
-            logger.info(f"📤 Audio sender task cancelled after {packet_count} packets")
-            pass
+            import struct
+            
+            # Unpack 8kHz samples
+            samples_8k = struct.unpack(f'<{len(pcm_data_8khz)//2}h', pcm_data_8khz)
+            
+            # Upsample 8kHz to 16kHz (2x interpolation - simple and efficient)
+            samples_16k = []
+            for i in range(len(samples_8k) - 1):
+                samples_16k.append(samples_8k[i])
+                # Linear interpolation between samples
+                interpolated = (samples_8k[i] + samples_8k[i + 1]) // 2
+                samples_16k.append(interpolated)
+            samples_16k.append(samples_8k[-1])  # Last sample
+            
+            # Pack back to bytes
+            return struct.pack(f'<{len(samples_16k)}h', *samples_16k)
+            
+        except Exception:
+            # Last resort: audioop - upsample to 16kHz
+            return audioop.ratecv(pcm_data_8khz, 2, 1, 8000, RATE, None)[0]
+            
+    except Exception as e:
+        logger.error(f"Failed to upsample audio: {e}")
+        # Fallback to audioop - upsample to 16kHz
+        return audioop.ratecv(pcm_data_8khz, 2, 1, 8000, RATE, None)[0]
+
+
+async def start_call(call: CallContext):
+    """Notify consoles and start transcription for a newly connected call"""
+    logger.info(f"📞 Call stream started from {call.caller_number} (ID: {call.call_sid})")
 
-    send_task = None
+    # notify notification clients
+    await notify_clients({
+        "type": "call_started",
+        "caller_number": call.caller_number,
+        "call_sid": call.call_sid,
+        "timestamp": datetime.now().isoformat()
+    })
+
+    # Queue the call for operator assignment (offered to the least-loaded idle operator)
+    call_queue.enqueue(call.call_sid, call.caller_number)
+
+    # Start Deepgram transcribers (browser-only mode)
+    if DEEPGRAM_API_KEY:
+        loop = asyncio.get_event_loop()
+        
+        # Browser transcriber for DISPATCH/CONTROL_ROOM audio
+        call.browser_transcriber = DeepgramRealtimeTranscriber("DISPATCH", call, loop)
+        call.spawn(call.browser_transcriber.connect(), name="DISPATCH_connect")
+        
+        # Phone transcriber for CALLER audio
+        call.phone_transcriber = DeepgramRealtimeTranscriber("CALLER", call, loop)
+        call.spawn(call.phone_transcriber.connect(), name="CALLER_connect")
+        
+        logger.info("✅ LIVE transcription active (Browser + Phone)")
+    else:
+        logger.warning("⚠️  Transcription disabled (no Deepgram API key)")
+
+    start_early_language_id(call)
+
+
+def vad_stats(call: CallContext) -> dict:
+    """Per-leg share of audio the VAD kept from Deepgram"""
+    return {
+        transcriber.speaker_label: transcriber.vad.stats()
+        for transcriber in (call.phone_transcriber, call.browser_transcriber)
+        if transcriber and transcriber.vad
+    }
 
+
+async def end_call(call: CallContext):
+    """Single cleanup path for a call: stop tasks, persist transcripts/recording, notify consoles"""
+    if calls.get(call.call_sid) is not call:
+        return  # Already ended
+    calls.remove(call)
+    sessions.pop(call.call_sid, None)
+    call_queue.remove(call.call_sid)
+
+    await call.close()
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    if call.phone_transcriber:
+        call.phone_transcriber.save_transcript(f"transcript_caller_{call.caller_number}_{timestamp}.txt")
+    if call.browser_transcriber:
+        call.browser_transcriber.save_transcript(f"transcript_dispatch_{call.caller_number}_{timestamp}.txt")
+    await asyncio.to_thread(save_recording, call.recording, call.caller_number, timestamp)
+
+    jitter_gauge.remove(call_sid=call.call_sid)
+    loss_gauge.remove(call_sid=call.call_sid)
+
+    vad = vad_stats(call)
+    if vad:
+        logger.info(f"🔇 VAD suppressed for {call.call_sid}: " + ", ".join(f"{leg} {stats['suppressed_fraction']:.0%}" for leg, stats in vad.items()))
+
+    await notify_clients({
+        "type": "call_ended",
+        "caller_number": call.caller_number,
+        "call_sid": call.call_sid,
+        "vad": vad,
+        "network": call.jitter.stats(),
+        "timestamp": datetime.now().isoformat()
+    })
+
+    call.release()
+    logger.info(f"🧹 Cleaned up call state for {call.caller_number} (ID: {call.call_sid})")
+
+
+def trace_playback(utterance: dict, status: str):
+    """Close the utterance's outbound stages on its trace: queued -> sent to Twilio -> heard"""
+    turn = utterance.get("trace")
+    now = time.time_ns()
+    previous = utterance["status"]
+    if previous == "queued" and "queued_ns" in utterance:
+        tracing.record_span("outbound_queue", turn, utterance["queued_ns"], now,
+                            status="ok" if status == "sent" else status, queue_depth=utterance.get("queue_depth"))
+    elif previous == "sent" and "sent_ns" in utterance:
+        tracing.record_span("twilio_playout", turn, utterance["sent_ns"], now,
+                            status="ok" if status == "heard" else status)
+    if status == "sent":
+        utterance["sent_ns"] = now
+
+
+async def publish_playback(call: CallContext, utterance_id: str, status: str):
+    """Record and broadcast the playback status of a TTS utterance (queued/sent/heard/interrupted)"""
+    utterance = call.utterances.get(utterance_id)
+    if not utterance or utterance["status"] == status:
+        return
+    trace_playback(utterance, status)
+    utterance["status"] = status
+    await console_hub.publish(call_topics(call.call_sid, call.caller_number, call.agency), {
+        "type": "playback",
+        "utterance_id": utterance_id,
+        "status": status,
+        "text": utterance["text"],
+        "caller_number": call.caller_number,
+        "call_sid": call.call_sid,
+        "timestamp": datetime.now().isoformat()
+    })
+
+
+async def barge_in(call: CallContext, source: str):
+    """
+    Caller started speaking over TTS Twilio is playing: clear Twilio's buffer
+    and hold the cut-off and still-queued dispatcher speech until they finish
+    """
+    if not BARGE_IN_ENABLED:
+        return
+    interrupted = call.playing_utterances()
+    if not interrupted:
+        return
+    held = call.hold_outbound(interrupted)
+    call.queue_outbound({"clear": True})
+    barge_in_counter.inc(source=source)
+    logger.info(f"✋ Barge-in ({source}) on {call.call_sid}: interrupted {len(interrupted)} utterance(s), "
+                f"holding {len(held)} for replay")
+    for utterance_id in interrupted:
+        # The console shows it as not heard until the replay's mark comes back
+        await publish_playback(call, utterance_id, "interrupted")
+    call.spawn(resume_after_hold(call, call.outbound_epoch), name="barge_in_hold")
+
+
+async def resume_playback(call: CallContext, reason: str):
+    """Requeue the dispatcher speech held by a barge-in"""
+    if call.held_utterances is None:
+        return
+    resumed = call.resume_outbound()
+    logger.info(f"▶️ Replaying {len(resumed)} held utterance(s) on {call.call_sid} ({reason})")
+    for utterance_id in resumed:
+        utterance = call.utterances[utterance_id]
+        utterance["queued_ns"] = time.time_ns()
+        await publish_playback(call, utterance_id, "queued")
+
+
+async def resume_after_hold(call: CallContext, epoch: int):
+    # Caller noise may never produce an end of speech; don't hold dispatcher speech forever
+    await asyncio.sleep(BARGE_IN_HOLD_SECONDS)
+    if call.outbound_epoch == epoch:
+        await resume_playback(call, "hold timeout")
+
+
+async def handle_playback_mark(call: CallContext, name: Optional[str]):
+    """Twilio echoed a mark: the utterance before it was played out (unless it was cleared)"""
+    # Marks from before a barge-in are Twilio acknowledging the clear, not playback
+    utterance_id = call.mark_utterance(name)
+    utterance = call.utterances.get(utterance_id) if utterance_id else None
+    if utterance and utterance["status"] == "sent":
+        utterance.pop("audio", None)
+        await publish_playback(call, utterance_id, "heard")
+
+
+async def send_laptop_audio(call: CallContext, websocket: WebSocket):
+    """Forward queued outbound audio (translated TTS / dispatcher passthrough) and control messages to the phone"""
+    packet_count = 0
+    logger.info(f"🎵 Audio sender task started - monitoring queue")
+    
+    async def send_control(item: dict) -> bool:
+        # Control messages: a mark after an utterance, or clear on barge-in
+        if "mark" in item:
+            message = {"event": "mark", "streamSid": call.stream_sid, "mark": {"name": item["mark"]}}
+        else:
+            message = {"event": "clear", "streamSid": call.stream_sid}
+        try:
+            await websocket.send_text(json.dumps(message))
+        except Exception as e:
+            logger.error(f"❌ Error sending {message['event']} to Twilio: {e}")
+            return False
+        if "mark" in item:
+            await publish_playback(call, item["utterance_id"], "sent")
+        return True
+    
     try:
         while True:
-            data = await websocket.receive_text()
-            message = json.loads(data)
+            item = await call.outbound.get()
+            if isinstance(item, dict):
+                if not await send_control(item):
+                    break
+                continue
+            
+            # Backlogged frames (TTS) go out as one 100-200ms message; live audio stays at 20ms
+            audio, control = take_batch(item, call.outbound)
+            try:
+                await websocket.send_text(media_message(call.stream_sid, audio))
+            except Exception as e:
+                logger.error(f"❌ Error sending audio to Twilio: {e}")
+                break
+            record_sent(audio)
+            if control and not await send_control(control):
+                break
+            packet_count += 1
+            hot_log.info(f"sent_to_phone:{call.call_sid}", "📤 Sent %d audio packets to phone", packet_count)
+    except asyncio.CancelledError:
+        logger.info(f"📤 Audio sender task cancelled after {packet_count} packets")
+        raise
 
-            if message["event"] == "start":
-                call_sid = message["start"]["callSid"]
-                stream_sid = message["start"]["streamSid"]
 
-                caller_number = "unknown"
-                if call_sid in sessions:
-                    caller_number = sessions[call_sid].get("caller_number", "unknown")
-                    sessions[call_sid]["active"] = True
-                    sessions[call_sid]["stream_sid"] = stream_sid
-                else:
-                    sessions[call_sid] = {"active": True, "stream_sid": stream_sid, "caller_number": caller_number}
+async def handle_inbound_media(call: CallContext, media: dict):
+    """Decode caller audio and pass it through the jitter buffer in chunk order"""
+    payload = media.get("payload")
+    if not payload:
+        return
+    
+    ulaw_data = base64.b64decode(payload)
+    pcm_data_8khz = audioop.ulaw2lin(ulaw_data, 2)
+    
+    try:
+        chunk = int(media["chunk"])
+        timestamp_ms = float(media["timestamp"])
+    except (KeyError, TypeError, ValueError):
+        chunk, timestamp_ms = None, None
+    
+    ready = call.jitter.push(chunk, timestamp_ms, pcm_data_8khz)
+    for frame, _concealed in ready:
+        await handle_inbound_frame(call, frame)
+    
+    if ready and call.jitter.received % NETWORK_STATS_FRAMES == 0:
+        await publish_network_quality(call)
+
+
+async def publish_network_quality(call: CallContext):
+    """Push the call's inbound jitter/loss to /metrics and the consoles following it"""
+    stats = call.jitter.stats()
+    jitter_gauge.set(stats["jitter_ms"], call_sid=call.call_sid)
+    loss_gauge.set(stats["loss_fraction"], call_sid=call.call_sid)
+    await console_hub.publish(call_topics(call.call_sid, call.caller_number, call.agency), {
+        "type": "network_quality",
+        "caller_number": call.caller_number,
+        "call_sid": call.call_sid,
+        **stats,
+        "timestamp": datetime.now().isoformat()
+    })
 
-                logger.info(f"📞 Call stream started from {caller_number} (ID: {call_sid})")
 
-                # notify notification clients
-                notification_message = {
-                    "type": "call_started",
-                    "caller_number": caller_number,
-                    "call_sid": call_sid,
-                    "timestamp": datetime.now().isoformat()
-                }
-                for client in list(notification_clients):
-                    try:
-                        await client.send_json(notification_message)
-                    except Exception as e:
-                        logger.error(f"❌ Failed to notify client: {e}")
-                        notification_clients.discard(client)
-
-                # Start Deepgram transcribers (browser-only mode)
-                if DEEPGRAM_API_KEY:
-                    loop = asyncio.get_event_loop()
-                    
-                    # Browser transcriber for DISPATCH/CONTROL_ROOM audio
-                    browser_transcriber = DeepgramRealtimeTranscriber("DISPATCH", caller_number, loop)
-                    asyncio.create_task(browser_transcriber.connect())
-                    browser_transcribers[caller_number] = {
-                        "browser_transcriber": browser_transcriber
-                    }
-                    
-                    # Phone transcriber for CALLER audio
-                    phone_transcriber = DeepgramRealtimeTranscriber("CALLER", caller_number, loop)
-                    asyncio.create_task(phone_transcriber.connect())
-                    active_transcribers[call_sid] = {
-                        "phone_transcriber": phone_transcriber
-                    }
-                    
-                    logger.info("✅ LIVE transcription active (Browser + Phone)")
-                else:
-                    logger.warning("⚠️  Transcription disabled (no Deepgram API key)")
+async def handle_inbound_frame(call: CallContext, pcm_data_8khz: bytes):
+    """Fan one in-order 20ms caller frame out to recording, language ID, transcriber and consoles"""
+    pcm_data_16khz = upsample_to_wideband(pcm_data_8khz)
+    
+    # Save for recording (16kHz); the mixer below fills the late-joiner replay buffer
+    call.recording.append(pcm_data_16khz)
+    
+    # Feed early audio language identification (first seconds of speech)
+    identifier = call.language_identifier
+    if identifier and not identifier.submitted:
+        identifier.feed(pcm_data_16khz)
+    
+    # Forward to Deepgram phone transcriber for CALLER transcription (16kHz)
+    transcriber = call.phone_transcriber
+    if transcriber:
+        transcriber.stream_audio(pcm_data_16khz)
+        # Local VAD onset beats Deepgram's SpeechStarted round trip for barge-in
+        if transcriber.vad and transcriber.vad.take_onset(BARGE_IN_MIN_SPEECH_MS):
+            await barge_in(call, "vad")
+    
+    # Mixed caller + dispatcher stream for supervisors: mixed and encoded once however many listen
+    monitor_topics = call_topics(call.call_sid, call.caller_number, kind="monitor")
+    if console_hub.has_subscribers(monitor_topics):
+        frame = call.mixer.mix(pcm_data_16khz)
+        if frame:
+            await console_hub.publish(monitor_topics, {
+                **call.mixer.encode(frame),
+                "caller_number": call.caller_number,
+                "call_sid": call.call_sid
+            })
+    else:
+        call.mixer.skip(pcm_data_16khz)
+    
+    # Caller audio for console playback, encoded at most once per frame for each codec someone asked for
+    for codec in CODECS:
+        audio_topics = call_topics(call.call_sid, call.caller_number, kind=audio_kind(codec))
+        if not console_hub.has_subscribers(audio_topics):
+            if codec == OPUS and call.opus_stream:
+                call.opus_stream.reset()
+            continue
+        
+        if codec == MULAW:
+            # Twilio's own 8kHz μ-law - ~5x less than upsampled PCM16
+            audio = {"audio": base64.b64encode(audioop.lin2ulaw(pcm_data_8khz, 2)).decode("utf-8"), "sample_rate": 8000}
+        elif codec == OPUS:
+            if call.opus_stream is None:
+                call.opus_stream = OpusStream()
+            packets = await call.opus_stream.push(pcm_data_16khz)
+            if not packets:
+                continue
+            # Raw 20ms packets from the call's one continuous stream, decoded with its OpusHead
+            audio = {
+                "packets": [base64.b64encode(packet).decode("utf-8") for packet in packets],
+                "opus_head": base64.b64encode(call.opus_stream.head).decode("utf-8"),
+                "sample_rate": RATE,
+            }
+        else:
+            # Send 16kHz PCM directly (no μ-law compression for better quality)
+            audio = {"audio": base64.b64encode(pcm_data_16khz).decode("utf-8"), "sample_rate": RATE}
+        
+        await console_hub.publish(audio_topics, {
+            "type": "audio",
+            **audio,
+            "encoding": codec,
+            "caller_number": call.caller_number,
+            "call_sid": call.call_sid,
+            "timestamp": datetime.now().isoformat()
+        })
 
-                send_task = asyncio.create_task(send_laptop_audio())
 
-            elif message["event"] == "media":
-                # inbound media (from caller)
-                media = message["media"]
-                track = media.get("track", "inbound")
-                if track == "inbound":
-                    payload = media.get("payload")
-                    if payload:
-                        try:
-                            ulaw_data = base64.b64decode(payload)
-                            pcm_data_8khz = audioop.ulaw2lin(ulaw_data, 2)
-                            
-                            # Better upsampling from 8kHz to 16kHz
-                            try:
-                                # Try numpy for best quality
-                                import numpy as np
-                                
-                                # Convert bytes to int16 array
-                                audio_array = np.frombuffer(pcm_data_8khz, dtype=np.int16)
-                                
-                                # High-quality upsampling: duplicate + filter
-                                upsampled = np.repeat(audio_array, 2)
-                                
-                                # Apply low-pass filter to smooth
-                                kernel = np.array([0.25, 0.5, 0.25])
-                                filtered = np.convolve(upsampled, kernel, mode='same')
-                                
-                                pcm_data_16khz = filtered.astype(np.int16).tobytes()
-                                
-                            except ImportError:
-                                # Fallback: Manual upsampling with linear interpolation
-                                try:
-                                    import struct
-                                    
-                                    # Unpack 8kHz samples
-                                    samples_8k = struct.unpack(f'<{len(pcm_data_8khz)//2}h', pcm_data_8khz)
-                                    
-                                    # Upsample 8kHz to 16kHz (2x interpolation - simple and efficient)
-                                    samples_16k = []
-                                    for i in range(len(samples_8k) - 1):
-                                        samples_16k.append(samples_8k[i])
-                                        # Linear interpolation between samples
-                                        interpolated = (samples_8k[i] + samples_8k[i + 1]) // 2
-                                        samples_16k.append(interpolated)
-                                    samples_16k.append(samples_8k[-1])  # Last sample
-                                    
-                                    # Pack back to bytes
-                                    pcm_data_16khz = struct.pack(f'<{len(samples_16k)}h', *samples_16k)
-                                    
-                                except Exception:
-                                    # Last resort: audioop - upsample to 16kHz
-                                    pcm_data_16khz = audioop.ratecv(pcm_data_8khz, 2, 1, 8000, RATE, None)[0]
-                                    
-                            except Exception as e:
-                                logger.error(f"Failed to upsample audio: {e}")
-                                # Fallback to audioop - upsample to 16kHz
-                                pcm_data_16khz = audioop.ratecv(pcm_data_8khz, 2, 1, 8000, RATE, None)[0]
-                            
-                            # Save for recording (16kHz)
-                            try:
-                                with recording_lock:
-                                    phone_audio_recording.append(pcm_data_16khz)
-                            except Exception:
-                                pass
-                            
-                            # Forward to Deepgram phone transcriber for CALLER transcription (16kHz)
-                            if call_sid in active_transcribers:
-                                phone_trans = active_transcribers[call_sid].get("phone_transcriber")
-                                if phone_trans:
-                                    phone_trans.stream_audio(pcm_data_16khz)
-                            
-                            # Send upsampled 16kHz audio to browser for playback (better quality)
-                            if caller_number in transcription_clients:
-                                # Send 16kHz PCM directly (no μ-law compression for better quality)
-                                payload_16khz = base64.b64encode(pcm_data_16khz).decode("utf-8")
-                                
-                                audio_message = {
-                                    "type": "audio",
-                                    "audio": payload_16khz,
-                                    "sample_rate": RATE,  # Indicate this is 16kHz
-                                    "encoding": "pcm16",   # Raw PCM16, not μ-law
-                                    "timestamp": datetime.now().isoformat()
-                                }
-                                for client in list(transcription_clients[caller_number]):
-                                    try:
-                                        await client.send_json(audio_message)
-                                    except Exception as e:
-                                        logger.error(f"Failed to send audio to browser: {e}")
-                                        transcription_clients[caller_number].discard(client)
+# Main WebSocket endpoint for Twilio Stream
+@app.websocket("/ws")
+async def websocket_endpoint(websocket: WebSocket):
+    """Main WebSocket endpoint for Twilio audio streaming"""
+    await websocket.accept()
+    call: Optional[CallContext] = None
+
+    try:
+        # Wait for the stream "start" event
+        while call is None:
+            message = json.loads(await websocket.receive_text())
+            if message["event"] != "start":
+                continue
+
+            call_sid = message["start"]["callSid"]
+            stream_sid = message["start"]["streamSid"]
+            metadata = sessions.pop(call_sid, {})
+            caller_number = metadata.get("caller_number") or "unknown"
+            call = CallContext(call_sid, caller_number, stream_sid, metadata)
+            calls.add(call)
+            # Every log line from this call (and the tasks it spawns) carries its SID and number
+            bind_call(call_sid, caller_number)
 
+        # Everything the call starts lives in its task group and ends with it
+        async with call:
+            await start_call(call)
+            call.spawn(send_laptop_audio(call, websocket), name="send_laptop_audio")
+
+            while True:
+                message = json.loads(await websocket.receive_text())
+
+                if message["event"] == "media":
+                    # inbound media (from caller)
+                    media = message["media"]
+                    if media.get("track", "inbound") == "inbound":
+                        try:
+                            await handle_inbound_media(call, media)
                         except Exception as e:
-                            logger.error(f"❌ Error handling inbound media: {e}")
+                            hot_log.error(f"inbound_media:{call.call_sid}", "❌ Error handling inbound media: %s", e, exc_info=True)
 
-            elif message["event"] == "stop":
-                logger.info(f"📴 Call ended from {caller_number}")
+                elif message["event"] == "mark":
+                    # Twilio finished playing (or cleared) everything queued before this mark
+                    await handle_playback_mark(call, message.get("mark", {}).get("name"))
 
-                notification_message = {
-                    "type": "call_ended",
-                    "caller_number": caller_number,
-                    "call_sid": call_sid,
-                    "timestamp": datetime.now().isoformat()
-                }
-                for client in list(notification_clients):
-                    try:
-                        await client.send_json(notification_message)
-                    except Exception as e:
-                        logger.error(f"❌ Failed to notify client: {e}")
-                        notification_clients.discard(client)
-
-                # Stop transcribers
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                
-                # Stop phone transcriber
-                if call_sid in active_transcribers:
-                    transcribers = active_transcribers[call_sid]
-                    phone = transcribers.get("phone_transcriber")
-                    if phone:
-                        asyncio.create_task(phone.stop())
-                        phone.save_transcript(f"transcript_caller_{caller_number}_{timestamp}.txt")
-                    del active_transcribers[call_sid]
-                
-                # Stop browser transcriber
-                if caller_number in browser_transcribers:
-                    transcribers = browser_transcribers[caller_number]
-                    browser = transcribers.get("browser_transcriber")
-                    if browser:
-                        asyncio.create_task(browser.stop())
-                        browser.save_transcript(f"transcript_dispatch_{caller_number}_{timestamp}.txt")
-                    del browser_transcribers[caller_number]
-                
-                # Clean up language state
-                if caller_number in caller_languages:
-                    del caller_languages[caller_number]
-                if caller_number in dispatcher_languages:
-                    del dispatcher_languages[caller_number]
-                if caller_number in dispatcher_should_translate:
-                    del dispatcher_should_translate[caller_number]
-                logger.info(f"🧹 Cleaned up language state for {caller_number}")
-
-                if send_task:
-                    send_task.cancel()
-                break
+                elif message["event"] == "stop":
+                    logger.info(f"📴 Call ended from {call.caller_number}")
+                    break
 
     except WebSocketDisconnect:
-        logger.info(f"📴 WebSocket connection closed for call {call_sid}")
-        if call_sid in active_transcribers:
-            transcribers = active_transcribers[call_sid]
-            if transcribers.get("phone_transcriber"):
-                asyncio.create_task(transcribers["phone_transcriber"].stop())
-            del active_transcribers[call_sid]
-        if caller_number and caller_number in browser_transcribers:
-            transcribers = browser_transcribers[caller_number]
-            if transcribers.get("browser_transcriber"):
-                asyncio.create_task(transcribers["browser_transcriber"].stop())
-            del browser_transcribers[caller_number]
-        if caller_number:
-            if caller_number in caller_languages:
-                del caller_languages[caller_number]
-            if caller_number in dispatcher_languages:
-                del dispatcher_languages[caller_number]
-            if caller_number in dispatcher_should_translate:
-                del dispatcher_should_translate[caller_number]
-        if send_task:
-            send_task.cancel()
-        if call_sid and call_sid in sessions:
-            sessions.pop(call_sid, None)
+        logger.info(f"📴 WebSocket connection closed for call {call.call_sid if call else None}")
     except Exception as e:
         logger.error(f"Error in websocket endpoint: {e}")
-        if call_sid in active_transcribers:
-            transcribers = active_transcribers[call_sid]
-            if transcribers.get("phone_transcriber"):
-                asyncio.create_task(transcribers["phone_transcriber"].stop())
-            del active_transcribers[call_sid]
-        if caller_number and caller_number in browser_transcribers:
-            transcribers = browser_transcribers[caller_number]
-            if transcribers.get("browser_transcriber"):
-                asyncio.create_task(transcribers["browser_transcriber"].stop())
-            del browser_transcribers[caller_number]
-        if caller_number:
-            if caller_number in caller_languages:
-                del caller_languages[caller_number]
-            if caller_number in dispatcher_languages:
-                del dispatcher_languages[caller_number]
-            if caller_number in dispatcher_should_translate:
-                del dispatcher_should_translate[caller_number]
-        if send_task:
-            send_task.cancel()
+    finally:
+        if call:
+            await end_call(call)
 
 
 def main():
@@ -0,0 +1,306 @@
+"""
+Training Session Store
+Training sessions kept as plain, JSON-serializable dicts (scenario, transcript,
+and the model chat history as role/text turns). Gemini chat objects are never
+persisted: they are rebuilt from the history on demand. Idle sessions are
+evicted from memory by TTL and LRU, and changes are written behind to SQLite,
+which also lets every uvicorn worker on the host see every session
+"""
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+from config import config
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+TRAINING_SESSION_DB = config.get("TRAINING_SESSION_DB", "training_sessions.db")
+TRAINING_SESSION_TTL_SECONDS = float(config.get("TRAINING_SESSION_TTL_SECONDS", "3600"))
+TRAINING_SESSION_MAX = int(config.get("TRAINING_SESSION_MAX", "1000"))
+TRAINING_SESSION_RETENTION_DAYS = float(config.get("TRAINING_SESSION_RETENTION_DAYS", "7"))
+TRAINING_SESSION_FLUSH_SECONDS = float(config.get("TRAINING_SESSION_FLUSH_SECONDS", "1"))
+
+# Keys that only make sense inside this process and are never written out
+TRANSIENT_KEYS = ("chat", "lock")
+
+# How often rows past the retention window are purged from the database
+PURGE_INTERVAL_SECONDS = 3600
+
+training_sessions_cached = registry.gauge("training_sessions_cached", "Training sessions held in memory")
+training_sessions_evicted = registry.counter("training_sessions_evicted_total", "Training sessions dropped from memory")
+training_sessions_loaded = registry.counter("training_sessions_loaded_total", "Training sessions read back from the database")
+training_session_flush_errors = registry.counter("training_session_flush_errors_total", "Write-behind flushes that failed")
+
+
+def add_exchange(session: dict, prompt: str, reply: str):
+    """Append one user -> model exchange to the chat history the session is rebuilt from"""
+    session["history"].append({"role": "user", "text": prompt})
+    session["history"].append({"role": "model", "text": reply})
+
+
+class SqliteSessionBackend:
+    """One row per session; WAL mode so several worker processes can share the file"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS training_sessions ("
+            "session_id TEXT PRIMARY KEY, version INTEGER NOT NULL, status TEXT, "
+            "updated_at REAL NOT NULL, data TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS training_sessions_updated ON training_sessions (updated_at)")
+        self._conn.commit()
+
+    def insert(self, session_id: str, version: int, status: str, updated_at: float, data: str) -> bool:
+        """Reserve a new session id (False if any worker already has it)"""
+        with self._lock:
+            try:
+                with self._conn:
+                    self._conn.execute("INSERT INTO training_sessions VALUES (?, ?, ?, ?, ?)",
+                                       (session_id, version, status, updated_at, data))
+                return True
+            except sqlite3.IntegrityError:
+                return False
+
+    def save_many(self, rows: List[Tuple[str, int, str, float, str]]):
+        # Never overwrite a newer version written by another worker
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO training_sessions VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET version=excluded.version, status=excluded.status, "
+                "updated_at=excluded.updated_at, data=excluded.data WHERE excluded.version > training_sessions.version",
+                rows,
+            )
+
+    def load(self, session_id: str) -> Optional[Tuple[int, str]]:
+        with self._lock:
+            row = self._conn.execute("SELECT version, data FROM training_sessions WHERE session_id = ?",
+                                     (session_id,)).fetchone()
+        return row
+
+    def version(self, session_id: str) -> Optional[int]:
+        with self._lock:
+            row = self._conn.execute("SELECT version FROM training_sessions WHERE session_id = ?",
+                                     (session_id,)).fetchone()
+        return row[0] if row else None
+
+    def delete(self, session_id: str):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM training_sessions WHERE session_id = ?", (session_id,))
+
+    def purge(self, before: float) -> int:
+        with self._lock, self._conn:
+            return self._conn.execute("DELETE FROM training_sessions WHERE updated_at < ?", (before,)).rowcount
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM training_sessions").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class TrainingSessionStore:
+    """
+    LRU/TTL cache of session dicts in front of an optional SqliteSessionBackend.
+    Call save(session_id) after mutating a session; the write happens on the
+    next flush. With no database path it is a bounded in-memory store
+    """
+
+    def __init__(self, chat_factory: Callable, path: Optional[str] = TRAINING_SESSION_DB,
+                 ttl: float = TRAINING_SESSION_TTL_SECONDS, max_sessions: int = TRAINING_SESSION_MAX,
+                 retention_days: float = TRAINING_SESSION_RETENTION_DAYS,
+                 flush_seconds: float = TRAINING_SESSION_FLUSH_SECONDS):
+        self.chat_factory = chat_factory
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.retention_seconds = retention_days * 86400
+        self.flush_seconds = flush_seconds
+        self.backend = SqliteSessionBackend(path) if path else None
+        self._sessions: "OrderedDict[str, dict]" = OrderedDict()
+        self._last_used: Dict[str, float] = {}
+        self._pending: Dict[str, dict] = {}  # session_id -> session awaiting write-behind
+        self._task: Optional[asyncio.Task] = None
+        self._last_purge = 0.0
+
+    # ---- serialization ----
+
+    @staticmethod
+    def _serialize(session: dict) -> str:
+        return json.dumps({k: v for k, v in session.items() if k not in TRANSIENT_KEYS}, ensure_ascii=False)
+
+    @staticmethod
+    def _row(session_id: str, session: dict) -> Tuple[str, int, str, float, str]:
+        return (session_id, session["version"], session.get("status"), session["updated_at"],
+                TrainingSessionStore._serialize(session))
+
+    def _attach(self, session_id: str, session: dict):
+        session.setdefault("lock", asyncio.Lock())
+        session.setdefault("chat", None)
+        self._sessions[session_id] = session
+        self._sessions.move_to_end(session_id)
+        self._last_used[session_id] = time.monotonic()
+        self._evict_lru()
+        training_sessions_cached.set(len(self._sessions))
+
+    # ---- access ----
+
+    async def create(self, session_id: str, session: dict) -> bool:
+        """Register a new session; False if the id is already taken (here or on another worker)"""
+        if session_id in self._sessions or session_id in self._pending:
+            return False
+        session.setdefault("history", [])
+        session["version"] = 1
+        session["updated_at"] = time.time()
+        if self.backend:
+            row = self._row(session_id, session)
+            if not await asyncio.to_thread(self.backend.insert, *row):
+                return False
+        self._attach(session_id, session)
+        return True
+
+    async def get(self, session_id: str) -> Optional[dict]:
+        """Session by id: from memory if current, otherwise (re)loaded from the database"""
+        session = self._sessions.get(session_id) or self._pending.get(session_id)
+        if session is not None and (self.backend is None or session_id in self._pending):
+            self._attach(session_id, session)
+            return session
+        if self.backend is None:
+            return None
+
+        if session is not None:
+            # Another worker may have moved the conversation on since we cached it
+            version = await asyncio.to_thread(self.backend.version, session_id)
+            if version is None or version <= session["version"]:
+                self._attach(session_id, session)
+                return session
+        row = await asyncio.to_thread(self.backend.load, session_id)
+        if row is None:
+            return None
+        loaded = json.loads(row[1])
+        training_sessions_loaded.inc()
+        if session is not None:
+            # Refresh in place so a turn waiting on the lock sees the new state
+            session.update(loaded)
+            session["chat"] = None
+        else:
+            session = loaded
+        self._attach(session_id, session)
+        return session
+
+    def chat(self, session: dict):
+        """The session's model chat, rebuilt from its history if this process doesn't hold one"""
+        if session.get("chat") is None:
+            session["chat"] = self.chat_factory(session.get("history") or None)
+        return session["chat"]
+
+    def save(self, session_id: str):
+        """Mark a mutated session for the next write-behind flush"""
+        session = self._sessions.get(session_id) or self._pending.get(session_id)
+        if session is None:
+            return
+        session["version"] += 1
+        session["updated_at"] = time.time()
+        if self.backend:
+            self._pending[session_id] = session
+
+    async def discard(self, session_id: str):
+        """Forget a session that never got going (e.g. its opening line failed)"""
+        self._sessions.pop(session_id, None)
+        self._last_used.pop(session_id, None)
+        self._pending.pop(session_id, None)
+        training_sessions_cached.set(len(self._sessions))
+        if self.backend:
+            await asyncio.to_thread(self.backend.delete, session_id)
+
+    # ---- eviction ----
+
+    def _evict(self, session_id: str):
+        # Dirty sessions stay reachable through _pending until flushed
+        self._sessions.pop(session_id, None)
+        self._last_used.pop(session_id, None)
+        training_sessions_evicted.inc()
+
+    def _evict_lru(self):
+        if len(self._sessions) <= self.max_sessions:
+            return
+        for session_id in list(self._sessions):
+            if len(self._sessions) <= self.max_sessions:
+                break
+            if not self._sessions[session_id]["lock"].locked():
+                self._evict(session_id)
+
+    def _evict_idle(self):
+        cutoff = time.monotonic() - self.ttl
+        for session_id, last_used in list(self._last_used.items()):
+            if last_used < cutoff and not self._sessions[session_id]["lock"].locked():
+                self._evict(session_id)
+        training_sessions_cached.set(len(self._sessions))
+
+    # ---- write-behind ----
+
+    async def flush(self):
+        if not self._pending or not self.backend:
+            return
+        pending, self._pending = self._pending, {}
+        rows = [self._row(session_id, session) for session_id, session in pending.items()]
+        try:
+            await asyncio.to_thread(self.backend.save_many, rows)
+        except Exception as e:
+            training_session_flush_errors.inc()
+            logger.error(f"❌ Could not persist {len(rows)} training sessions: {e}")
+            for session_id, session in pending.items():
+                self._pending.setdefault(session_id, session)
+
+    async def _purge(self):
+        if not self.backend or time.monotonic() - self._last_purge < PURGE_INTERVAL_SECONDS:
+            return
+        self._last_purge = time.monotonic()
+        try:
+            purged = await asyncio.to_thread(self.backend.purge, time.time() - self.retention_seconds)
+            if purged:
+                logger.info(f"🧹 Purged {purged} training sessions older than {self.retention_seconds / 86400:g} days")
+        except Exception as e:
+            logger.error(f"❌ Could not purge old training sessions: {e}")
+
+    async def _run(self):
+        try:
+            while True:
+                await asyncio.sleep(self.flush_seconds)
+                await self.flush()
+                self._evict_idle()
+                await self._purge()
+        except asyncio.CancelledError:
+            pass
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+        if self.backend:
+            self.backend.close()
+
+    def stats(self) -> dict:
+        return {
+            "cached": len(self._sessions),
+            "pending_writes": len(self._pending),
+            "max_sessions": self.max_sessions,
+            "ttl_seconds": self.ttl,
+            "database": self.backend.path if self.backend else None,
+        }
@@ -0,0 +1,294 @@
+"""
+Console Subscriptions
+Topic index for dashboard WebSockets: a console subscribes to the topics it
+wants (calls, agencies, notifications, audio) and events are delivered only to
+matching subscribers, serialized once per event. Each console has its own
+bounded send queue and sender task, so publishing never waits on a socket
+"""
+import asyncio
+import json
+import logging
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+from fastapi import WebSocket
+
+from config import config
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Seconds between hub-wide keepalive messages
+KEEPALIVE_INTERVAL = 30.0
+
+NOTIFICATIONS = "notifications"
+
+# Interim transcripts are coalesced per subscriber and flushed at most once per tick
+INTERIM_TICK_SECONDS = float(config.get("INTERIM_TICK_MS", "100")) / 1000
+
+# Messages queued per console (~10s of caller audio) before it is resynced
+CONSOLE_QUEUE_SIZE = int(config.get("CONSOLE_QUEUE_SIZE", "512"))
+RESYNC_TEXT = json.dumps({"type": "resync"})
+
+interim_updates = registry.counter("console_interim_updates_total", "Interim transcript updates by outcome (sent/coalesced)")
+console_bytes = registry.counter("console_bytes_sent_total", "Bytes sent to console sockets by message kind")
+console_resyncs = registry.counter("console_resyncs_total", "Consoles whose send backlog overflowed and was dropped")
+
+
+def common_prefix_length(a: str, b: str) -> int:
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+def call_topics(call_sid: str, caller_number: str, agency: Optional[str] = None, kind: str = "call") -> List[str]:
+    """
+    Topics an event for one call is published to.
+
+    kind is "call" (transcripts and call events) or "audio" (caller audio);
+    "<kind>:*" is the supervisor wildcard that used to be the "all" client key.
+    """
+    topics = [f"{kind}:{call_sid}", f"{kind}:{caller_number}", f"{kind}:*"]
+    if agency and kind == "call":
+        topics.append(f"agency:{agency}")
+    return topics
+
+
+class Subscriber:
+    """
+    One console WebSocket and the topics it follows.
+
+    With delta=True interim transcripts carry only the changed suffix relative
+    to the last hypothesis sent on this socket: {"delta": {"base": n, "text": s}}
+    means message = previous[:n] + s. Finals are always sent in full.
+
+    Everything sent to the socket goes through `queue` and one sender task.
+    A console that falls CONSOLE_QUEUE_SIZE messages behind has its backlog
+    dropped and gets {"type": "resync"} followed by fresh call snapshots.
+    """
+
+    def __init__(self, websocket: WebSocket, name: str = "console", delta: bool = False, codec: str = "pcm16",
+                 queue_size: int = CONSOLE_QUEUE_SIZE):
+        self.websocket = websocket
+        self.name = name
+        self.delta = delta
+        self.codec = codec  # Negotiated playback codec for audio topics
+        self.topics: Set[str] = set()
+        self.pending_interims: Dict[str, dict] = {}  # stream key -> newest unsent interim
+        self.sent_interims: Dict[str, str] = {}  # stream key -> last interim text sent
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.resyncs = 0
+        self._on_error: Optional[Callable[["Subscriber"], None]] = None
+        self._on_overflow: Optional[Callable[["Subscriber"], None]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def offer(self, text: str) -> bool:
+        """Queue a serialized message without waiting; False if the backlog overflowed"""
+        try:
+            self.queue.put_nowait(text)
+            return True
+        except asyncio.QueueFull:
+            # Events can't be skipped selectively: drop the backlog and start over from snapshots
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.resyncs += 1
+            console_resyncs.inc()
+            logger.warning(f"⚠️ {self.name} fell {self.queue.maxsize} messages behind, resyncing")
+            self.queue.put_nowait(RESYNC_TEXT)
+            if self._on_overflow:
+                self._on_overflow(self)
+            return False
+
+    async def send_text(self, text: str):
+        self.offer(text)
+
+    async def send_json(self, message: dict):
+        self.offer(json.dumps(message))
+
+    def start(self, on_error: Callable[["Subscriber"], None], on_overflow: Optional[Callable[["Subscriber"], None]] = None):
+        self._on_error = on_error
+        self._on_overflow = on_overflow
+        if self._task is None:
+            self._task = asyncio.create_task(self._send_loop())
+
+    async def _send_loop(self):
+        try:
+            while True:
+                text = await self.queue.get()
+                await self.websocket.send_text(text)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f"❌ Failed to send to {self.name}: {e}")
+            if self._on_error:
+                self._on_error(self)
+
+    def close(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+
+class SubscriptionHub:
+    """
+    Topic -> subscribers index shared by every console endpoint. `on_resync`
+    is called with a subscriber whose backlog was dropped, to resend its snapshots
+    """
+
+    def __init__(self, on_resync: Optional[Callable[[Subscriber], None]] = None):
+        self.on_resync = on_resync
+        self._index: Dict[str, Set[Subscriber]] = {}
+        self._subscribers: Set[Subscriber] = set()
+        self._keepalive_task: Optional[asyncio.Task] = None
+        self._interim_task: Optional[asyncio.Task] = None
+        self._interim_ready = asyncio.Event()
+        self._pending: Set[Subscriber] = set()
+
+    def __len__(self):
+        return len(self._subscribers)
+
+    def add(self, subscriber: Subscriber, topics: Iterable[str] = ()):
+        self._subscribers.add(subscriber)
+        subscriber.start(self.remove, self._resync)
+        for topic in topics:
+            self.subscribe(subscriber, topic)
+
+    def subscribe(self, subscriber: Subscriber, topic: str):
+        subscriber.topics.add(topic)
+        self._index.setdefault(topic, set()).add(subscriber)
+
+    def unsubscribe(self, subscriber: Subscriber, topic: str):
+        subscriber.topics.discard(topic)
+        members = self._index.get(topic)
+        if members is not None:
+            members.discard(subscriber)
+            if not members:
+                del self._index[topic]
+
+    def remove(self, subscriber: Subscriber):
+        for topic in list(subscriber.topics):
+            self.unsubscribe(subscriber, topic)
+        self._subscribers.discard(subscriber)
+        self._pending.discard(subscriber)
+        subscriber.close()
+
+    def _resync(self, subscriber: Subscriber):
+        if self.on_resync and subscriber in self._subscribers:
+            self.on_resync(subscriber)
+
+    def subscribers_for(self, topics: Iterable[str]) -> Set[Subscriber]:
+        matched: Set[Subscriber] = set()
+        for topic in topics:
+            members = self._index.get(topic)
+            if members:
+                matched.update(members)
+        return matched
+
+    def has_subscribers(self, topics: Iterable[str]) -> bool:
+        return any(self._index.get(topic) for topic in topics)
+
+    async def publish(self, topics: Iterable[str], message: dict, stream_key: Optional[str] = None) -> int:
+        """
+        Deliver an event to every subscriber of any of the topics (each at most once).
+
+        Pass the transcript stream_key (call + speaker) for a final transcript so a
+        coalesced interim for the same utterance is dropped instead of sent after it.
+        """
+        subscribers = self.subscribers_for(topics)
+        if not subscribers:
+            return 0
+        if stream_key is not None:
+            for subscriber in subscribers:
+                subscriber.pending_interims.pop(stream_key, None)
+                subscriber.sent_interims.pop(stream_key, None)
+        return await self.publish_text(subscribers, json.dumps(message), kind=message.get("type", "event"))
+
+    def publish_interim(self, topics: Iterable[str], stream_key: str, message: dict) -> int:
+        """Queue an interim transcript; a newer interim for the same stream replaces it"""
+        subscribers = self.subscribers_for(topics)
+        for subscriber in subscribers:
+            if stream_key in subscriber.pending_interims:
+                interim_updates.inc(outcome="coalesced")
+            subscriber.pending_interims[stream_key] = message
+            self._pending.add(subscriber)
+        if subscribers:
+            self._interim_ready.set()
+        return len(subscribers)
+
+    async def publish_text(self, subscribers: Iterable[Subscriber], text: str, kind: str = "event") -> int:
+        """Queue an already-serialized event for the given subscribers (never waits on a socket)"""
+        delivered = sum(1 for subscriber in list(subscribers) if subscriber.offer(text))
+        console_bytes.inc(len(text) * delivered, kind=kind)
+        return delivered
+
+    async def flush_interims(self):
+        """Send each subscriber its newest interim per stream (full or delta-encoded)"""
+        pending, self._pending = self._pending, set()
+        # Subscribers at the same point of the same utterance share one serialization
+        encoded: Dict[tuple, str] = {}
+        for subscriber in pending:
+            interims, subscriber.pending_interims = subscriber.pending_interims, {}
+            for stream_key, message in interims.items():
+                text = message.get("message", "")
+                if subscriber.delta:
+                    previous = subscriber.sent_interims.get(stream_key, "")
+                    base = common_prefix_length(previous, text)
+                    cache_key = (stream_key, message.get("seq"), base)
+                    if cache_key not in encoded:
+                        body = {k: v for k, v in message.items() if k != "message"}
+                        body["delta"] = {"base": base, "text": text[base:]}
+                        encoded[cache_key] = json.dumps(body)
+                else:
+                    cache_key = (stream_key, message.get("seq"), None)
+                    if cache_key not in encoded:
+                        encoded[cache_key] = json.dumps(message)
+                subscriber.sent_interims[stream_key] = text
+                if await self.publish_text([subscriber], encoded[cache_key], kind="interim"):
+                    interim_updates.inc(outcome="sent")
+                else:
+                    break
+
+    async def _interim_loop(self):
+        try:
+            while True:
+                await self._interim_ready.wait()
+                # Let the tick's worth of hypotheses collapse into one update
+                await asyncio.sleep(INTERIM_TICK_SECONDS)
+                self._interim_ready.clear()
+                await self.flush_interims()
+        except asyncio.CancelledError:
+            pass
+
+    def start(self):
+        """Start the single keepalive and interim flush loops for all consoles"""
+        if self._keepalive_task is None:
+            self._keepalive_task = asyncio.create_task(self._keepalive_loop())
+        if self._interim_task is None:
+            self._interim_task = asyncio.create_task(self._interim_loop())
+
+    def stop(self):
+        for task in (self._keepalive_task, self._interim_task):
+            if task:
+                task.cancel()
+        self._keepalive_task = None
+        self._interim_task = None
+
+    async def _keepalive_loop(self):
+        try:
+            while True:
+                await asyncio.sleep(KEEPALIVE_INTERVAL)
+                if self._subscribers:
+                    text = json.dumps({"type": "keepalive", "timestamp": datetime.now().isoformat()})
+                    await self.publish_text(self._subscribers, text, kind="keepalive")
+        except asyncio.CancelledError:
+            pass
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": len(self._subscribers),
+            "max_backlog": max((s.queue.qsize() for s in self._subscribers), default=0),
+            "resyncs": sum(s.resyncs for s in self._subscribers),
+            "topics": {topic: len(members) for topic, members in self._index.items()},
+        }
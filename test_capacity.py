@@ -0,0 +1,27 @@
+import capacity
+from capacity import CapacityManager
+
+
+def make_manager():
+    return CapacityManager(active_calls=lambda: 0, outbound_depth=lambda: 0)
+
+
+def test_single_slow_sample_does_not_overload():
+    manager = make_manager()
+    manager.record_provider_latency("tts", 10.0)
+    assert manager.overload_reasons() == []
+
+
+def test_overloaded_node_recovers_after_window(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(capacity.time, "monotonic", lambda: now[0])
+    manager = make_manager()
+    for _ in range(capacity.PROVIDER_LATENCY_MIN_SAMPLES):
+        manager.record_provider_latency("translation", capacity.MAX_PROVIDER_LATENCY_MS / 1000 * 2)
+    assert manager.overload_reasons() == ["provider_latency:translation"]
+    assert manager.decide().admit is False
+
+    # No new samples arrive while calls go to overflow; the old ones age out
+    now[0] += capacity.PROVIDER_LATENCY_WINDOW_SECONDS + 1
+    assert manager.overload_reasons() == []
+    assert manager.decide().admit is True
@@ -0,0 +1,303 @@
+"""
+Per-Call Tracing
+Lightweight spans keyed on call_sid and utterance id. The current span lives in
+a contextvar, so tasks spawned inside a span (call.spawn / create_task) inherit
+it; stages that finish on another task (outbound queue, Twilio playout) are
+recorded after the fact against the utterance's root span. Finished spans are
+batched on a background thread to a JSONL file or an OTLP/HTTP collector
+"""
+import asyncio
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Dict, List, Optional
+
+from logging_setup import current_call_sid
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+TRACE_QUEUE_SIZE = 10000
+TRACE_BATCH_SIZE = 512
+TRACE_FLUSH_SECONDS = 1.0
+SERVICE_NAME = "voice-transcription-server"
+
+# Attributes a child span copies from its parent so every stage can be filtered by call / utterance
+INHERITED_ATTRIBUTES = ("call_sid", "utterance_id")
+
+current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("span", default=None)
+
+trace_spans_dropped = registry.counter("trace_spans_dropped_total", "Finished spans dropped because the export queue was full")
+trace_export_errors = registry.counter("trace_export_errors_total", "Span batches the exporter failed to write")
+
+_processor: Optional["BatchSpanProcessor"] = None
+
+
+def _new_id(nbytes: int) -> str:
+    return os.urandom(nbytes).hex()
+
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start_ns", "end_ns", "attributes", "status", "_token")
+
+    def __init__(self, name: str, parent: Optional["Span"] = None, attributes: Optional[dict] = None,
+                 start_ns: Optional[int] = None):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else _new_id(16)
+        self.span_id = _new_id(8)
+        self.parent_id = parent.span_id if parent else None
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes: Dict[str, object] = {}
+        if parent:
+            for key in INHERITED_ATTRIBUTES:
+                if key in parent.attributes:
+                    self.attributes[key] = parent.attributes[key]
+        else:
+            call_sid = current_call_sid.get()
+            if call_sid != "-":
+                self.attributes["call_sid"] = call_sid
+        if attributes:
+            self.attributes.update(attributes)
+        self.status = "ok"
+        self._token = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def fail(self, error: Optional[str] = None):
+        """Mark a stage failed without raising (e.g. a provider fallback)"""
+        self.status = "error"
+        if error:
+            self.attributes["error"] = error
+
+    def end(self, end_ns: Optional[int] = None):
+        if self.end_ns is None:
+            self.end_ns = end_ns or time.time_ns()
+            _export(self)
+
+    def __enter__(self) -> "Span":
+        self._token = current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            if issubclass(exc_type, asyncio.CancelledError):
+                self.status = "cancelled"
+            else:
+                self.status = "error"
+                self.attributes["error"] = f"{exc_type.__name__}: {exc}"
+        current_span.reset(self._token)
+        self.end()
+        return False
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 2),
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+class _NoopSpan:
+    """Returned while tracing is disabled so instrumented code costs next to nothing"""
+
+    __slots__ = ()
+    trace_id = span_id = None
+    attributes: dict = {}
+
+    def set(self, **attributes):
+        pass
+
+    def fail(self, error: Optional[str] = None):
+        pass
+
+    def end(self, end_ns: Optional[int] = None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def span(name: str, **attributes):
+    """Child of the current span (or a new trace if there is none): `with span("translate", ...) as s:`"""
+    if _processor is None:
+        return NOOP_SPAN
+    return Span(name, current_span.get(), attributes)
+
+
+def start_trace(name: str, start_ns: Optional[int] = None, **attributes):
+    """Root span of a new trace, e.g. one dispatcher turn (optionally backdated to when it really began)"""
+    if _processor is None:
+        return NOOP_SPAN
+    return Span(name, None, attributes, start_ns=start_ns)
+
+
+def record_span(name: str, parent, start_ns: int, end_ns: Optional[int] = None, status: str = "ok", **attributes):
+    """Record a stage measured outside a `with` block (e.g. queue wait ending on another task)"""
+    if _processor is None or not isinstance(parent, Span):
+        return
+    finished = Span(name, parent, attributes, start_ns=start_ns)
+    finished.status = status
+    finished.end(end_ns)
+
+
+def _export(finished: Span):
+    processor = _processor
+    if processor is not None:
+        processor.submit(finished)
+
+
+class JsonlSpanExporter:
+    """One JSON span per line, appended to a local file (jq / pandas friendly)"""
+
+    def __init__(self, path: str = "traces.jsonl"):
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8")
+
+    def export(self, spans: List[Span]):
+        self._file.write("".join(json.dumps(s.to_dict(), default=str) + "\n" for s in spans))
+        self._file.flush()
+
+    def shutdown(self):
+        self._file.close()
+
+
+class OtlpHttpSpanExporter:
+    """OTLP/HTTP JSON to a collector (or any stand-in that accepts POST /v1/traces)"""
+
+    def __init__(self, endpoint: str = "http://localhost:4318", timeout: float = 5.0):
+        self.url = endpoint.rstrip("/") + "/v1/traces"
+        self.timeout = timeout
+
+    @staticmethod
+    def _attributes(attributes: dict) -> List[dict]:
+        encoded = []
+        for key, value in attributes.items():
+            if isinstance(value, bool):
+                encoded.append({"key": key, "value": {"boolValue": value}})
+            elif isinstance(value, int):
+                encoded.append({"key": key, "value": {"intValue": str(value)}})
+            elif isinstance(value, float):
+                encoded.append({"key": key, "value": {"doubleValue": value}})
+            else:
+                encoded.append({"key": key, "value": {"stringValue": str(value)}})
+        return encoded
+
+    def to_otlp(self, spans: List[Span]) -> dict:
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": self._attributes({"service.name": SERVICE_NAME})},
+                "scopeSpans": [{
+                    "scope": {"name": __name__},
+                    "spans": [{
+                        "traceId": s.trace_id,
+                        "spanId": s.span_id,
+                        "parentSpanId": s.parent_id or "",
+                        "name": s.name,
+                        "kind": 1,
+                        "startTimeUnixNano": str(s.start_ns),
+                        "endTimeUnixNano": str(s.end_ns),
+                        "attributes": self._attributes(s.attributes),
+                        "status": {"code": 2 if s.status == "error" else 1},
+                    } for s in spans],
+                }],
+            }]
+        }
+
+    def export(self, spans: List[Span]):
+        import requests
+        response = requests.post(self.url, json=self.to_otlp(spans), timeout=self.timeout)
+        response.raise_for_status()
+
+    def shutdown(self):
+        pass
+
+
+class BatchSpanProcessor:
+    """Bounded queue of finished spans drained by a background thread (never blocks the event loop)"""
+
+    def __init__(self, exporter):
+        self.exporter = exporter
+        self._queue: queue.Queue = queue.Queue(maxsize=TRACE_QUEUE_SIZE)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+        self._thread.start()
+
+    def submit(self, finished: Span):
+        try:
+            self._queue.put_nowait(finished)
+        except queue.Full:
+            trace_spans_dropped.inc()
+
+    def _drain(self) -> List[Span]:
+        batch = []
+        while len(batch) < TRACE_BATCH_SIZE:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _flush(self):
+        batch = self._drain()
+        while batch:
+            try:
+                self.exporter.export(batch)
+            except Exception as e:
+                trace_export_errors.inc()
+                logger.warning(f"⚠️ Span export failed ({len(batch)} spans): {e}")
+            batch = self._drain()
+
+    def _run(self):
+        while not self._stopped.wait(TRACE_FLUSH_SECONDS):
+            self._flush()
+        self._flush()
+
+    def shutdown(self):
+        self._stopped.set()
+        self._thread.join(timeout=5)
+        self.exporter.shutdown()
+
+
+def configure_tracing(exporter: str = "none", trace_file: str = "traces.jsonl",
+                      otlp_endpoint: str = "http://localhost:4318") -> bool:
+    """Enable span export ("jsonl" or "otlp"); "none" keeps instrumentation as no-ops (idempotent)"""
+    global _processor
+    if _processor is not None:
+        return True
+    exporter = (exporter or "none").lower()
+    if exporter == "jsonl":
+        _processor = BatchSpanProcessor(JsonlSpanExporter(trace_file))
+    elif exporter == "otlp":
+        _processor = BatchSpanProcessor(OtlpHttpSpanExporter(otlp_endpoint))
+    else:
+        return False
+    atexit.register(stop_tracing)
+    logger.info(f"🧭 Tracing enabled ({exporter})")
+    return True
+
+
+def stop_tracing():
+    """Export buffered spans and stop the exporter thread"""
+    global _processor
+    if _processor is not None:
+        processor, _processor = _processor, None
+        processor.shutdown()
@@ -1,9 +1,9 @@
-import json
-import random
 import os
 from google import genai
 from dotenv import load_dotenv
 
+from scenario_store import ScenarioStore, SCENARIO_SOURCE
+
 load_dotenv()
 # Initialize Gemini client
 # Make sure you have set your API key first:
@@ -13,17 +13,6 @@ if not api_key:
 client = genai.Client()
 
 
-def load_scenarios(file_path="911_calls.json"):
-    """Load 911 dataset from JSON file."""
-    with open(file_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    return data
-
-def select_random_scenario(scenarios):
-    """Select a random call scenario from dataset."""
-    scenario = random.choice(scenarios)
-    return scenario
-
 def start_training_session(scenario):
     """Initialize chat model for simulated emergency call."""
     title = scenario.get("title", "Unknown Emergency")
@@ -72,9 +61,9 @@ Provide:
         print("\nCaller:", response.text)
 
 def main():
-    scenarios = load_scenarios("911_calls.json")
-    selected = select_random_scenario(scenarios)
-    start_training_session(selected)
+    # Same scenario store (and uniform sampling) as the server's training endpoints
+    store = ScenarioStore.ensure(SCENARIO_SOURCE)
+    start_training_session(store.sample(1)[0])
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,164 @@
+"""
+Training Chat Client
+Dispatcher-training conversations on Gemini's async API (client.aio), so a
+classroom of trainees waiting on the LLM never blocks the event loop that
+forwards live call audio. Turns are serialized per session, bounded by a
+node-wide concurrency cap and a timeout
+"""
+import asyncio
+import logging
+import time
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from config import config
+from metrics import registry
+from prompts import TRAINING_CALLER_PROMPT, TRAINING_GRADING_PROMPT
+
+logger = logging.getLogger(__name__)
+
+TRAINING_MODEL = config.get("TRAINING_MODEL", "gemini-2.5-flash")
+TRAINING_MAX_CONCURRENT = int(config.get("TRAINING_MAX_CONCURRENT", "8"))
+TRAINING_TIMEOUT_SECONDS = float(config.get("TRAINING_TIMEOUT_SECONDS", "30"))
+
+training_llm_seconds = registry.histogram(
+    "training_llm_seconds", "Training LLM turn latency including queueing for a slot",
+    buckets=(0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0, 60.0),
+)
+training_llm_in_flight = registry.gauge("training_llm_in_flight", "Training LLM requests in flight")
+training_llm_first_token_seconds = registry.histogram(
+    "training_llm_first_token_seconds", "Time to the first streamed token of a training turn",
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0),
+)
+training_llm_timeouts = registry.counter("training_llm_timeouts_total", "Training LLM turns that hit the timeout")
+
+
+class TrainingTimeout(Exception):
+    """The model did not answer within TRAINING_TIMEOUT_SECONDS (including time queued for a slot)"""
+
+
+def caller_prompt(scenario: dict) -> str:
+    return TRAINING_CALLER_PROMPT.format(
+        title=scenario.get("title", "Unknown Emergency"),
+        desc=scenario.get("desc", "No description"),
+        location=scenario.get("twp", "Unknown Location"),
+    )
+
+
+class StreamedTurn:
+    """
+    One streamed model turn: `async for text in turn` yields chunks as they are
+    generated. The concurrency slot is held until the stream ends or is closed;
+    the timeout applies to the whole turn. text / ttft_ms / total_ms fill in as it runs
+    """
+
+    def __init__(self, llm: "TrainingLLM", chat, message: str, kind: str):
+        self.llm = llm
+        self.chat = chat
+        self.message = message
+        self.kind = kind
+        self.text = ""
+        self.ttft_ms: Optional[float] = None
+        self.total_ms: Optional[float] = None
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        started = time.perf_counter()
+        deadline = started + self.llm.timeout
+        try:
+            await asyncio.wait_for(self.llm._slots.acquire(), self.llm.timeout)
+            training_llm_in_flight.inc()
+            try:
+                stream = await asyncio.wait_for(self.chat.send_message_stream(self.message), deadline - time.perf_counter())
+                chunks = aiter(stream)
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(anext(chunks), deadline - time.perf_counter())
+                    except StopAsyncIteration:
+                        break
+                    text = chunk.text or ""
+                    if not text:
+                        continue
+                    if self.ttft_ms is None:
+                        self.ttft_ms = round((time.perf_counter() - started) * 1000, 1)
+                        training_llm_first_token_seconds.observe(self.ttft_ms / 1000, kind=self.kind)
+                    self.text += text
+                    yield text
+            finally:
+                training_llm_in_flight.dec()
+                self.llm._slots.release()
+        except TimeoutError:
+            training_llm_timeouts.inc(kind=self.kind)
+            raise TrainingTimeout(f"no complete {self.kind} response within {self.llm.timeout:g}s")
+        finally:
+            self.total_ms = round((time.perf_counter() - started) * 1000, 1)
+            training_llm_seconds.observe(self.total_ms / 1000, kind=self.kind)
+
+
+class TrainingLLM:
+    def __init__(self, client, model: str = TRAINING_MODEL, max_concurrent: int = TRAINING_MAX_CONCURRENT,
+                 timeout: float = TRAINING_TIMEOUT_SECONDS):
+        self.client = client
+        self.model = model
+        self.timeout = timeout
+        self.max_concurrent = max_concurrent
+        self._slots = asyncio.Semaphore(max_concurrent)
+
+    async def _send(self, chat, message: str, kind: str) -> str:
+        started = time.perf_counter()
+        try:
+            async with asyncio.timeout(self.timeout):
+                async with self._slots:
+                    training_llm_in_flight.inc()
+                    try:
+                        response = await chat.send_message(message)
+                    finally:
+                        training_llm_in_flight.dec()
+        except TimeoutError:
+            training_llm_timeouts.inc(kind=kind)
+            raise TrainingTimeout(f"no {kind} response within {self.timeout:g}s")
+        finally:
+            training_llm_seconds.observe(time.perf_counter() - started, kind=kind)
+        return response.text
+
+    def new_chat(self, history: Optional[List[Dict[str, str]]] = None):
+        """Chat session, optionally resumed from [{"role": "user"|"model", "text": ...}] turns"""
+        if not history:
+            return self.client.aio.chats.create(model=self.model)
+        from google.genai import types
+        contents = [types.Content(role=turn["role"], parts=[types.Part(text=turn["text"])]) for turn in history]
+        return self.client.aio.chats.create(model=self.model, history=contents)
+
+    @property
+    def busy(self) -> bool:
+        """At least half the concurrency slots are taken (background work should wait)"""
+        return training_llm_in_flight.get() * 2 >= self.max_concurrent
+
+    async def start(self, scenario: dict) -> Tuple[object, str]:
+        """New caller-role chat for the scenario; returns (chat, opening line)"""
+        chat = self.new_chat()
+        opening = await self._send(chat, caller_prompt(scenario), "start")
+        return chat, opening
+
+    async def opening(self, scenario: dict) -> Tuple[List[Dict[str, str]], str]:
+        """Opening line for the scenario and the chat history that resumes right after it"""
+        prompt = caller_prompt(scenario)
+        opening = await self._send(self.new_chat(), prompt, "pregenerate")
+        return [{"role": "user", "text": prompt}, {"role": "model", "text": opening}], opening
+
+    def stream_start(self, chat, scenario: dict) -> StreamedTurn:
+        """Streamed opening line of a new chat (see new_chat)"""
+        return StreamedTurn(self, chat, caller_prompt(scenario), "start")
+
+    def stream_reply(self, chat, message: str) -> StreamedTurn:
+        """Streamed caller answer to a dispatcher message"""
+        return StreamedTurn(self, chat, message, "message")
+
+    async def reply(self, chat, message: str) -> str:
+        """Caller's answer to a dispatcher message"""
+        return await self._send(chat, message, "message")
+
+    async def grade(self, chat) -> str:
+        """Evaluation of the dispatcher's side of the conversation"""
+        return await self._send(chat, TRAINING_GRADING_PROMPT, "grade")
+
+    def stats(self) -> dict:
+        return {"in_flight": int(training_llm_in_flight.get()), "max_concurrent": self.max_concurrent, "timeout_seconds": self.timeout}
@@ -0,0 +1,152 @@
+"""
+Streaming Voice Activity Detection
+Energy / zero-crossing gate in front of the Deepgram upstream: speech (plus
+pre-roll and hangover padding) is forwarded, silence is dropped, and the
+sent-stream -> call-time offsets are kept so transcript timestamps stay correct
+"""
+import audioop
+import bisect
+from collections import deque
+from typing import Deque, List, Tuple
+
+from config import config
+from metrics import registry
+
+VAD_ENABLED = config.get("VAD_ENABLED", "true").lower() == "true"
+VAD_FRAME_MS = 20
+VAD_MIN_RMS = float(config.get("VAD_MIN_RMS", "250"))  # Absolute floor (PCM16 RMS)
+VAD_NOISE_RATIO = float(config.get("VAD_NOISE_RATIO", "2.5"))  # Speech = this much above the noise floor
+VAD_HANGOVER_MS = int(config.get("VAD_HANGOVER_MS", "400"))  # Keep sending after speech (lets endpointing fire)
+VAD_PREROLL_MS = int(config.get("VAD_PREROLL_MS", "200"))  # Audio sent from before the onset
+
+# Zero crossings per second typical of unvoiced speech (s, f, sh) that is too quiet for the energy test
+FRICATIVE_ZCR = (2500, 6000)
+NOISE_FLOOR_ALPHA = 0.05
+
+vad_audio_seconds = registry.counter("vad_audio_seconds_total", "Upstream STT audio by outcome (sent/suppressed)")
+
+
+class StreamingVAD:
+    """
+    Per-leg speech gate operating on 20ms PCM16 frames.
+
+    process() returns the bytes that should go upstream for a chunk (possibly
+    empty); `segment_ended` is set when a speech segment has just closed so the
+    caller can ask the STT to finalize.
+    """
+
+    def __init__(self, sample_rate: int, leg: str = ""):
+        self.sample_rate = sample_rate
+        self.leg = leg
+        self.frame_bytes = sample_rate * VAD_FRAME_MS // 1000 * 2
+        self.frame_seconds = VAD_FRAME_MS / 1000
+        self.hangover_frames = max(1, VAD_HANGOVER_MS // VAD_FRAME_MS)
+        self.noise_floor = VAD_MIN_RMS / VAD_NOISE_RATIO
+        self.active = False
+        self.segment_ended = False
+        self.speech_run = 0  # Consecutive speech frames (for barge-in)
+        self._onset_taken = False
+        self._hangover = 0
+        self._remainder = b""
+        self._preroll: Deque[Tuple[float, bytes]] = deque(maxlen=max(0, VAD_PREROLL_MS // VAD_FRAME_MS))
+
+        # Offset bookkeeping: (sent stream seconds, call seconds) at every discontinuity
+        self._offsets: List[Tuple[float, float]] = []
+        self.received_seconds = 0.0
+        self.sent_seconds = 0.0
+        self._next_contiguous = None
+
+    def is_speech(self, frame: bytes) -> bool:
+        rms = audioop.rms(frame, 2)
+        threshold = max(VAD_MIN_RMS, self.noise_floor * VAD_NOISE_RATIO)
+        if rms >= threshold:
+            return True
+        zcr = audioop.cross(frame, 2) / self.frame_seconds
+        if rms >= threshold / 2 and FRICATIVE_ZCR[0] <= zcr <= FRICATIVE_ZCR[1]:
+            return True
+        # Only non-speech frames move the noise floor
+        self.noise_floor += NOISE_FLOOR_ALPHA * (rms - self.noise_floor)
+        return False
+
+    def process(self, pcm16: bytes) -> bytes:
+        """Gate a chunk of PCM16; returns the audio to forward upstream"""
+        self.segment_ended = False
+        data = self._remainder + pcm16
+        usable = len(data) - len(data) % self.frame_bytes
+        self._remainder = data[usable:]
+
+        out = []
+        for i in range(0, usable, self.frame_bytes):
+            frame = data[i:i + self.frame_bytes]
+            frame_start = self.received_seconds
+            self.received_seconds += self.frame_seconds
+
+            if self.is_speech(frame):
+                self.speech_run += 1
+                if not self.active:
+                    self.active = True
+                    for start, buffered in self._preroll:
+                        self._emit(out, start, buffered)
+                    self._preroll.clear()
+                self._hangover = self.hangover_frames
+                self._emit(out, frame_start, frame)
+            elif self.active and self._hangover > 0:
+                self.speech_run = 0
+                self._onset_taken = False
+                self._hangover -= 1
+                self._emit(out, frame_start, frame)
+                if self._hangover == 0:
+                    self.active = False
+                    self.segment_ended = True
+            else:
+                self.speech_run = 0
+                self._onset_taken = False
+                self._preroll.append((frame_start, frame))
+
+        sent = sum(len(frame) for frame in out)
+        suppressed = usable - sent
+        if sent:
+            vad_audio_seconds.inc(sent / 2 / self.sample_rate, leg=self.leg, outcome="sent")
+        if suppressed > 0:
+            vad_audio_seconds.inc(suppressed / 2 / self.sample_rate, leg=self.leg, outcome="suppressed")
+        return b"".join(out)
+
+    def _emit(self, out: list, frame_start: float, frame: bytes):
+        if self._next_contiguous is None or abs(frame_start - self._next_contiguous) > 1e-6:
+            self._offsets.append((self.sent_seconds, frame_start))
+        out.append(frame)
+        self.sent_seconds += self.frame_seconds
+        self._next_contiguous = frame_start + self.frame_seconds
+
+    def to_call_time(self, stream_seconds: float) -> float:
+        """Map a timestamp in the (gated) upstream stream back to seconds since the leg started"""
+        if not self._offsets:
+            return stream_seconds
+        i = bisect.bisect_right(self._offsets, (stream_seconds, float("inf"))) - 1
+        sent_at, call_at = self._offsets[max(i, 0)]
+        return call_at + (stream_seconds - sent_at)
+
+    @property
+    def speech_ms(self) -> int:
+        """Length of the current uninterrupted run of speech"""
+        return self.speech_run * VAD_FRAME_MS
+
+    def take_onset(self, min_speech_ms: int) -> bool:
+        """True once per run of speech, when it has lasted at least min_speech_ms"""
+        if self._onset_taken or self.speech_ms < min_speech_ms:
+            return False
+        self._onset_taken = True
+        return True
+
+    @property
+    def suppressed_fraction(self) -> float:
+        if self.received_seconds <= 0:
+            return 0.0
+        return max(0.0, 1 - self.sent_seconds / self.received_seconds)
+
+    def stats(self) -> dict:
+        return {
+            "received_seconds": round(self.received_seconds, 1),
+            "sent_seconds": round(self.sent_seconds, 1),
+            "suppressed_fraction": round(self.suppressed_fraction, 3),
+        }